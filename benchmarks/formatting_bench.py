@@ -0,0 +1,81 @@
+"""
+Text copy CPU cost: markdown round trip vs raw_text + formatting entities
+
+    python -m benchmarks.formatting_bench [posts]
+
+Redirected text used to be sent as message.text: Telethon renders the
+entities to markdown, then send_message parses that markdown back into
+entities. Sending message.raw_text with formatting_entities=message.entities
+skips both steps. This times the two paths on long formatted posts; no
+network calls are made.
+"""
+
+import random
+import sys
+import time
+from telethon import types
+from telethon.extensions import markdown
+
+ENTITY_TYPES = [
+    types.MessageEntityBold,
+    types.MessageEntityItalic,
+    types.MessageEntityCode,
+    types.MessageEntityUnderline,
+    types.MessageEntityStrike,
+]
+
+
+def make_post(words=600, formatted_every=4):
+    """A long channel post with every few words formatted and a few links"""
+    vocabulary = ["signal", "market", "update", "target", "entry", "stop", "profit", "analysis", "volume", "trend"]
+    parts, entities, offset = [], [], 0
+    for i in range(words):
+        word = random.choice(vocabulary)
+        if i % formatted_every == 0:
+            if i % (formatted_every * 10) == 0:
+                entities.append(types.MessageEntityTextUrl(offset, len(word), f"https://example.com/{i}"))
+            else:
+                entities.append(random.choice(ENTITY_TYPES)(offset, len(word)))
+        parts.append(word)
+        offset += len(word) + 1
+    return " ".join(parts), entities
+
+
+def markdown_round_trip(raw_text, entities):
+    """What send_message(dest, message.text) costs: unparse for .text, parse on send"""
+    text = markdown.unparse(raw_text, entities)
+    return markdown.parse(text)
+
+
+def raw_with_entities(raw_text, entities):
+    """What send_message(dest, message.raw_text, formatting_entities=entities) costs"""
+    return raw_text, list(entities)
+
+
+def _time(path, posts):
+    started = time.perf_counter()
+    for raw_text, entities in posts:
+        path(raw_text, entities)
+    return time.perf_counter() - started
+
+
+def main(count=500):
+    posts = [make_post() for _ in range(count)]
+    chars = sum(len(raw_text) for raw_text, _ in posts) / count
+    entities = sum(len(post_entities) for _, post_entities in posts) / count
+
+    round_trip = _time(markdown_round_trip, posts)
+    raw = _time(raw_with_entities, posts)
+
+    # The round trip must not be lossy on these posts for the comparison to be fair
+    mismatches = sum(1 for raw_text, post_entities in posts if markdown_round_trip(raw_text, post_entities)[0] != raw_text)
+
+    print(f"{count} posts, {chars:.0f} chars and {entities:.0f} entities each ({mismatches} altered by the round trip)")
+    print(f"{'':22}{'us/message':>12}")
+    print(f"{'markdown round trip':22}{round_trip / count * 1e6:>12.1f}")
+    print(f"{'raw_text + entities':22}{raw / count * 1e6:>12.1f}")
+    print(f"saved per message: {(round_trip - raw) / count * 1e6:.1f} us")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
@@ -0,0 +1,77 @@
+"""
+Message mapping memory/speed: formatted-string dict vs PairMap
+
+    python -m benchmarks.message_map_bench [entries]
+
+Compares the original f"{user_id}_{chat_id}_{msg_id}_{dest_id}" -> id dict
+with the array('q') columns used by the message map hot tier, for one busy
+source -> destination pair.
+"""
+
+import random
+import sys
+import time
+import tracemalloc
+from bot.storage.message_map import PairMap
+
+USER_ID = 1190237801
+SOURCE_CHAT = -1001234567890
+DEST_CHAT = -1009876543210
+
+
+def _measure(build):
+    tracemalloc.start()
+    started = time.perf_counter()
+    container = build()
+    elapsed = time.perf_counter() - started
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return container, size, elapsed
+
+
+def build_dict(entries):
+    mapping = {}
+    for msg_id in range(1, entries + 1):
+        mapping[f"{USER_ID}_{SOURCE_CHAT}_{msg_id}_{DEST_CHAT}"] = msg_id + 500000
+    return mapping
+
+
+def build_pair_map(entries):
+    pair = PairMap()
+    now = int(time.time())
+    for msg_id in range(1, entries + 1):
+        pair.set(msg_id, msg_id + 500000, now)
+    return pair
+
+
+def lookup_dict(mapping, ids):
+    started = time.perf_counter()
+    for msg_id in ids:
+        mapping.get(f"{USER_ID}_{SOURCE_CHAT}_{msg_id}_{DEST_CHAT}")
+    return time.perf_counter() - started
+
+
+def lookup_pair_map(pair, ids):
+    started = time.perf_counter()
+    for msg_id in ids:
+        pair.get(msg_id)
+    return time.perf_counter() - started
+
+
+def main(entries=200000):
+    ids = [random.randint(1, entries) for _ in range(100000)]
+
+    mapping, dict_bytes, dict_build = _measure(lambda: build_dict(entries))
+    pair, pair_bytes, pair_build = _measure(lambda: build_pair_map(entries))
+    dict_lookup = lookup_dict(mapping, ids)
+    pair_lookup = lookup_pair_map(pair, ids)
+
+    print(f"{entries} mappings, {len(ids)} random lookups")
+    print(f"{'':10}{'bytes/entry':>14}{'build (s)':>12}{'lookup (us)':>14}")
+    print(f"{'dict':10}{dict_bytes / entries:>14.1f}{dict_build:>12.3f}{dict_lookup / len(ids) * 1e6:>14.2f}")
+    print(f"{'PairMap':10}{pair_bytes / entries:>14.1f}{pair_build:>12.3f}{pair_lookup / len(ids) * 1e6:>14.2f}")
+    print(f"memory ratio: {dict_bytes / pair_bytes:.1f}x")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
@@ -160,9 +160,9 @@ async def handle_generate_license(event, client):
 async def handle_list_users(event, client):
     """List registered users"""
     try:
-        from bot.database import load_data
+        from bot.database import export_data
         
-        data = load_data()
+        data = await export_data()
         licenses = data.get("licenses", {})
         connections = data.get("connections", {})
         
@@ -200,9 +200,9 @@ async def handle_list_users(event, client):
 async def handle_stats(event, client):
     """Show bot statistics"""
     try:
-        from bot.database import load_data
+        from bot.database import export_data
         
-        data = load_data()
+        data = await export_data()
         
         total_licenses = len(data.get("licenses", {}))
         active_licenses = sum(1 for license_data in data.get("licenses", {}).values() 
@@ -210,6 +210,19 @@ async def handle_stats(event, client):
         total_connections = len(data.get("connections", {}))
         total_redirections = sum(len(redirections) for redirections in data.get("redirections", {}).values())
         
+        from bot.send_queue import send_queues
+        from bot.scheduler import scheduler_stats
+        from bot.dispatcher import subscriptions
+        from bot.poller import pollers
+        from bot.lanes import lanes
+        from bot.outbox import outbox
+        queues = send_queues.stats()
+        schedulers = scheduler_stats()
+        sources = subscriptions.stats()
+        polling = pollers.stats()
+        ordering = lanes.stats()
+        in_flight = outbox.stats()
+        
         stats_message = f"""
 📊 **STATISTIQUES DU BOT**
 
@@ -223,6 +236,19 @@ async def handle_stats(event, client):
 • Transformations : {len(data.get("transformations", {}))}
 • Listes blanches : {len(data.get("whitelists", {}))}
 • Listes noires : {len(data.get("blacklists", {}))}
+• Canaux sources écoutés : {sources['sources']} (dont {sources['shared_sources']} partagés, {sources['skipped_listeners']} écoutes évitées)
+• Sources interrogées (polling) : {sum(p['sources'] for p in polling)} ({sum(p['recovered'] for p in polling)} messages rattrapés)
+
+📤 **Files d'envoi :**
+• Destinations : {len(queues)}
+• Messages en attente : {sum(q['depth'] for q in queues)}
+• Attente max : {max((q['max_wait'] for q in queues), default=0):.1f}s
+• FloodWaits : {sum(q['flood_waits'] for q in queues)}
+• Destinations en pause : {sum(1 for q in queues if q['paused_for'] > 0)}
+• Messages en attente d'ordre : {ordering['waiting']} ({ordering['lanes']} redirections)
+• Envois en cours (outbox) : {in_flight['pending']}
+• Appels API en attente : {sum(sum(sc['waiting'].values()) for sc in schedulers)}
+• Comptes en pause (FloodWait) : {sum(1 for sc in schedulers if sc['paused_for'])}
 
 🚀 **Statut :** Bot opérationnel
         """
@@ -236,10 +262,10 @@ async def handle_stats(event, client):
 async def handle_sessions(event, client):
     """Show active sessions and redirections"""
     try:
-        from bot.database import load_data
+        from bot.database import export_data
         from bot.connection import active_connections
         
-        data = load_data()
+        data = await export_data()
         connections = data.get("connections", {})
         redirections = data.get("redirections", {})
         
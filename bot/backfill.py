@@ -0,0 +1,272 @@
+"""
+Bulk backfill of a redirection's source history
+
+/redirection backfill NAME on PHONE [N|since DATE] copies the history of a
+redirection's source to its destination with the user's client, as a
+background job:
+
+- history is read 100 messages per request, oldest first, and each page is
+  forwarded with one forward_messages call (albums are never split across
+  two calls);
+- every call is admitted at BACKFILL priority, behind live redirections, and
+  goes through the destination's send queue (rate limit, FloodWait retry);
+- the cursor (last source message ID handled) is persisted in
+  backfill_jobs.json after each batch, so a paused, interrupted or crashed
+  job resumes where it stopped;
+- copies are recorded in the message map, so edits and deletions in the
+  source propagate to backfilled messages too;
+- messages that already have a copy in the destination (redirected live,
+  or by an earlier backfill) are skipped, so backfilling an active
+  redirection never duplicates them or takes over their mappings.
+
+Jobs report progress, throughput and ETA, and can be paused, resumed or
+cancelled.
+"""
+
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from telethon import types
+from config.settings import BACKFILL_FILE, DATA_FLUSH_DELAY
+from bot.connection import active_connections
+from bot.scheduler import Priority, schedule
+from bot.send_queue import send_queues
+from bot.storage import get_json_store, get_message_map
+
+logger = logging.getLogger(__name__)
+
+# Messages per history request and per forward_messages call (Telegram's maximum)
+BATCH_SIZE = 100
+# Seconds between progress messages to the user
+PROGRESS_INTERVAL = 60
+
+RUNNING, PAUSED, CANCELLED, DONE, FAILED = "running", "paused", "cancelled", "done", "failed"
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds}s"
+    if seconds < 3600:
+        return f"{seconds // 60}min {seconds % 60:02d}s"
+    return f"{seconds // 3600}h {seconds % 3600 // 60:02d}min"
+
+
+class BackfillJobs:
+    """Backfill jobs per (user_id, redirection name), persisted as JSON"""
+
+    def __init__(self, path, flush_delay=1.0):
+        self.store = get_json_store(path, dict, flush_delay)
+        self.notifier = None  # Bot client used to report progress
+        self._tasks = {}  # key -> asyncio.Task
+
+    @staticmethod
+    def _key(user_id, name):
+        return f"{int(user_id)}:{name}"
+
+    def get(self, user_id, name):
+        job = self.store.data.get(self._key(user_id, name))
+        return dict(job) if job else None
+
+    def _update(self, key, **fields):
+        with self.store.lock:
+            self.store.data[key].update(fields)
+        self.store.mark_dirty()
+
+    def is_running(self, user_id, name):
+        task = self._tasks.get(self._key(user_id, name))
+        return task is not None and not task.done()
+
+    def start(self, notifier, user_id, name, phone, source_id, destination_id, chat_id, count=None, since=None):
+        """Create and start a job; return False if one is already running for the redirection"""
+        if self.is_running(user_id, name):
+            return False
+        key = self._key(user_id, name)
+        with self.store.lock:
+            self.store.data[key] = {
+                'user_id': int(user_id),
+                'name': name,
+                'phone': phone,
+                'source_id': int(source_id),
+                'destination_id': int(destination_id),
+                'chat_id': chat_id,  # Where progress is reported
+                'count': count,
+                'since': since.timestamp() if since else None,
+                'state': RUNNING,
+                'cursor': None,  # Last source message ID handled; None until the range is known
+                'end_id': None,
+                'total': None,
+                'done': 0,
+                'rate': 0.0,
+                'error': None,
+                'created_at': time.time(),
+                'updated_at': time.time(),
+            }
+        self.store.mark_dirty()
+        self.notifier = notifier
+        self._spawn(key)
+        return True
+
+    def pause(self, user_id, name):
+        return self._set_state(user_id, name, PAUSED, (RUNNING,))
+
+    def cancel(self, user_id, name):
+        return self._set_state(user_id, name, CANCELLED, (RUNNING, PAUSED, FAILED))
+
+    def resume(self, notifier, user_id, name):
+        """Resume a paused or failed job; return False if there is nothing to resume"""
+        if self.is_running(user_id, name) or not self._set_state(user_id, name, RUNNING, (PAUSED, FAILED, RUNNING)):
+            return False
+        self.notifier = notifier
+        self._spawn(self._key(user_id, name))
+        return True
+
+    def resume_all(self, notifier):
+        """Restart the jobs that were running when the process stopped"""
+        self.notifier = notifier
+        for key, job in list(self.store.data.items()):
+            if job['state'] == RUNNING and key not in self._tasks:
+                logger.info(f"Resuming backfill {job['name']} for user {job['user_id']} at message {job['cursor']}")
+                self._spawn(key)
+
+    def _set_state(self, user_id, name, state, allowed):
+        key = self._key(user_id, name)
+        job = self.store.data.get(key)
+        if not job or job['state'] not in allowed:
+            return False
+        self._update(key, state=state, updated_at=time.time())
+        return True
+
+    def _spawn(self, key):
+        task = asyncio.ensure_future(self._run(key))
+        self._tasks[key] = task
+
+        def forget(done):
+            if self._tasks.get(key) is done:
+                del self._tasks[key]
+        task.add_done_callback(forget)
+
+    @staticmethod
+    def describe(job):
+        """Progress, throughput and ETA of a job, for status messages"""
+        done, total, rate = job['done'], job['total'], job['rate']
+        lines = [f"📊 **Progression :** {done}" + (f" / ~{total} ({min(100, done * 100 // max(total, 1))}%)" if total else "")]
+        if rate:
+            lines.append(f"⚡ **Débit :** {rate:.1f} messages/s")
+            if total and job['state'] == RUNNING:
+                lines.append(f"⏳ **Temps restant estimé :** {format_duration(max(0, total - done) / rate)}")
+        return "\n".join(lines)
+
+    async def _notify(self, job, text):
+        if not self.notifier or not job.get('chat_id'):
+            return
+        try:
+            await self.notifier.send_message(job['chat_id'], text)
+        except Exception as e:
+            logger.warning(f"Cannot report backfill progress to {job['chat_id']}: {e}")
+
+    async def _start_cursor(self, client, job):
+        """Source message ID after which copying starts, and the last ID to copy"""
+        source_id = job['source_id']
+        latest = await schedule(client, Priority.BACKFILL, lambda: client.get_messages(source_id, limit=1))
+        end_id = latest[0].id if latest else 0
+        if job['count']:
+            # The message just before the N most recent ones
+            older = await schedule(client, Priority.BACKFILL, lambda: client.get_messages(
+                source_id, limit=1, add_offset=job['count']
+            ))
+            return (older[0].id if older else 0), end_id
+        if job['since']:
+            # Latest message posted before the date
+            older = await schedule(client, Priority.BACKFILL, lambda: client.get_messages(
+                source_id, limit=1, offset_date=datetime.fromtimestamp(job['since'], timezone.utc)
+            ))
+            return (older[0].id if older else 0), end_id
+        return 0, end_id
+
+    async def _run(self, key):
+        job = self.store.data[key]
+        user_id, source_id, destination_id = job['user_id'], job['source_id'], job['destination_id']
+        client = active_connections.get(user_id, {}).get('client')
+        if not client or not client.is_connected():
+            self._update(key, state=PAUSED, error="session", updated_at=time.time())
+            await self._notify(job, f"⏸️ **Backfill {job['name']} en pause :** le compte {job['phone']} n'est pas connecté.\n"
+                                    f"Reprenez avec `/redirection backfill {job['name']} on {job['phone']} resume`.")
+            return
+
+        message_map = get_message_map()
+        try:
+            if job['cursor'] is None:
+                cursor, end_id = await self._start_cursor(client, job)
+                count = job['count']
+                self._update(key, cursor=cursor, end_id=end_id, total=min(count, end_id - cursor) if count else end_id - cursor)
+                await self._notify(job, f"🚀 **Backfill {job['name']} démarré**\n\n📥 ~{job['total']} messages à copier.")
+
+            run_started, run_done = time.monotonic(), job['done']
+            last_report = run_started
+            while job['state'] == RUNNING and job['cursor'] < job['end_id']:
+                cursor, end_id = job['cursor'], job['end_id']
+                page = await schedule(client, Priority.BACKFILL, lambda: client.get_messages(
+                    source_id, limit=BATCH_SIZE, offset_id=cursor, reverse=True
+                ))
+                page = [message for message in page if message.id <= end_id]
+                if not page:
+                    self._update(key, cursor=end_id)
+                    break
+
+                messages = [message for message in page if isinstance(message, types.Message)]
+                next_cursor = page[-1].id
+                # Keep an album that may continue on the next page for the next batch
+                if len(page) == BATCH_SIZE and messages and messages[-1].grouped_id:
+                    trailing = [message for message in messages if message.grouped_id == messages[-1].grouped_id]
+                    if len(trailing) < len(messages):
+                        messages = messages[:-len(trailing)]
+                        next_cursor = trailing[0].id - 1
+
+                # Messages the live redirection already copied keep their copy (and its mapping for edits)
+                copied = [
+                    await message_map.get(user_id, source_id, message.id, destination_id) is not None
+                    for message in messages
+                ]
+                skipped = sum(copied)
+                messages = [message for message, is_copied in zip(messages, copied) if not is_copied]
+
+                if messages:
+                    ids = [message.id for message in messages]
+                    sent = await send_queues.submit(
+                        client, destination_id,
+                        lambda: client.forward_messages(destination_id, ids, from_peer=source_id),
+                        Priority.BACKFILL,
+                    )
+                    if not isinstance(sent, list):
+                        sent = [sent]
+                    for message_id, copy in zip(ids, sent):
+                        if copy is not None:
+                            await message_map.put(user_id, source_id, message_id, destination_id, copy.id)
+
+                done = job['done'] + len(messages) + skipped
+                elapsed = time.monotonic() - run_started
+                rate = (done - run_done) / elapsed if elapsed > 0 else 0.0
+                self._update(key, cursor=next_cursor, done=done, rate=rate, error=None, updated_at=time.time())
+
+                if time.monotonic() - last_report >= PROGRESS_INTERVAL:
+                    last_report = time.monotonic()
+                    await self._notify(job, f"🔄 **Backfill {job['name']}**\n\n{self.describe(job)}")
+
+            if job['state'] == RUNNING:
+                self._update(key, state=DONE, updated_at=time.time())
+                await self._notify(job, f"✅ **Backfill {job['name']} terminé**\n\n{self.describe(job)}")
+            elif job['state'] == PAUSED:
+                await self._notify(job, f"⏸️ **Backfill {job['name']} en pause**\n\n{self.describe(job)}")
+            elif job['state'] == CANCELLED:
+                await self._notify(job, f"🛑 **Backfill {job['name']} annulé**\n\n{self.describe(job)}")
+        except Exception as e:
+            logger.error(f"Backfill {job['name']} of user {user_id} failed at message {job['cursor']}: {e}")
+            self._update(key, state=FAILED, error=str(e), updated_at=time.time())
+            await self._notify(job, f"❌ **Backfill {job['name']} interrompu :** {e}\n"
+                                    f"Reprenez avec `/redirection backfill {job['name']} on {job['phone']} resume`.")
+
+
+# Global backfill jobs instance
+backfill_jobs = BackfillJobs(BACKFILL_FILE, DATA_FLUSH_DELAY)
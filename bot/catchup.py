@@ -0,0 +1,337 @@
+"""
+Restart catch-up of messages missed while the bot was down
+
+Every redirected source message advances a checkpoint per (account, source,
+destination): the highest source message ID already redirected. Checkpoints
+are kept in checkpoints.json, so after a restart or a reconnection each
+source's gap is fetched (newest CATCHUP_MAX_BACKLOG messages at most, in
+pages of 100) and pushed through the engine's normal redirection pipeline,
+oldest first, at BACKFILL priority: sends go through the same
+per-destination queues as live traffic and yield to it in the account
+scheduler. Messages that already have a copy in a destination are skipped,
+and the engines claim each (message, destination) in recent_deliveries
+before sending, so a live update racing the catch-up or the poller (see
+bot.poller) is not sent twice. Catch-up starts with the redirections a crash
+left pending in the outbox (see bot.outbox).
+"""
+
+import asyncio
+import logging
+from collections import OrderedDict
+from itertools import groupby
+from telethon import types
+from config.settings import CHECKPOINT_FILE, CATCHUP_MAX_BACKLOG, DATA_FLUSH_DELAY
+from bot.outbox import outbox
+from bot.scheduler import Priority, schedule
+from bot.storage import get_json_store, get_message_map
+
+logger = logging.getLogger(__name__)
+
+# Messages per history request (Telegram's maximum)
+PAGE_SIZE = 100
+
+
+class CheckpointStore:
+    """Last redirected source message ID per (scope, source, destination), persisted as JSON"""
+
+    def __init__(self, path, flush_delay=1.0):
+        self.store = get_json_store(path, dict, flush_delay)
+
+    @staticmethod
+    def _key(source_id, destination_id):
+        return f"{int(source_id)}:{int(destination_id)}"
+
+    def get(self, scope, source_id, destination_id):
+        """Last redirected message ID, or None if the pair never redirected anything"""
+        return self.store.data.get(str(scope), {}).get(self._key(source_id, destination_id))
+
+    def advance(self, scope, source_id, destination_id, message_id):
+        """Record a redirected message; checkpoints only move forward"""
+        key = self._key(source_id, destination_id)
+        with self.store.lock:
+            marks = self.store.data.setdefault(str(scope), {})
+            if marks.get(key, 0) >= message_id:
+                return
+            marks[key] = message_id
+        self.store.mark_dirty()
+
+    def forget(self, scope, source_id, destination_id):
+        with self.store.lock:
+            removed = self.store.data.get(str(scope), {}).pop(self._key(source_id, destination_id), None)
+        if removed is not None:
+            self.store.mark_dirty()
+
+
+class RecentDeliveries:
+    """Source messages being or recently redirected, so the push, catch-up and polling paths never send one twice"""
+
+    def __init__(self, size=20000):
+        self.size = size
+        self._claims = OrderedDict()  # (scope, source, message, destination) -> None
+
+    def claim(self, scope, source_id, message_id, destination_id):
+        """Return False if the message was already claimed for the destination"""
+        key = (str(scope), int(source_id), message_id, int(destination_id))
+        if key in self._claims:
+            return False
+        self._claims[key] = None
+        if len(self._claims) > self.size:
+            self._claims.popitem(last=False)
+        return True
+
+    def claimed(self, scope, source_id, message_id, destination_id):
+        return (str(scope), int(source_id), message_id, int(destination_id)) in self._claims
+
+    def release(self, scope, source_id, message_id, destination_id):
+        """Forget a claim whose send failed, so a later poll can retry it"""
+        self._claims.pop((str(scope), int(source_id), message_id, int(destination_id)), None)
+
+
+class BacklogEvent:
+    """Stands in for a NewMessage event for a message fetched from history"""
+
+    __slots__ = ("chat_id", "message")
+
+    def __init__(self, chat_id, message):
+        self.chat_id = chat_id
+        self.message = message
+
+
+async def fetch_since(client, source_id, min_id, limit, priority=Priority.BACKFILL):
+    """Messages of a source newer than min_id (the newest `limit` of them), oldest first"""
+    if await client.is_bot():
+        return await _fetch_since_by_ids(client, source_id, min_id, limit, priority)
+    messages = []
+    offset_id = 0
+    while len(messages) < limit:
+        page_size = min(PAGE_SIZE, limit - len(messages))
+        page = await schedule(client, priority, lambda: client.get_messages(
+            source_id, limit=page_size, min_id=min_id, offset_id=offset_id
+        ))
+        if not page:
+            break
+        messages.extend(page)
+        if len(page) < page_size:
+            break
+        offset_id = page[-1].id
+    messages.reverse()
+    return [message for message in messages if isinstance(message, types.Message)]
+
+
+async def _fetch_since_by_ids(client, source_id, min_id, limit, priority):
+    """Bots cannot read history: find the newest message ID, then fetch the newest `limit` IDs after min_id"""
+    head = await _latest_id_by_ids(client, source_id, priority, after=min_id)
+    if head is None:
+        return []
+    start = max(min_id + 1, head - limit + 1)
+    if start > min_id + 1:
+        logger.warning(f"{start - min_id - 1} messages of {source_id} skipped, fetching the {limit} most recent")
+    messages = []
+    for page_start in range(start, head + 1, PAGE_SIZE):
+        ids = list(range(page_start, min(page_start + PAGE_SIZE, head + 1)))
+        page = await schedule(client, priority, lambda: client.get_messages(source_id, ids=ids))
+        messages.extend(message for message in page if isinstance(message, types.Message))
+    return messages
+
+
+async def latest_message_id(client, source_id, priority=Priority.BACKGROUND):
+    """ID of the newest message of a source, or None if it cannot be found"""
+    if await client.is_bot():
+        return await _latest_id_by_ids(client, source_id, priority)
+    latest = await schedule(client, priority, lambda: client.get_messages(source_id, limit=1))
+    return latest[0].id if latest else None
+
+
+async def _latest_id_by_ids(client, source_id, priority, after=0):
+    """Bots cannot read history: probe windows of PAGE_SIZE IDs past `after`, doubling the offset, then bisect"""
+    async def probe(start):
+        ids = list(range(start, start + PAGE_SIZE))
+        page = await schedule(client, priority, lambda: client.get_messages(source_id, ids=ids))
+        return max((message.id for message in page
+                    if message is not None and not isinstance(message, types.MessageEmpty)), default=None)
+
+    start = after + 1
+    latest = await probe(start)
+    if latest is None:
+        return None
+    # Invariant: the window at `start` holds messages, the one at `end` does not
+    step = PAGE_SIZE
+    while True:
+        found = await probe(start + step)
+        if found is None:
+            end = start + step
+            break
+        start, latest = start + step, found
+        step *= 2
+    while end - start > PAGE_SIZE:
+        middle = (start + end) // 2
+        found = await probe(middle)
+        if found is None:
+            end = middle
+        else:
+            start, latest = middle, max(latest, found)
+    return latest
+
+
+async def seed_checkpoint(client, scope, source_id, destination_id):
+    """Start a new route's checkpoint at the source's newest message, so polling has a starting point
+    even if the source never delivers a push update; a no-op for routes that already have one"""
+    if checkpoints.get(scope, source_id, destination_id) is not None:
+        return
+    try:
+        latest = await latest_message_id(client, source_id)
+    except Exception as e:
+        logger.warning(f"Cannot find the newest message of {source_id} for {scope}: {e}")
+        return
+    if latest is not None:
+        checkpoints.advance(scope, source_id, destination_id, latest)
+
+
+async def redirect_backlog(scope, source_id, routes, marks, messages, on_message, on_album, priority=Priority.BACKFILL):
+    """Push fetched messages through an engine's pipeline for the routes that have not redirected them yet
+
+    marks maps destination IDs to the checkpoints taken before fetching (live
+    traffic moves the stored ones meanwhile). on_message(event, routes,
+    is_edit, priority=...) and on_album(events, routes, priority=...) are the
+    engine's dispatch callbacks. Messages are handed over PAGE_SIZE at a time
+    and queued in order, so media forwards get coalesced. Returns the number
+    of messages handed to the pipeline.
+    """
+    message_map = get_message_map()
+    batch, handed = [], 0
+    # Album parts are consecutive in history; a message without grouped_id is its own group
+    for _, group in groupby(messages, key=lambda message: message.grouped_id or -message.id):
+        group = list(group)
+        pending = []
+        for route in routes:
+            if group[-1].id <= marks.get(route['destination_id'], 0):
+                continue
+            if recent_deliveries.claimed(scope, source_id, group[0].id, route['destination_id']):
+                continue  # Being redirected live
+            if await message_map.get(scope, source_id, group[0].id, route['destination_id']) is not None:
+                continue  # Redirected live while we were fetching
+            pending.append(route)
+        if not pending:
+            continue
+
+        events = [BacklogEvent(source_id, message) for message in group]
+        if len(events) > 1 and on_album:
+            batch.append(on_album(events, pending, priority=priority))
+        else:
+            batch.extend(on_message(event, pending, False, priority=priority) for event in events)
+        handed += len(events)
+        if len(batch) >= PAGE_SIZE:
+            await asyncio.gather(*batch)
+            batch = []
+    if batch:
+        await asyncio.gather(*batch)
+    return handed
+
+
+async def replay_outbox(client, scope, routes, on_message, on_album):
+    """Redirect again what the previous run recorded in the outbox but did not finish; returns the messages handed over"""
+    message_map = get_message_map()
+    # Copies sent just before the crash whose mappings did not reach the disk
+    restored = 0
+    for done in outbox.take_copies(scope):
+        for message_id, copy in zip(done['ids'], done['copies']):
+            if copy and await message_map.get(scope, done['source'], message_id, done['destination']) is None:
+                await message_map.put(scope, done['source'], message_id, done['destination'], copy)
+                restored += 1
+    if restored:
+        logger.info(f"Restored {restored} message mappings from the outbox for {scope}")
+
+    intents = outbox.take_recovered(scope)
+    if not intents:
+        return 0
+    by_pair = {(route['source_id'], route['destination_id']): route for route in routes}
+    handed = 0
+    for intent in intents:
+        source_id, destination_id, ids = intent['source'], intent['destination'], intent['ids']
+        route = by_pair.get((source_id, destination_id))
+        if route is None:
+            outbox.complete(scope, source_id, ids[0], destination_id)  # Redirection removed meanwhile
+            continue
+        copy = await message_map.get(scope, source_id, ids[0], destination_id)
+        if copy is not None:
+            outbox.complete(scope, source_id, ids[0], destination_id, [copy])  # Sent, only the done mark was lost
+            continue
+        try:
+            messages = await schedule(client, Priority.BACKFILL, lambda: client.get_messages(source_id, ids=ids))
+        except Exception as e:
+            logger.warning(f"Cannot fetch pending messages {ids} of {source_id} for {scope}, retrying later: {e}")
+            outbox.retry(scope, source_id, ids[0], destination_id)
+            continue
+        events = [BacklogEvent(source_id, message) for message in messages if isinstance(message, types.Message)]
+        if len(events) > 1 and on_album:
+            await on_album(events, [route], priority=Priority.BACKFILL)
+        elif events:
+            await asyncio.gather(*(on_message(event, [route], False, priority=Priority.BACKFILL) for event in events))
+        if not events or events[0].message.id != ids[0]:
+            # The first part is gone: the engine recorded its own intent for the parts still in the source
+            outbox.complete(scope, source_id, ids[0], destination_id)
+        # Otherwise the engine completed the intent, or kept it pending if the send failed
+        handed += len(events)
+    if handed:
+        logger.info(f"Replayed {handed} pending messages from the outbox for {scope}")
+    return handed
+
+
+async def catch_up(client, scope, routes, on_message, on_album, max_backlog=CATCHUP_MAX_BACKLOG):
+    """Redirect what each source posted since its routes' checkpoints; routes without one are skipped"""
+    by_source = {}
+    for route in routes:
+        by_source.setdefault(route['source_id'], []).append(route)
+
+    total = 0
+    try:
+        total += await replay_outbox(client, scope, routes, on_message, on_album)
+    except Exception as e:
+        logger.error(f"Error replaying the outbox for {scope}: {e}")
+    for source_id, source_routes in by_source.items():
+        marks = {
+            route['destination_id']: checkpoints.get(scope, source_id, route['destination_id'])
+            for route in source_routes
+        }
+        marks = {destination_id: mark for destination_id, mark in marks.items() if mark is not None}
+        if not marks:
+            continue
+        source_routes = [route for route in source_routes if route['destination_id'] in marks]
+        try:
+            messages = await fetch_since(client, source_id, min(marks.values()), max_backlog)
+            if not messages:
+                continue
+            if len(messages) >= max_backlog:
+                logger.warning(f"Catch-up of {source_id} for {scope} capped at the {max_backlog} most recent messages")
+            total += await redirect_backlog(scope, source_id, source_routes, marks, messages, on_message, on_album)
+        except Exception as e:
+            logger.error(f"Error catching up on {source_id} for {scope}: {e}")
+    if total:
+        logger.info(f"Caught up on {total} missed messages for {scope}")
+    return total
+
+
+class CatchUps:
+    """One catch-up task per account (user ID, or "bot")
+
+    Startup wires an account's redirections from several paths (session
+    restore, redirection setup); only the first catch-up of an account runs,
+    the others are ignored until it is done.
+    """
+
+    def __init__(self):
+        self._tasks = {}  # scope -> asyncio.Task
+
+    def start(self, client, scope, routes, on_message, on_album):
+        """Catch up on an account's sources in the background; return False if a catch-up is already running"""
+        task = self._tasks.get(scope)
+        if task is not None and not task.done():
+            return False
+        self._tasks[scope] = asyncio.ensure_future(catch_up(client, scope, routes, on_message, on_album))
+        return True
+
+
+# Global checkpoint store, delivery claims and catch-up tasks
+checkpoints = CheckpointStore(CHECKPOINT_FILE, DATA_FLUSH_DELAY)
+recent_deliveries = RecentDeliveries()
+catch_ups = CatchUps()
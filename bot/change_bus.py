@@ -0,0 +1,79 @@
+"""
+Change notifications published by the storage layer
+
+bot.database and SessionManager publish a typed event after every change
+to redirections or sessions. The redirection engine (MessageRedirector)
+subscribes and updates its routing tables incrementally instead of
+reloading everything.
+"""
+
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class RedirectionAdded:
+    user_id: int
+    name: str
+    record: Dict[str, Any] = field(compare=False)
+
+
+@dataclass(frozen=True)
+class RedirectionRemoved:
+    user_id: int
+    name: str
+    record: Optional[Dict[str, Any]] = field(default=None, compare=False)
+
+
+@dataclass(frozen=True)
+class RedirectionChanged:
+    user_id: int
+    name: str
+    old_record: Optional[Dict[str, Any]] = field(compare=False)
+    record: Dict[str, Any] = field(compare=False)
+
+
+@dataclass(frozen=True)
+class SessionActivated:
+    user_id: int
+    phone_number: str
+
+
+@dataclass(frozen=True)
+class SessionDeactivated:
+    user_id: int
+    phone_number: str
+
+
+class ChangeBus:
+    """In-process publish/subscribe for storage change events"""
+
+    def __init__(self):
+        self._subscribers = []  # (callback, event types or None for all)
+
+    def subscribe(self, callback, *event_types):
+        """Register a sync or async callback for the given event types (all if none)"""
+        self._subscribers.append((callback, event_types or None))
+
+    def unsubscribe(self, callback):
+        self._subscribers = [(cb, types) for cb, types in self._subscribers if cb is not callback]
+
+    async def publish(self, event):
+        """Deliver an event to matching subscribers in registration order"""
+        for callback, event_types in list(self._subscribers):
+            if event_types is not None and not isinstance(event, event_types):
+                continue
+            try:
+                result = callback(event)
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception as e:
+                logger.error(f"Error in change subscriber {getattr(callback, '__qualname__', callback)} for {event}: {e}")
+
+
+# Global change bus instance
+change_bus = ChangeBus()
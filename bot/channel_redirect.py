@@ -78,9 +78,9 @@ Cette commande configure une redirection automatique de tous les messages du can
         await store_redirection(user_id, redirection_name, phone_number, "add", 
                                channel_title or "Canal", source_id, destination_id)
         
-        # Set up the message redirection handler with user's client
+        # The stored redirection is wired live through the change bus
         from bot.message_handler import message_redirector
-        handler_added = await message_redirector.add_redirection_handler(user_id, redirection_name, source_id, destination_id)
+        handler_added = message_redirector.is_route_active(user_id, redirection_name)
         
         success_message = f"""
 ✅ **Redirection configurée avec succès !**
@@ -140,8 +140,8 @@ async def setup_automatic_channel_redirection(client, user_id, channel_invite_li
         await store_redirection(user_id, redirection_name, phone_number, "add", 
                                channel_title or "Canal", source_id, destination_id)
         
-        # Set up the handler
-        handler_added = await message_redirector.add_redirection_handler(user_id, redirection_name, source_id, destination_id)
+        # The stored redirection is wired live through the change bus
+        handler_added = message_redirector.is_route_active(user_id, redirection_name)
         
         logger.info(f"Automatic channel to bot redirection configured: {source_id} -> {destination_id}")
         return True, {
@@ -2,6 +2,7 @@ import logging
 from telethon.tl.functions.messages import CheckChatInviteRequest, ImportChatInviteRequest
 from telethon.tl.functions.channels import JoinChannelRequest
 from telethon import TelegramClient
+from bot.scheduler import Priority, schedule
 
 logger = logging.getLogger(__name__)
 
@@ -19,7 +20,7 @@ async def resolve_invite_link(client, invite_link):
             raise ValueError("Invalid invite link format")
         
         # Check the invite link details
-        invite_info = await client(CheckChatInviteRequest(invite_hash))
+        invite_info = await schedule(client, Priority.INTERACTIVE, lambda: client(CheckChatInviteRequest(invite_hash)))
         
         # If already a member, get the chat info
         if hasattr(invite_info, 'chat'):
@@ -30,7 +31,7 @@ async def resolve_invite_link(client, invite_link):
         if hasattr(invite_info, 'title'):
             logger.info(f"Channel found: {invite_info.title}")
             # Join the channel to get full access
-            result = await client(ImportChatInviteRequest(invite_hash))
+            result = await schedule(client, Priority.INTERACTIVE, lambda: client(ImportChatInviteRequest(invite_hash)))
             if hasattr(result, 'chats') and result.chats:
                 chat = result.chats[0]
                 return chat.id, chat.title
@@ -46,7 +47,7 @@ async def get_bot_id(client):
     Get the bot's own user ID
     """
     try:
-        me = await client.get_me()
+        me = await schedule(client, Priority.INTERACTIVE, client.get_me)
         return me.id
     except Exception as e:
         logger.error(f"Error getting bot ID: {e}")
@@ -1,4 +1,5 @@
 import logging
+from bot.scheduler import Priority, schedule
 
 logger = logging.getLogger(__name__)
 
@@ -187,7 +188,8 @@ async def get_real_user_chats(user_id, phone_number):
             
         # Get all dialogs (chats) from the active client
         chats = []
-        async for dialog in active_client.iter_dialogs():
+        dialogs = await schedule(active_client, Priority.INTERACTIVE, active_client.get_dialogs)
+        for dialog in dialogs:
             try:
                 chat_entity = dialog.entity
                 chat_type = 'user'
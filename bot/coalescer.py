@@ -0,0 +1,125 @@
+"""
+Burst coalescing of forwarded messages
+
+Messages forwarded from a source to a destination within a short window
+(FORWARD_COALESCE_WINDOW seconds after the first one) are sent with a
+single forward_messages call of up to 100 IDs instead of one call each.
+Each caller still gets its own forwarded message back, so ID mappings are
+kept per message. Albums go through forward_many() and are never split
+across two calls, so they stay grouped in the destination.
+
+Other sends for the same (source, destination) go through send(), which
+first queues the pending batch: everything reaches the destination's send
+queue, and so Telegram, in arrival order. The queue_* variants add to the
+batch or queue immediately and return a future, for callers that must know
+their message is queued before awaiting the result (see bot.lanes).
+"""
+
+import asyncio
+import logging
+from config.settings import FORWARD_COALESCE_WINDOW
+from bot.scheduler import Priority
+from bot.send_queue import send_queues
+
+logger = logging.getLogger(__name__)
+
+# Telegram accepts at most 100 message IDs per forward
+MAX_BATCH = 100
+
+
+class _Batch:
+    __slots__ = ("message_ids", "waiters", "timer")
+
+    def __init__(self):
+        self.message_ids = []
+        self.waiters = []  # (future, first index, count)
+        self.timer = None
+
+
+class ForwardCoalescer:
+    """Groups forwards per (client, source, destination) into batched forward_messages calls"""
+
+    def __init__(self, window=0.1, max_batch=MAX_BATCH):
+        self.window = window
+        self.max_batch = max_batch
+        self._batches = {}  # (client, source_id, destination_id, priority) -> _Batch
+        self.calls = 0
+        self.forwarded = 0
+
+    async def forward(self, client, source_id, destination_id, message, priority=Priority.LIVE):
+        """Forward one message as part of the current batch; return the forwarded message (or None)"""
+        return (await self.queue_forward_many(client, source_id, destination_id, [message], priority))[0]
+
+    async def forward_many(self, client, source_id, destination_id, messages, priority=Priority.LIVE):
+        """Forward messages that must stay in one call (e.g. an album); return the forwarded messages in order"""
+        return await self.queue_forward_many(client, source_id, destination_id, messages, priority)
+
+    async def send(self, client, source_id, destination_id, call, priority=Priority.LIVE):
+        """Queue a non-forward call for the pair after any forwards still being batched"""
+        return await self.queue_send(client, source_id, destination_id, call, priority)
+
+    def queue_forward_many(self, client, source_id, destination_id, messages, priority=Priority.LIVE):
+        """Add messages to the current batch now; return a future of the forwarded messages"""
+        key = (client, int(source_id), int(destination_id), priority)
+        batch = self._batches.get(key)
+        if batch is not None and len(batch.message_ids) + len(messages) > self.max_batch:
+            self._flush(key)
+            batch = None
+        if batch is None:
+            batch = self._batches[key] = _Batch()
+            if self.window > 0:
+                batch.timer = asyncio.get_running_loop().call_later(self.window, self._flush, key)
+
+        future = asyncio.get_running_loop().create_future()
+        batch.waiters.append((future, len(batch.message_ids), len(messages)))
+        batch.message_ids.extend(message.id for message in messages)
+        if len(batch.message_ids) >= self.max_batch or self.window <= 0:
+            self._flush(key)
+        return future
+
+    def queue_send(self, client, source_id, destination_id, call, priority=Priority.LIVE):
+        """Queue a call now, after the pending batch; return a future of its result"""
+        self._flush((client, int(source_id), int(destination_id), priority))
+        return send_queues.enqueue(client, destination_id, call, priority)
+
+    def _flush(self, key):
+        batch = self._batches.pop(key, None)
+        if batch is None:
+            return
+        if batch.timer is not None:
+            batch.timer.cancel()
+
+        client, source_id, destination_id, priority = key
+        message_ids = batch.message_ids
+        self.calls += 1
+        self.forwarded += len(message_ids)
+        result = send_queues.enqueue(
+            client, destination_id,
+            lambda: client.forward_messages(destination_id, message_ids, from_peer=source_id),
+            priority,
+        )
+        result.add_done_callback(lambda done: self._deliver(done, batch.waiters))
+
+    @staticmethod
+    def _deliver(done, waiters):
+        """Hand each caller its slice of the forwarded messages (same order as the IDs)"""
+        if done.cancelled():
+            for future, _, _ in waiters:
+                future.cancel()
+            return
+        error = done.exception()
+        messages = None if error is not None else done.result()
+        if messages is not None and not isinstance(messages, list):
+            messages = [messages]
+        for future, start, count in waiters:
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                part = messages[start:start + count]
+                future.set_result(part + [None] * (count - len(part)))
+
+
+# Global coalescer instance
+forward_coalescer = ForwardCoalescer(FORWARD_COALESCE_WINDOW)
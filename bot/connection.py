@@ -178,14 +178,11 @@ async def handle_verification_code(event, client):
             # Store in connection function for restoration
             await store_connection_client(user_id, phone, new_client)
             
-            # Store session in persistent database
+            # Store session in persistent database; this publishes SessionActivated,
+            # which wires this user's existing redirections
             from bot.session_manager import session_manager
             await session_manager.store_session(user_id, phone, connection_data['session_name'])
             
-            # Setup message redirection handlers for existing redirections
-            from bot.message_handler import message_redirector
-            await message_redirector.setup_redirection_handlers()
-            
             logger.info(f"Successful connection for user {user_id} with phone {phone}")
             return True
             
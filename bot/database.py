@@ -1,54 +1,23 @@
 import logging
-import json
-import os
 from datetime import datetime
+from bot.storage import get_backend
+from bot.change_bus import change_bus, RedirectionAdded, RedirectionRemoved, RedirectionChanged
 
 logger = logging.getLogger(__name__)
 
-# Simple file-based storage for demo purposes
-DATA_FILE = "user_data.json"
+# Storage engine (JSON files, JSON journal, SQLite or PostgreSQL) is selected by STORAGE_BACKEND in config.settings (see bot.storage.get_backend)
 
-def load_data():
-    """Load user data from file"""
-    if os.path.exists(DATA_FILE):
-        try:
-            with open(DATA_FILE, 'r') as f:
-                data = json.load(f)
-                # Ensure all required keys exist
-                if "pending_redirections" not in data:
-                    data["pending_redirections"] = {}
-                    save_data(data)  # Save updated structure
-                return data
-        except Exception as e:
-            logger.error(f"Error loading data: {e}")
-    return {
-        "licenses": {},
-        "connections": {},
-        "redirections": {},
-        "transformations": {},
-        "whitelists": {},
-        "blacklists": {},
-        "chats": {},
-        "pending_redirections": {}
-    }
-
-def save_data(data):
-    """Save user data to file"""
-    try:
-        with open(DATA_FILE, 'w') as f:
-            json.dump(data, f, indent=2)
-    except Exception as e:
-        logger.error(f"Error saving data: {e}")
+async def export_data():
+    """Get all user data in the user_data.json layout (admin views)"""
+    return await get_backend().export_data()
 
 async def store_license(user_id, license_code):
     """Store validated license"""
-    data = load_data()
-    data["licenses"][str(user_id)] = {
+    await get_backend().put_license(user_id, {
         "license": license_code,
         "validated_at": datetime.now().isoformat(),
         "active": True
-    }
-    save_data(data)
+    })
     logger.info(f"License stored for user {user_id}")
 
 async def is_user_licensed(user_id):
@@ -58,49 +27,32 @@ async def is_user_licensed(user_id):
 
 async def store_connection(user_id, phone_number):
     """Store successful phone connection - automatically replaces existing connection for same phone"""
-    data = load_data()
-    if str(user_id) not in data["connections"]:
-        data["connections"][str(user_id)] = []
-    
-    # Check if phone already exists and remove it (automatic replacement)
-    data["connections"][str(user_id)] = [
-        conn for conn in data["connections"][str(user_id)] 
-        if conn["phone"] != phone_number
-    ]
-    
-    # Add new connection with current timestamp
-    data["connections"][str(user_id)].append({
+    await get_backend().replace_connection(user_id, {
         "phone": phone_number,
         "connected_at": datetime.now().isoformat(),
         "active": True,
         "replaced_at": datetime.now().strftime("%d/%m/%Y %H:%M:%S")
     })
-    save_data(data)
     logger.info(f"Connection stored/replaced for user {user_id}: {phone_number}")
 
 async def get_user_connections(user_id):
     """Get user's phone connections"""
-    data = load_data()
-    return data["connections"].get(str(user_id), [])
+    connections = await get_backend().list_connections(user_id)
+    return connections.get(str(user_id), [])
 
 async def store_redirection(user_id, name, phone_number, action, channel_name=None, source_id=None, destination_id=None):
     """Store redirection rule"""
-    data = load_data()
-    if str(user_id) not in data["redirections"]:
-        data["redirections"][str(user_id)] = {}
+    backend = get_backend()
+    existing = await backend.get_redirection(user_id, name)
+    event = None
     
     if action == "add":
-        # Check if a redirection with the exact same name already exists and replace it
-        existing_redirection = None
-        if name in data["redirections"][str(user_id)]:
-            existing_redirection = name
-        
-        # If same name exists, mark as replaced
+        # If a redirection with the exact same name already exists, mark as replaced
         replaced_info = ""
-        if existing_redirection:
-            replaced_info = f" (mis à jour: {existing_redirection})"
+        if existing:
+            replaced_info = f" (mis à jour: {name})"
         
-        data["redirections"][str(user_id)][name] = {
+        record = {
             "phone": phone_number,
             "name": name,
             "channel_name": channel_name or name,
@@ -111,58 +63,63 @@ async def store_redirection(user_id, name, phone_number, action, channel_name=No
             "active": True,
             "replacement_info": replaced_info
         }
+        await backend.put_redirection(user_id, name, record)
+        if existing:
+            event = RedirectionChanged(int(user_id), name, existing, record)
+        else:
+            event = RedirectionAdded(int(user_id), name, record)
     elif action == "remove":
-        if name in data["redirections"][str(user_id)]:
-            del data["redirections"][str(user_id)][name]
+        if await backend.delete_redirection(user_id, name):
+            event = RedirectionRemoved(int(user_id), name, existing)
     elif action == "change":
-        if name in data["redirections"][str(user_id)]:
-            data["redirections"][str(user_id)][name]["phone"] = phone_number
-            data["redirections"][str(user_id)][name]["channel_name"] = channel_name or name
-            data["redirections"][str(user_id)][name]["source_id"] = source_id
-            data["redirections"][str(user_id)][name]["destination_id"] = destination_id
-            data["redirections"][str(user_id)][name]["updated_at"] = datetime.now().isoformat()
+        if await backend.update_redirection(user_id, name, {
+            "phone": phone_number,
+            "channel_name": channel_name or name,
+            "source_id": source_id,
+            "destination_id": destination_id,
+            "updated_at": datetime.now().isoformat()
+        }):
+            event = RedirectionChanged(int(user_id), name, existing, await backend.get_redirection(user_id, name))
     
-    save_data(data)
     logger.info(f"Redirection {action} for user {user_id}: {name} -> {channel_name or name}")
+    if event:
+        await change_bus.publish(event)
 
 async def get_user_redirections(user_id, phone_number):
     """Get user redirections for a phone number"""
-    data = load_data()
-    user_redirections = data["redirections"].get(str(user_id), {})
-    phone_redirections = []
-    
-    for name, redir in user_redirections.items():
-        if redir["phone"] == phone_number and redir.get("active", True):
-            phone_redirections.append({
-                "name": name,
-                "channel_name": redir.get("channel_name", name),
-                "status": "Actif"
-            })
-    
-    return phone_redirections
+    redirections = await get_backend().list_redirections(user_id=user_id, phone=phone_number, active_only=True)
+    return [
+        {
+            "name": redir["name"],
+            "channel_name": redir.get("channel_name", redir["name"]),
+            "status": "Actif"
+        }
+        for redir in redirections
+    ]
+
+async def get_all_redirections(active_only=True, user_id=None):
+    """Get all redirections (optionally of one user) grouped by user: {user_id: {name: redirection}}"""
+    grouped = {}
+    for redir in await get_backend().list_redirections(user_id=user_id, active_only=active_only):
+        grouped.setdefault(redir.pop("user_id"), {})[redir["name"]] = redir
+    return grouped
 
 async def store_pending_redirection(user_id, name, phone_number):
     """Store pending redirection waiting for channel IDs"""
-    data = load_data()
-    data["pending_redirections"][str(user_id)] = {
+    await get_backend().set_pending(user_id, {
         "name": name,
         "phone_number": phone_number,
         "created_at": datetime.now().isoformat()
-    }
-    save_data(data)
+    })
     logger.info(f"Pending redirection stored for user {user_id}: {name} on {phone_number}")
 
 async def get_pending_redirection(user_id):
     """Get pending redirection for user"""
-    data = load_data()
-    return data["pending_redirections"].get(str(user_id))
+    return await get_backend().get_pending(user_id)
 
 async def clear_pending_redirection(user_id):
     """Clear pending redirection for user"""
-    data = load_data()
-    if str(user_id) in data["pending_redirections"]:
-        del data["pending_redirections"][str(user_id)]
-        save_data(data)
+    if await get_backend().delete_pending(user_id):
         logger.info(f"Pending redirection cleared for user {user_id}")
 
 async def get_user_chats_data(user_id, phone_number, chat_type=None):
@@ -0,0 +1,356 @@
+"""
+Per-client update dispatcher for redirections
+
+Each client gets exactly one NewMessage, one MessageEdited and one
+MessageDeleted handler, whatever the number of redirections. The handlers
+look the chat up in a dict mapping source chat id -> routes, so the cost of
+an update does not grow with the number of redirections. Channels read by
+several accounts are listened to through one of them (SubscriptionIndex).
+
+When an on_album callback is given, the parts of an album (messages sharing
+a grouped_id) are buffered and dispatched together once the album is
+complete (ALBUM_MAX_SIZE parts) or no part arrived for ALBUM_WAIT seconds.
+"""
+
+import asyncio
+import logging
+import time
+from telethon import events, types, utils
+from config.settings import ALBUM_WAIT
+from bot.lanes import lane_key, lanes
+
+logger = logging.getLogger(__name__)
+
+# Telegram albums hold at most 10 media
+ALBUM_MAX_SIZE = 10
+# Seconds without an update from a shared channel after which its listener is replaced
+# by the next account receiving one (missed messages are recovered by bot.poller)
+LISTENER_STALE_AFTER = 10
+
+
+def _is_channel(chat_id):
+    return utils.resolve_id(chat_id)[1] is types.PeerChannel
+
+
+class SubscriptionIndex:
+    """Dispatchers reading each channel source, across users and engines
+
+    When several accounts redirect the same channel, only one of them (the
+    designated listener) handles its updates and hands them to every
+    subscribed dispatcher; the other accounts drop them after a dict lookup.
+    The first account receiving an update from the channel becomes its
+    listener. An account receiving an update while the listener received
+    none for LISTENER_STALE_AFTER seconds takes over: the listener may have
+    left the channel or stopped getting its push updates while still being
+    connected. Only channels are shared: their message IDs are the same for
+    every account, unlike in groups and private chats.
+    """
+
+    def __init__(self):
+        self._dispatchers = {}  # source chat id -> [ClientDispatcher]
+        self._listeners = {}  # source chat id -> designated ClientDispatcher
+        self._heard = {}  # source chat id -> monotonic time of the listener's last update
+
+    def add(self, source_id, dispatcher):
+        dispatchers = self._dispatchers.setdefault(source_id, [])
+        if dispatcher not in dispatchers:
+            dispatchers.append(dispatcher)
+
+    def remove(self, source_id, dispatcher):
+        dispatchers = [d for d in self._dispatchers.get(source_id, []) if d is not dispatcher]
+        if dispatchers:
+            self._dispatchers[source_id] = dispatchers
+        else:
+            self._dispatchers.pop(source_id, None)
+        if self._listeners.get(source_id) is dispatcher:
+            del self._listeners[source_id]
+            self._heard.pop(source_id, None)
+
+    def dispatchers(self, source_id):
+        return list(self._dispatchers.get(source_id, []))
+
+    def receive(self, source_id, dispatcher):
+        """Whether a dispatcher that received an update from source_id handles it, taking over a stale listener"""
+        now = time.monotonic()
+        current = self._listeners.get(source_id)
+        if current is not dispatcher:
+            if current is not None and now - self._heard.get(source_id, 0) < LISTENER_STALE_AFTER:
+                return False  # The listener is receiving this channel's updates
+            if current is not None:
+                logger.info(f"Listener for {source_id} received nothing for {LISTENER_STALE_AFTER}s, switching to another account")
+            self._listeners[source_id] = dispatcher
+        self._heard[source_id] = now
+        return True
+
+    def stats(self):
+        shared = [dispatchers for dispatchers in self._dispatchers.values() if len(dispatchers) > 1]
+        return {
+            'sources': len(self._dispatchers),
+            'shared_sources': len(shared),
+            'skipped_listeners': sum(len(dispatchers) - 1 for dispatchers in shared),
+        }
+
+
+# Global subscription index, shared by every RouteRegistry
+subscriptions = SubscriptionIndex()
+
+
+class ClientDispatcher:
+    """Routes one client's message updates to the redirections reading that chat"""
+
+    def __init__(self, client, on_message, on_deleted=None, on_album=None):
+        """
+        on_message(event, routes, is_edit) is awaited once per update with
+        every matching route, so the message is processed once for all of them;
+        on_deleted(event, routes) once per deletion batch that may concern routes;
+        on_album(events, routes) once per album with the NewMessage events of
+        all its parts, in message order.
+
+        Updates from a channel other accounts also read are only handled by
+        the channel's designated listener (see SubscriptionIndex), which calls
+        these callbacks on every subscribed dispatcher.
+        """
+        self.client = client
+        self.on_message = on_message
+        self.on_deleted = on_deleted
+        self.on_album = on_album
+        self.routes = {}  # source chat id -> list of routes
+        self._albums = {}  # (chat id, grouped_id) -> [events, timer, lane keys]
+        self._handlers = [
+            (self._on_new_message, events.NewMessage()),
+            (self._on_message_edited, events.MessageEdited()),
+            (self._on_message_deleted, events.MessageDeleted()),
+        ]
+        for callback, builder in self._handlers:
+            client.add_event_handler(callback, builder)
+
+    def add_route(self, source_id, route):
+        self.routes.setdefault(int(source_id), []).append(route)
+        if _is_channel(int(source_id)):
+            subscriptions.add(int(source_id), self)
+
+    def remove_route(self, source_id, route):
+        """Drop a route; return False if it was not routed"""
+        routes = self.routes.get(int(source_id), [])
+        remaining = [r for r in routes if r is not route]
+        if len(remaining) == len(routes):
+            return False
+        if remaining:
+            self.routes[int(source_id)] = remaining
+        else:
+            del self.routes[int(source_id)]
+            subscriptions.remove(int(source_id), self)
+        return True
+
+    def close(self):
+        """Detach the handlers from the client"""
+        for callback, _ in self._handlers:
+            self.client.remove_event_handler(callback)
+        for events_, timer, lane_keys in self._albums.values():
+            if timer:
+                timer.cancel()
+            for lane in lane_keys:
+                for event in events_:
+                    lanes.leave(lane, event.message.id)
+        self._albums.clear()
+        for source_id in self.routes:
+            subscriptions.remove(source_id, self)
+        self.routes.clear()
+
+    def _targets(self, chat_id):
+        """Dispatchers this client should deliver an update from chat_id to"""
+        if chat_id not in self.routes:
+            return []
+        if not _is_channel(chat_id):
+            return [self]
+        if not subscriptions.receive(chat_id, self):
+            return []  # Another account handles this channel
+        return subscriptions.dispatchers(chat_id)
+
+    @staticmethod
+    def _enter_lanes(targets, chat_id, message_id):
+        """Reserve the message's place in the ordered lane of every route it goes to"""
+        keys = [lane_key(route) for target in targets for route in target.routes.get(chat_id, [])]
+        for key in keys:
+            lanes.enter(key, message_id)
+        return keys
+
+    async def _dispatch(self, event, is_edit):
+        targets = self._targets(event.chat_id)
+        if not targets:
+            return
+        # Edits change messages already sent: they do not take a place in the lanes
+        keys = [] if is_edit else self._enter_lanes(targets, event.chat_id, event.message.id)
+        try:
+            await asyncio.gather(*(target._deliver_message(event, is_edit) for target in targets))
+        finally:
+            for key in keys:
+                lanes.leave(key, event.message.id)
+
+    async def _deliver_message(self, event, is_edit):
+        routes = self.routes.get(event.chat_id)
+        if not routes:
+            return
+        try:
+            # Copy: a callback may add or remove routes while it runs
+            await self.on_message(event, list(routes), is_edit)
+        except Exception as e:
+            logger.error(f"Error dispatching message from {event.chat_id}: {e}")
+
+    async def _on_new_message(self, event):
+        if self.on_album and event.message.grouped_id:
+            targets = self._targets(event.chat_id)
+            if targets:
+                self._buffer_album_part(event, self._enter_lanes(targets, event.chat_id, event.message.id))
+            return
+        await self._dispatch(event, is_edit=False)
+
+    def _buffer_album_part(self, event, lane_keys):
+        """Hold an album part until the album is complete or no part arrived for ALBUM_WAIT"""
+        key = (event.chat_id, event.message.grouped_id)
+        album = self._albums.get(key)
+        if album is None:
+            album = self._albums[key] = [[], None, set()]
+        elif album[1]:
+            album[1].cancel()
+        album[0].append(event)
+        album[2].update(lane_keys)
+        if len(album[0]) >= ALBUM_MAX_SIZE:
+            album[1] = None
+            asyncio.ensure_future(self._dispatch_album(key))
+        else:
+            album[1] = asyncio.get_running_loop().call_later(
+                ALBUM_WAIT, lambda: asyncio.ensure_future(self._dispatch_album(key))
+            )
+
+    async def _dispatch_album(self, key):
+        album = self._albums.pop(key, None)
+        if album is None:
+            return
+        # Parts are handled concurrently and may have been buffered out of order
+        parts = sorted(album[0], key=lambda event: event.message.id)
+        # The parts were received as the listener: hand them over without counting a new update
+        targets = subscriptions.dispatchers(key[0]) if _is_channel(key[0]) else [self]
+        try:
+            await asyncio.gather(*(target._deliver_album(key[0], parts) for target in targets))
+        finally:
+            for lane in album[2]:
+                for part in parts:
+                    lanes.leave(lane, part.message.id)
+
+    async def _deliver_album(self, chat_id, parts):
+        routes = self.routes.get(chat_id)
+        if not routes or not self.on_album:
+            return
+        try:
+            await self.on_album(parts, list(routes))
+        except Exception as e:
+            logger.error(f"Error dispatching album from {chat_id}: {e}")
+
+    async def _on_message_edited(self, event):
+        await self._dispatch(event, is_edit=True)
+
+    async def _on_message_deleted(self, event):
+        if event.chat_id is not None:
+            targets = self._targets(event.chat_id)
+            await asyncio.gather(*(target._deliver_deletion(event, target.routes.get(event.chat_id)) for target in targets))
+            return
+        # Telegram only names the chat for channel deletions; others may be in any non-channel source
+        await self._deliver_deletion(event, [
+            route
+            for source_id, source_routes in self.routes.items()
+            if not _is_channel(source_id)
+            for route in source_routes
+        ])
+
+    async def _deliver_deletion(self, event, routes):
+        if not routes or not self.on_deleted:
+            return
+        try:
+            await self.on_deleted(event, list(routes))
+        except Exception as e:
+            logger.error(f"Error dispatching deletion in {event.chat_id}: {e}")
+
+
+class RouteRegistry:
+    """Live redirections keyed by (user_id, name), each served by its owner's ClientDispatcher
+
+    Registering the same route again is a no-op, so setup can run any number
+    of times. A dispatcher's Telethon handlers are removed as soon as its last
+    route goes away or its owner switches to another client.
+    """
+
+    def __init__(self, on_message, on_deleted=None, on_album=None):
+        self.on_message = on_message
+        self.on_deleted = on_deleted
+        self.on_album = on_album
+        self.routes = {}  # (user_id, name) -> route
+        self.dispatchers = {}  # owner -> ClientDispatcher
+
+    def __contains__(self, key):
+        return key in self.routes
+
+    def get(self, user_id, name):
+        return self.routes.get((user_id, name))
+
+    def routes_of(self, owner):
+        return [route for route in self.routes.values() if route['owner'] == owner]
+
+    def _dispatcher_for(self, owner, client):
+        dispatcher = self.dispatchers.get(owner)
+        if dispatcher and dispatcher.client is client:
+            return dispatcher
+
+        new_dispatcher = ClientDispatcher(client, self.on_message, self.on_deleted, self.on_album)
+        if dispatcher:
+            # The owner reconnected with a new client: carry its routes over
+            dispatcher.close()
+            for route in self.routes.values():
+                if route['owner'] == owner:
+                    new_dispatcher.add_route(route['source_id'], route)
+        self.dispatchers[owner] = new_dispatcher
+        return new_dispatcher
+
+    def register(self, client, owner, user_id, name, source_id, destination_id):
+        """Route a redirection through the owner's client; return False if already live as is"""
+        key = (user_id, name)
+        current = self.routes.get(key)
+        if (current and current['owner'] == owner and current['source_id'] == int(source_id)
+                and current['destination_id'] == int(destination_id)
+                and self.dispatchers[owner].client is client):
+            return False
+        if current:
+            self.unregister(user_id, name)
+
+        route = {
+            'owner': owner,
+            'user_id': user_id,
+            'name': name,
+            'source_id': int(source_id),
+            'destination_id': int(destination_id),
+        }
+        dispatcher = self._dispatcher_for(owner, client)
+        self.routes[key] = route
+        dispatcher.add_route(route['source_id'], route)
+        return True
+
+    def unregister(self, user_id, name):
+        """Stop routing a redirection; return False if it was not live"""
+        route = self.routes.pop((user_id, name), None)
+        if not route:
+            return False
+        dispatcher = self.dispatchers.get(route['owner'])
+        if dispatcher:
+            dispatcher.remove_route(route['source_id'], route)
+            if not dispatcher.routes:
+                dispatcher.close()
+                del self.dispatchers[route['owner']]
+        return True
+
+    def unregister_owner(self, owner):
+        """Drop every route of an owner and detach its dispatcher"""
+        for key in [key for key, route in self.routes.items() if route['owner'] == owner]:
+            del self.routes[key]
+        dispatcher = self.dispatchers.pop(owner, None)
+        if dispatcher:
+            dispatcher.close()
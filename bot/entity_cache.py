@@ -0,0 +1,118 @@
+"""
+Per-client entity cache shared by the redirection engines
+
+Caches client.get_entity() results per client for a TTL, and failures for a
+shorter negative TTL so an inaccessible chat is not looked up on every
+message. Concurrent lookups of the same chat share one request.
+
+Chat names are only needed for log lines, so describe() returns a lazy
+object: the name is looked up when the line is actually emitted, served
+from the cache, and resolved in the background on a miss instead of
+delaying the message being redirected.
+"""
+
+import asyncio
+import logging
+import time
+import weakref
+from config.settings import ENTITY_CACHE_TTL, ENTITY_CACHE_NEGATIVE_TTL
+from bot.scheduler import Priority, schedule
+
+logger = logging.getLogger(__name__)
+
+
+def entity_name(entity, chat_id):
+    """Human-readable name of a chat, user or channel"""
+    if getattr(entity, 'title', None):
+        return entity.title
+    if getattr(entity, 'first_name', None):
+        name = entity.first_name
+        if getattr(entity, 'last_name', None):
+            name += f" {entity.last_name}"
+        return name
+    if getattr(entity, 'username', None):
+        return f"@{entity.username}"
+    return f"Chat {chat_id}"
+
+
+class _LazyName:
+    """Formats as the chat's name, without any network call"""
+
+    __slots__ = ("cache", "client", "chat_id")
+
+    def __init__(self, cache, client, chat_id):
+        self.cache = cache
+        self.client = client
+        self.chat_id = chat_id
+
+    def __str__(self):
+        return self.cache.cached_name(self.client, self.chat_id, warm=True)
+
+
+class EntityCache:
+    """TTL cache of get_entity() results, one table per client"""
+
+    def __init__(self, ttl=3600, negative_ttl=300):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        # client -> {chat_id: (expires_at, entity or None)}; dropped with the client
+        self._entries = weakref.WeakKeyDictionary()
+        self._inflight = weakref.WeakKeyDictionary()  # client -> {chat_id: future}
+
+    def _lookup(self, client, chat_id):
+        """Return (hit, entity) from the cache"""
+        entry = self._entries.get(client, {}).get(chat_id)
+        if entry is None or entry[0] < time.monotonic():
+            return False, None
+        return True, entry[1]
+
+    async def get_entity(self, client, chat_id):
+        """Return the entity of a chat, or None if it cannot be resolved"""
+        chat_id = int(chat_id)
+        hit, entity = self._lookup(client, chat_id)
+        if hit:
+            return entity
+
+        inflight = self._inflight.setdefault(client, {})
+        future = inflight.get(chat_id)
+        if future is None:
+            future = inflight[chat_id] = asyncio.ensure_future(self._resolve(client, chat_id))
+            future.add_done_callback(lambda _: inflight.pop(chat_id, None))
+        return await asyncio.shield(future)
+
+    async def _resolve(self, client, chat_id):
+        try:
+            entity = await schedule(client, Priority.BACKGROUND, lambda: client.get_entity(chat_id))
+            ttl = self.ttl
+        except Exception as e:
+            logger.warning(f"Cannot resolve chat {chat_id}: {e}")
+            entity, ttl = None, self.negative_ttl
+        self._entries.setdefault(client, {})[chat_id] = (time.monotonic() + ttl, entity)
+        return entity
+
+    def put(self, client, chat_id, entity):
+        """Record an entity resolved elsewhere (e.g. by a batched peer lookup)"""
+        self._entries.setdefault(client, {})[int(chat_id)] = (time.monotonic() + self.ttl, entity)
+
+    async def get_name(self, client, chat_id):
+        return entity_name(await self.get_entity(client, chat_id), chat_id)
+
+    def cached_name(self, client, chat_id, warm=False):
+        """Name from the cache only; with warm, resolve a miss in the background"""
+        chat_id = int(chat_id)
+        hit, entity = self._lookup(client, chat_id)
+        if not hit and warm:
+            try:
+                asyncio.get_running_loop()
+                asyncio.ensure_future(self.get_entity(client, chat_id))
+            except RuntimeError:
+                pass  # No event loop in this thread
+        return entity_name(entity, chat_id)
+
+    def describe(self, client, chat_id):
+        """Lazy name for log arguments: logger.info("... %s", cache.describe(client, chat_id))"""
+        return _LazyName(self, client, chat_id)
+
+
+# Global entity cache instance
+entity_cache = EntityCache(ENTITY_CACHE_TTL, ENTITY_CACHE_NEGATIVE_TTL)
@@ -0,0 +1,46 @@
+"""
+One-to-many fan-out of source messages
+
+A source message is turned into an Outgoing once (what to send: text with
+its formatting entities, a media forward, or the placeholder for empty
+messages), then sent to every destination of its source concurrently. Each
+send still goes through its destination's send queue, so concurrency is
+bounded by the per-destination rate limiters and the account-wide
+scheduler, not by the number of routes.
+"""
+
+import asyncio
+import logging
+from dataclasses import dataclass, field
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Outgoing:
+    """What a source message becomes in every destination"""
+
+    kind: str  # "text", "media" or "empty"
+    text: str  # Raw text, without markup
+    entities: list = field(default_factory=list)  # Formatting of text, sent as is
+
+    @classmethod
+    def from_message(cls, message):
+        # raw_text + entities: message.text would render markdown that send_message then parses back
+        text = message.raw_text
+        if text:
+            return cls("text", text, list(message.entities or []))
+        if message.media:
+            return cls("media", "")
+        return cls("empty", "")
+
+
+async def fan_out(routes, send):
+    """Await send(route) for every route concurrently; one failing destination does not stop the others"""
+    if len(routes) == 1:
+        await send(routes[0])
+        return
+    results = await asyncio.gather(*(send(route) for route in routes), return_exceptions=True)
+    for route, result in zip(routes, results):
+        if isinstance(result, Exception):
+            logger.error(f"Error redirecting to {route['destination_id']} via {route['name']}: {result}")
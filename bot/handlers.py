@@ -15,8 +15,10 @@ from bot.whitelist import handle_whitelist_command
 from bot.blacklist import handle_blacklist_command
 from bot.chats import handle_chats_command
 from bot.admin import handle_admin_commands
+from bot.storage import close_backend
 
 # Configure logging
+os.makedirs("logs", exist_ok=True)
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -337,10 +339,12 @@ async def start_bot():
 
         # Setup message redirection handlers AFTER sessions are restored
         from bot.message_handler import message_redirector
-import os
-os.makedirs("logs", exist_ok=True)
         await message_redirector.setup_redirection_handlers()
 
+        # Resume history copies interrupted by the restart
+        from bot.backfill import backfill_jobs
+        backfill_jobs.resume_all(client)
+
         # Initialize and start keep-alive system
         keep_alive = KeepAliveSystem(client, ADMIN_ID)
         asyncio.create_task(keep_alive.start_keep_alive())
@@ -351,6 +355,13 @@ os.makedirs("logs", exist_ok=True)
     except Exception as e:
         logger.error(f"Error starting bot: {e}")
         raise
+    finally:
+        # Stop the send workers, then persist any buffered writes before the process exits
+        from bot.send_queue import send_queues
+        await send_queues.close()
+        from bot.outbox import outbox
+        outbox.close()
+        close_backend()
 
 def start_bot_sync():
     """Synchronous wrapper to start the bot"""
@@ -0,0 +1,68 @@
+"""
+Per-(source, destination) ordered lanes
+
+Updates are handled concurrently, and a message can be held back on its way
+to the send queue (an album waiting for its parts, a lookup, a busy
+coalescer), letting a later message of the same source overtake it. Each
+route has a lane keyed by (owner, source, destination): the dispatcher
+enters a message's ID in the lanes of its routes when the update arrives,
+and the engine waits for its turn (every lower ID in the lane has been
+queued or dropped) right before queueing the send. Send queues are FIFO, so
+each destination receives a source's messages in ID order, while unrelated
+lanes never wait on each other.
+"""
+
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Seconds a message waits for earlier ones before going ahead anyway
+LANE_MAX_WAIT = 60
+
+
+def lane_key(route):
+    return (route['owner'], route['source_id'], route['destination_id'])
+
+
+class OrderedLanes:
+    """Messages of each lane not queued yet, by source message ID"""
+
+    def __init__(self):
+        self._lanes = {}  # key -> {message_id: future set when the message leaves}
+
+    def enter(self, key, message_id):
+        lane = self._lanes.setdefault(key, {})
+        if message_id not in lane:
+            lane[message_id] = asyncio.get_running_loop().create_future()
+
+    def leave(self, key, message_id):
+        """Mark a message queued (or dropped); a no-op if it already left or never entered"""
+        lane = self._lanes.get(key)
+        if not lane:
+            return
+        future = lane.pop(message_id, None)
+        if future is not None and not future.done():
+            future.set_result(None)
+        if not lane:
+            del self._lanes[key]
+
+    async def turn(self, key, message_id):
+        """Wait until every lower message ID entered in the lane has left"""
+        lane = self._lanes.get(key)
+        if not lane:
+            return
+        earlier = [future for other_id, future in lane.items() if other_id < message_id]
+        if not earlier:
+            return
+        # asyncio.wait never cancels the futures: other messages of the lane wait on them too
+        _, late = await asyncio.wait(earlier, timeout=LANE_MAX_WAIT)
+        if late:
+            logger.warning(f"Message {message_id} waited {LANE_MAX_WAIT}s for earlier messages of {key[1]}, sending it anyway")
+
+    def stats(self):
+        return {'lanes': len(self._lanes), 'waiting': sum(len(lane) for lane in self._lanes.values())}
+
+
+# Global lanes instance
+lanes = OrderedLanes()
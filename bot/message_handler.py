@@ -1,8 +1,22 @@
 import logging
 import asyncio
-from telethon import events
-from bot.database import load_data
+from bot.database import get_all_redirections
 from bot.connection import active_connections
+from bot.catchup import catch_ups, checkpoints, recent_deliveries, seed_checkpoint
+from bot.coalescer import forward_coalescer
+from bot.dispatcher import RouteRegistry
+from bot.entity_cache import entity_cache
+from bot.fanout import Outgoing, fan_out
+from bot.lanes import lane_key, lanes
+from bot.outbox import outbox
+from bot.peer_cache import peer_cache
+from bot.poller import pollers
+from bot.scheduler import Priority
+from bot.send_queue import send_queues
+from bot.storage import get_message_map
+from bot.change_bus import (
+    change_bus, RedirectionAdded, RedirectionRemoved, RedirectionChanged, SessionActivated, SessionDeactivated
+)
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
@@ -12,13 +26,15 @@ class MessageRedirector:
     
     def __init__(self):
         self.redirection_clients = {}
-        self.message_mapping = {}  # Maps original message ID to redirected message ID
+        self.message_map = get_message_map()  # Maps original message ID to redirected message ID
+        self.routes = RouteRegistry(self._dispatch_message, self._handle_message_deletion, self._dispatch_album)  # keyed by (user_id, name)
+        change_bus.subscribe(self._on_redirection_change, RedirectionAdded, RedirectionRemoved, RedirectionChanged)
+        change_bus.subscribe(self._on_session_change, SessionActivated, SessionDeactivated)
         
     async def setup_redirection_handlers(self):
         """Setup message handlers for all active connections"""
         try:
-            data = load_data()
-            redirections = data.get("redirections", {})
+            redirections = await get_all_redirections()
             total_redirections = 0
             
             # First, restore all sessions for users with active redirections
@@ -27,6 +43,14 @@ class MessageRedirector:
             # Wait a moment for sessions to be fully established
             await asyncio.sleep(3)
             
+            # Resolve every source and destination in batches, all clients concurrently
+            jobs = []
+            for user_id, user_redirections in redirections.items():
+                client = active_connections.get(int(user_id), {}).get('client')
+                if client and client.is_connected():
+                    jobs.append((client, int(user_id), self._redirection_chat_ids(user_redirections)))
+            await peer_cache.resolve_all(jobs)
+            
             for user_id, user_redirections in redirections.items():
                 if int(user_id) in active_connections:
                     connection_data = active_connections[int(user_id)]
@@ -35,6 +59,8 @@ class MessageRedirector:
                         count = await self._setup_client_handlers(client, int(user_id), user_redirections)
                         total_redirections += count
                         logger.info(f"Restored {count} redirections for user {user_id}")
+                        self._start_catch_up(client, int(user_id))
+                        self._start_polling(client, int(user_id))
                     else:
                         logger.warning(f"User {user_id} has redirections but no active client")
                 else:
@@ -54,6 +80,11 @@ class MessageRedirector:
                 # Check if user has active redirections
                 active_redirections = [r for r in user_redirections.values() if r.get('active', True)]
                 
+                connection_data = active_connections.get(int(user_id), {})
+                if connection_data.get('client') and connection_data['client'].is_connected():
+                    # Already connected: restoring again would open a second client for the account
+                    continue
+                
                 if active_redirections:
                     logger.info(f"Restoring session for user {user_id} with {len(active_redirections)} redirections")
                     
@@ -77,6 +108,15 @@ class MessageRedirector:
         except Exception as e:
             logger.error(f"Error restoring sessions for redirections: {e}")
     
+    @staticmethod
+    def _redirection_chat_ids(user_redirections):
+        return [
+            chat_id
+            for redir_data in user_redirections.values()
+            for chat_id in (redir_data.get('source_id'), redir_data.get('destination_id'))
+            if chat_id
+        ]
+    
     async def _setup_client_handlers(self, client, user_id, user_redirections):
         """Setup message handlers for a specific client"""
         setup_count = 0
@@ -87,16 +127,7 @@ class MessageRedirector:
                     destination_id = redir_data.get('destination_id')
                     
                     if source_id and destination_id:
-                        # Create handler for new messages
-                        @client.on(events.NewMessage(chats=int(source_id)))
-                        async def message_handler(event, dest_id=destination_id, redirect_name=name):
-                            await self._handle_message_redirection(event, dest_id, redirect_name, user_id, is_edit=False)
-                        
-                        # Create handler for edited messages
-                        @client.on(events.MessageEdited(chats=int(source_id)))
-                        async def edit_handler(event, dest_id=destination_id, redirect_name=name):
-                            await self._handle_message_redirection(event, dest_id, redirect_name, user_id, is_edit=True)
-                        
+                        self._register_route(client, user_id, name, source_id, destination_id)
                         setup_count += 1
                         logger.info(f"✅ Redirection '{name}' configurée: {source_id} -> {destination_id}")
             
@@ -106,8 +137,13 @@ class MessageRedirector:
             logger.error(f"Error setting up client handlers: {e}")
             return setup_count
     
-    async def _handle_message_redirection(self, event, destination_id, redirect_name, user_id, is_edit=False):
-        """Handle individual message redirection"""
+    async def _handle_message_redirection(self, event, destination_id, redirect_name, user_id, is_edit=False, outgoing=None,
+                                          priority=Priority.LIVE, lane=None):
+        """Handle individual message redirection
+
+        outgoing is the message's content, prepared once per source message;
+        lane is the route's ordered lane (see bot.lanes), if it has one.
+        """
         try:
             # Get the client for forwarding
             client = active_connections[user_id].get('client')
@@ -118,35 +154,36 @@ class MessageRedirector:
             # Get message content
             message = event.message
             original_msg_id = message.id
-            mapping_key = f"{user_id}_{event.chat_id}_{original_msg_id}_{destination_id}"
+            if outgoing is None:
+                outgoing = Outgoing.from_message(message)
             
-            # Get source and destination channel names for logging only
-            source_name = await self._get_channel_name(client, event.chat_id)
-            dest_name = await self._get_channel_name(client, int(destination_id))
+            # Source and destination names for logging only, looked up when a line is emitted
+            source_name = entity_cache.describe(client, event.chat_id)
+            dest_name = entity_cache.describe(client, destination_id)
             
             if is_edit:
                 # Check if we have a mapping for this message
-                if mapping_key in self.message_mapping:
-                    redirected_msg_id = self.message_mapping[mapping_key]
+                redirected_msg_id = await self.message_map.get(user_id, event.chat_id, original_msg_id, destination_id)
+                if redirected_msg_id is not None:
                     try:
                         # Edit the existing message
-                        if message.text:
-                            await client.edit_message(int(destination_id), redirected_msg_id, message.text)
+                        if outgoing.kind == "text":
+                            await send_queues.submit(client, int(destination_id), lambda: client.edit_message(int(destination_id), redirected_msg_id, outgoing.text, formatting_entities=outgoing.entities))
                             action = "edited and updated"
-                            logger.info(f"Message {action} from {event.chat_id} ({source_name}) to {destination_id} ({dest_name}) via {redirect_name}")
+                            logger.info("Message %s from %s (%s) to %s (%s) via %s", action, event.chat_id, source_name, destination_id, dest_name, redirect_name)
                             return
-                        elif message.media:
+                        elif outgoing.kind == "media":
                             # For media edits, we need to delete and resend since Telegram doesn't allow editing media in the same way
                             try:
-                                await client.delete_messages(int(destination_id), redirected_msg_id)
+                                await send_queues.submit(client, int(destination_id), lambda: client.delete_messages(int(destination_id), redirected_msg_id))
                             except:
                                 pass  # Continue even if delete fails
                             # Fall through to send new message
                         else:
                             # Message was deleted or has no content, delete the redirected message too
                             try:
-                                await client.delete_messages(int(destination_id), redirected_msg_id)
-                                del self.message_mapping[mapping_key]
+                                await send_queues.submit(client, int(destination_id), lambda: client.delete_messages(int(destination_id), redirected_msg_id))
+                                await self.message_map.pop(user_id, event.chat_id, original_msg_id, destination_id)
                                 logger.info(f"Message deleted from {event.chat_id} to {destination_id} via {redirect_name}")
                                 return
                             except Exception as delete_error:
@@ -166,54 +203,135 @@ class MessageRedirector:
                     # Don't send anything for edits of unmapped messages
                     return
             
+            # A message can reach us through push updates, catch-up and polling: send it once
+            if not is_edit and not recent_deliveries.claim(user_id, event.chat_id, original_msg_id, destination_id):
+                return
+            
             # Send new message (either first time or edit/media replacement)
             sent_message = None
-            if message.text:
-                sent_message = await client.send_message(int(destination_id), message.text)
-            elif message.media:
-                # Forward media directly
-                sent_message = await client.forward_messages(int(destination_id), message)
+            try:
+                if not is_edit:
+                    # Persisted before sending: if the process dies from here on, the message is sent at the next start
+                    await outbox.record(user_id, event.chat_id, [original_msg_id], destination_id)
+                if lane is not None and not is_edit:
+                    # Queue behind the earlier messages of the source still on their way to this destination
+                    await lanes.turn(lane, original_msg_id)
+                queued = None
+                if outgoing.kind == "text":
+                    queued = forward_coalescer.queue_send(client, event.chat_id, destination_id, lambda: client.send_message(int(destination_id), outgoing.text, formatting_entities=outgoing.entities), priority)
+                elif outgoing.kind == "media":
+                    # Forward media directly, batched with other forwards from the same source
+                    queued = forward_coalescer.queue_forward_many(client, event.chat_id, destination_id, [message], priority)
+                if lane is not None and not is_edit:
+                    lanes.leave(lane, original_msg_id)
+                if queued is not None:
+                    sent_message = await queued
+                    if outgoing.kind == "media":
+                        sent_message = sent_message[0]
+            except Exception:
+                if not is_edit:
+                    recent_deliveries.release(user_id, event.chat_id, original_msg_id, destination_id)
+                    outbox.retry(user_id, event.chat_id, original_msg_id, destination_id)
+                raise
             
-            # Store the mapping for future edits (only for new messages or successful replacements)
-            if sent_message and not is_edit:
-                if hasattr(sent_message, 'id'):
-                    self.message_mapping[mapping_key] = sent_message.id
-                elif isinstance(sent_message, list) and len(sent_message) > 0:
-                    self.message_mapping[mapping_key] = sent_message[0].id
-            elif sent_message and is_edit:
-                # Update mapping for media replacements
-                if hasattr(sent_message, 'id'):
-                    self.message_mapping[mapping_key] = sent_message.id
-                elif isinstance(sent_message, list) and len(sent_message) > 0:
-                    self.message_mapping[mapping_key] = sent_message[0].id
+            # Store the mapping for future edits (new messages and media replacements)
+            sent_id = None
+            if hasattr(sent_message, 'id'):
+                sent_id = sent_message.id
+            elif isinstance(sent_message, list) and len(sent_message) > 0:
+                sent_id = sent_message[0].id
+            if sent_id is not None:
+                await self.message_map.put(user_id, event.chat_id, original_msg_id, destination_id, sent_id)
+                if not is_edit:
+                    checkpoints.advance(user_id, event.chat_id, destination_id, original_msg_id)
+            if not is_edit:
+                outbox.complete(user_id, event.chat_id, original_msg_id, destination_id, [sent_id] if sent_id else [])
             
             action = "edited and redirected" if is_edit else "redirected"
-            logger.info(f"Message {action} from {event.chat_id} ({source_name}) to {destination_id} ({dest_name}) via {redirect_name}")
+            logger.info("Message %s from %s (%s) to %s (%s) via %s", action, event.chat_id, source_name, destination_id, dest_name, redirect_name)
             
         except Exception as e:
             logger.error(f"Error handling message redirection: {e}")
     
-    async def _get_channel_name(self, client, chat_id):
-        """Get the actual channel/chat name"""
+    def _register_route(self, client, user_id, name, source_id, destination_id):
+        """Make a redirection live on the user's client; a no-op if it already is"""
+        if not self.routes.register(client, user_id, user_id, name, source_id, destination_id):
+            return False
+        asyncio.ensure_future(seed_checkpoint(client, user_id, int(source_id), int(destination_id)))
+        return True
+    
+    async def _dispatch_message(self, event, routes, is_edit, priority=Priority.LIVE):
+        """Prepare the message once, then redirect it to every destination of its source concurrently"""
+        outgoing = Outgoing.from_message(event.message)
+        await fan_out(routes, lambda route: self._handle_message_redirection(
+            event, route['destination_id'], route['name'], route['user_id'], is_edit=is_edit, outgoing=outgoing,
+            priority=priority, lane=lane_key(route)
+        ))
+    
+    async def _dispatch_album(self, events, routes, priority=Priority.LIVE):
+        await fan_out(routes, lambda route: self._handle_album_redirection(
+            events, route['destination_id'], route['name'], route['user_id'], priority, lane_key(route)
+        ))
+    
+    async def _handle_album_redirection(self, events, destination_id, redirect_name, user_id, priority=Priority.LIVE,
+                                        lane=None):
+        """Forward all parts of an album in one call and map every part"""
         try:
-            entity = await client.get_entity(chat_id)
+            client = active_connections[user_id].get('client')
+            if not client or not client.is_connected():
+                logger.warning(f"Client not available for redirection {redirect_name}")
+                return
             
-            # Get the proper name
-            if hasattr(entity, 'title') and entity.title:
-                return entity.title
-            elif hasattr(entity, 'first_name') and entity.first_name:
-                name = entity.first_name
-                if hasattr(entity, 'last_name') and entity.last_name:
-                    name += f" {entity.last_name}"
-                return name
-            elif hasattr(entity, 'username') and entity.username:
-                return f"@{entity.username}"
-            else:
-                return f"Chat {chat_id}"
-                
+            chat_id = events[0].chat_id
+            messages = [event.message for event in events]
+            if not recent_deliveries.claim(user_id, chat_id, messages[0].id, destination_id):
+                return
+            try:
+                await outbox.record(user_id, chat_id, [message.id for message in messages], destination_id)
+                if lane is not None:
+                    await lanes.turn(lane, messages[0].id)
+                queued = forward_coalescer.queue_forward_many(client, chat_id, destination_id, messages, priority)
+                if lane is not None:
+                    for message in messages:
+                        lanes.leave(lane, message.id)
+                sent_messages = await queued
+            except Exception:
+                recent_deliveries.release(user_id, chat_id, messages[0].id, destination_id)
+                outbox.retry(user_id, chat_id, messages[0].id, destination_id)
+                raise
+            for message, sent_message in zip(messages, sent_messages):
+                if sent_message is not None:
+                    await self.message_map.put(user_id, chat_id, message.id, destination_id, sent_message.id)
+            if any(sent_messages):
+                checkpoints.advance(user_id, chat_id, destination_id, messages[-1].id)
+            outbox.complete(user_id, chat_id, messages[0].id, destination_id,
+                            [sent_message.id if sent_message is not None else None for sent_message in sent_messages])
+            
+            logger.info("Album of %d messages redirected from %s (%s) to %s (%s) via %s", len(messages), chat_id,
+                        entity_cache.describe(client, chat_id), destination_id,
+                        entity_cache.describe(client, destination_id), redirect_name)
         except Exception as e:
-            logger.error(f"Error getting channel name for {chat_id}: {e}")
-            return f"Chat {chat_id}"
+            logger.error(f"Error handling album redirection: {e}")
+    
+    async def _handle_message_deletion(self, event, routes):
+        """Delete the redirected copies of messages deleted in a source chat, one call per destination"""
+        user_id = routes[0]['user_id']  # A dispatcher only serves one user's routes
+        client = active_connections.get(user_id, {}).get('client')
+        if not client or not client.is_connected():
+            return
+        
+        names = {route['destination_id']: route['name'] for route in routes}
+        copies = await self.message_map.pop_copies(user_id, event.chat_id, event.deleted_ids, names.keys())
+        for destination_id, redirected_ids in copies.items():
+            try:
+                await send_queues.submit(client, destination_id, lambda: client.delete_messages(destination_id, redirected_ids))
+                logger.info(f"Deleted {len(redirected_ids)} messages from {destination_id} via {names[destination_id]}")
+            except Exception as e:
+                logger.warning(f"Failed to delete redirected messages via {names[destination_id]}: {e}")
+    
+    def is_route_active(self, user_id, name):
+        """Check whether a redirection is currently being forwarded"""
+        return (user_id, name) in self.routes
     
     async def add_redirection_handler(self, user_id, name, source_id, destination_id):
         """Add a new redirection handler for a user"""
@@ -225,17 +343,8 @@ class MessageRedirector:
             if not client or not client.is_connected():
                 return False
             
-            # Create handler for new messages
-            @client.on(events.NewMessage(chats=int(source_id)))
-            async def message_handler(event, dest_id=destination_id, redirect_name=name):
-                await self._handle_message_redirection(event, dest_id, redirect_name, user_id, is_edit=False)
-            
-            # Create handler for edited messages
-            @client.on(events.MessageEdited(chats=int(source_id)))
-            async def edit_handler(event, dest_id=destination_id, redirect_name=name):
-                await self._handle_message_redirection(event, dest_id, redirect_name, user_id, is_edit=True)
-            
-            logger.info(f"Added message and edit handlers for redirection {name}: {source_id} -> {destination_id}")
+            if self._register_route(client, user_id, name, source_id, destination_id):
+                logger.info(f"Routed redirection {name}: {source_id} -> {destination_id}")
             return True
             
         except Exception as e:
@@ -245,15 +354,52 @@ class MessageRedirector:
     async def remove_redirection_handler(self, user_id, name):
         """Remove a redirection handler for a user"""
         try:
-            # Note: Telethon doesn't provide direct handler removal
-            # In a production system, you would need to track handlers
-            # and remove them manually or restart the client
-            logger.info(f"Redirection handler removal requested for {name}")
+            if self.routes.unregister(user_id, name):
+                logger.info(f"Redirection handler removed for {name}")
             return True
             
         except Exception as e:
             logger.error(f"Error removing redirection handler: {e}")
             return False
+    
+    async def _on_redirection_change(self, event):
+        """Apply a stored redirection change to the live routes"""
+        if isinstance(event, RedirectionRemoved):
+            await self.remove_redirection_handler(event.user_id, event.name)
+            return
+        
+        record = event.record or {}
+        if isinstance(event, RedirectionChanged):
+            await self.remove_redirection_handler(event.user_id, event.name)
+        if record.get('active', True) and record.get('source_id') and record.get('destination_id'):
+            await self.add_redirection_handler(event.user_id, event.name, record['source_id'], record['destination_id'])
+    
+    async def _on_session_change(self, event):
+        """Wire or drop a user's redirections when their session comes and goes"""
+        if isinstance(event, SessionDeactivated):
+            self.routes.unregister_owner(event.user_id)
+            pollers.stop(event.user_id)
+            logger.info(f"Redirections paused for user {event.user_id}")
+            return
+        
+        connection_data = active_connections.get(event.user_id, {})
+        client = connection_data.get('client')
+        if not client or not client.is_connected():
+            return
+        user_redirections = (await get_all_redirections(user_id=event.user_id)).get(str(event.user_id), {})
+        await peer_cache.resolve(client, event.user_id, self._redirection_chat_ids(user_redirections))
+        count = await self._setup_client_handlers(client, event.user_id, user_redirections)
+        logger.info(f"Restored {count} redirections for user {event.user_id}")
+        self._start_catch_up(client, event.user_id)
+        self._start_polling(client, event.user_id)
+    
+    def _start_catch_up(self, client, user_id):
+        """Redirect in the background what the user's sources posted while they were not listened to"""
+        catch_ups.start(client, user_id, self.routes.routes_of(user_id), self._dispatch_message, self._dispatch_album)
+    
+    def _start_polling(self, client, user_id):
+        """Poll the user's sources in case their push updates stall"""
+        pollers.start(client, user_id, lambda: self.routes.routes_of(user_id), self._dispatch_message, self._dispatch_album)
 
 # Global message redirector instance
 message_redirector = MessageRedirector()
\ No newline at end of file
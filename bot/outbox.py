@@ -0,0 +1,280 @@
+"""
+Crash-safe outbox of redirections in flight
+
+A message is lost if the process dies between receiving it and its copy
+being sent, and its edits are lost if it dies before the copy is recorded in
+the message map. Before a new message is sent, the engines record an intent
+(scope, source, source message IDs, destination) in an append-only JSONL
+journal and wait until it is on disk; once the copy is sent and mapped, the
+intent is marked done with the destination message IDs. Appends are written
+and fsynced in batches by a background thread, so concurrent redirections
+share one fsync every OUTBOX_FSYNC_INTERVAL seconds.
+
+Intents still pending at startup are redirected again by the catch-up, and
+those whose send failed by the next poll (see bot.catchup.replay_outbox and
+bot.poller), up to MAX_ATTEMPTS times per run. Intents are keyed by (scope,
+source chat, first source message ID, destination), the same key as the
+message map and the engines' delivery claims: an intent whose copy is
+already mapped is only marked done, and a message is never recorded or sent
+twice in a process.
+A copy sent right before a crash that killed both its mapping and its done
+mark is sent again: delivery is at least once.
+
+The message map writes its batches to disk after the done mark, so done
+marks keep the copies' IDs: at startup, they are written back to the
+message map if the crash lost them, and edits still reach those copies.
+
+The journal is rewritten at startup and when it grows past compact_bytes,
+keeping the pending intents and the done marks not older than
+DONE_RETENTION seconds (or not restored yet).
+"""
+
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from config.settings import OUTBOX_FILE, OUTBOX_FSYNC_INTERVAL
+from bot.storage.journal_backend import _write_atomic
+
+logger = logging.getLogger(__name__)
+
+# Seconds a done mark outlives compaction: far longer than the message map takes to write its mappings
+DONE_RETENTION = 60
+
+# Failed sends of an intent before it is given up
+MAX_ATTEMPTS = 5
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class Outbox:
+    """Pending redirections, persisted as an fsynced journal of intents and done marks"""
+
+    def __init__(self, path, fsync_interval=0.02, compact_bytes=1024 * 1024):
+        self.path = path
+        self.fsync_interval = fsync_interval
+        self.compact_bytes = compact_bytes
+        self.lock = threading.Lock()
+        self._wakeup = threading.Condition(self.lock)
+        self._io_lock = threading.Lock()  # Serializes journal writes and compaction
+        self.pending, self._done = self._load()  # key -> intent, key -> done mark with copies
+        self._recovered = set(self.pending)  # Keys to redirect again: left pending by the previous run, or failed since
+        self._attempts = {}  # key -> failed sends in this run
+        self._unrestored = set(self._done)  # Done marks of the previous run not written back to the message map yet
+        if self._recovered:
+            logger.info(f"{len(self._recovered)} redirections left pending in {path}")
+        self._buffer = []
+        self._waiters = []  # (loop, future) resolved once the buffer is on disk
+        self._journal = None
+        self._journal_size = 0
+        self._thread = None
+        self._closed = False
+
+    @staticmethod
+    def _key(scope, source_id, message_id, destination_id):
+        return (str(scope), int(source_id), int(message_id), int(destination_id))
+
+    @classmethod
+    def _intent_key(cls, intent):
+        return cls._key(intent['scope'], intent['source'], intent['ids'][0], intent['destination'])
+
+    def _load(self):
+        """Replay the journal: intents without a done mark are pending"""
+        pending, done = {}, {}
+        if not os.path.exists(self.path):
+            return pending, done
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.endswith('\n'):
+                    # Torn write from a crash: the entry was never acknowledged as durable
+                    logger.warning(f"Ignoring incomplete outbox entry in {self.path}")
+                    break
+                try:
+                    entry = json.loads(line)
+                    key = self._intent_key(entry)
+                    if entry['op'] == 'intent':
+                        pending[key] = entry
+                        done.pop(key, None)
+                    else:
+                        pending.pop(key, None)
+                        if any(entry['copies']):
+                            done[key] = entry
+                except Exception as e:
+                    logger.error(f"Skipping invalid outbox entry: {e}")
+        return pending, done
+
+    def _start(self):
+        # Called under self.lock; the journal is rewritten on first use (see _open)
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._sync_loop, name="Outbox", daemon=True)
+        self._thread.start()
+
+    def _append(self, entry, waiter=None):
+        # Called under self.lock
+        self._buffer.append(json.dumps(entry, separators=(',', ':')) + '\n')
+        if waiter is not None:
+            self._waiters.append(waiter)
+        self._start()
+        self._wakeup.notify()
+
+    async def record(self, scope, source_id, message_ids, destination_id):
+        """Persist the intent to send messages (an album: all its IDs) to a destination; return once it is on disk"""
+        key = self._key(scope, source_id, message_ids[0], destination_id)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self.lock:
+            if key in self.pending or self._closed:
+                return  # Already durable (replayed intent), or shutting down
+            intent = {
+                'op': 'intent',
+                'scope': str(scope),
+                'source': int(source_id),
+                'ids': [int(message_id) for message_id in message_ids],
+                'destination': int(destination_id),
+                'at': time.time(),
+            }
+            self.pending[key] = intent
+            self._append(intent, (loop, future))
+        await future
+
+    def complete(self, scope, source_id, message_id, destination_id, copies=()):
+        """Mark an intent done with the destination message ID of each of its source messages
+
+        copies is aligned with the recorded message IDs (None where nothing
+        was sent), and empty if the send failed or was dropped.
+        """
+        key = self._key(scope, source_id, message_id, destination_id)
+        with self.lock:
+            intent = self.pending.pop(key, None)
+            if intent is None:
+                return
+            self._recovered.discard(key)
+            self._attempts.pop(key, None)
+            done = {
+                'op': 'done',
+                'scope': intent['scope'],
+                'source': intent['source'],
+                'ids': intent['ids'],
+                'destination': intent['destination'],
+                'copies': [None if copy is None else int(copy) for copy in copies],
+                'at': time.time(),
+            }
+            if any(done['copies']):
+                self._done[key] = done
+            self._append(done)
+
+    def retry(self, scope, source_id, message_id, destination_id):
+        """Keep the intent of a failed send pending, to be redirected again by the next replay;
+        after MAX_ATTEMPTS failures in a run it is given up"""
+        key = self._key(scope, source_id, message_id, destination_id)
+        with self.lock:
+            if key not in self.pending:
+                return
+            attempts = self._attempts[key] = self._attempts.get(key, 0) + 1
+            if attempts < MAX_ATTEMPTS:
+                self._recovered.add(key)
+                return
+        logger.error(f"Giving up on messages {self.pending.get(key, {}).get('ids')} of {source_id} for {scope} "
+                     f"to {destination_id} after {attempts} failed sends")
+        self.complete(scope, source_id, message_id, destination_id)
+
+    def take_recovered(self, scope):
+        """Intents of a scope to redirect again, oldest source message first; each is returned once"""
+        scope = str(scope)
+        with self.lock:
+            keys = sorted(key for key in self._recovered if key[0] == scope)
+            self._recovered.difference_update(keys)
+            return [self.pending[key] for key in keys if key in self.pending]
+
+    def take_copies(self, scope):
+        """Done marks of a scope from the previous run, to write their copies back to the message map; each is returned once"""
+        scope = str(scope)
+        with self.lock:
+            keys = [key for key in self._unrestored if key[0] == scope]
+            self._unrestored.difference_update(keys)
+            return [self._done[key] for key in keys if key in self._done]
+
+    # Persistence
+    def _open(self):
+        # Called under self._io_lock: start the journal over with the pending intents
+        with self.lock:
+            horizon = time.time() - DONE_RETENTION
+            self._done = {
+                key: done for key, done in self._done.items()
+                if done.get('at', 0) >= horizon or key in self._unrestored
+            }
+            entries = list(self._done.values()) + list(self.pending.values())
+            payload = ''.join(json.dumps(entry, separators=(',', ':')) + '\n' for entry in entries)
+            self._buffer = []
+            waiters, self._waiters = self._waiters, []
+        _write_atomic(self.path, payload)
+        if self._journal is not None:
+            self._journal.close()
+        self._journal = open(self.path, 'a', encoding='utf-8')
+        self._journal_size = len(payload.encode('utf-8'))
+        return waiters
+
+    def _write_buffer(self):
+        """Append buffered entries to the journal and fsync them as one batch"""
+        with self._io_lock:
+            if self._journal is None or self._journal_size > self.compact_bytes:
+                waiters = self._open()
+            else:
+                with self.lock:
+                    pending, self._buffer = self._buffer, []
+                    waiters, self._waiters = self._waiters, []
+                if pending:
+                    payload = ''.join(pending)
+                    self._journal.write(payload)
+                    self._journal.flush()
+                    os.fsync(self._journal.fileno())
+                    self._journal_size += len(payload.encode('utf-8'))
+        return waiters
+
+    def _sync_loop(self):
+        while True:
+            with self.lock:
+                while not self._buffer and not self._closed:
+                    self._wakeup.wait()
+                closed = self._closed
+            if not closed:
+                # Let concurrent redirections accumulate so one fsync covers the batch
+                time.sleep(self.fsync_interval)
+            try:
+                waiters = self._write_buffer()
+            except Exception as e:
+                # Redirections go on without durability rather than stall on a disk error
+                logger.error(f"Error writing outbox {self.path}: {e}")
+                with self.lock:
+                    waiters, self._waiters = self._waiters, []
+            for loop, future in waiters:
+                try:
+                    loop.call_soon_threadsafe(_resolve, future)
+                except RuntimeError:
+                    pass  # Loop already closed
+            if closed:
+                return
+
+    def stats(self):
+        return {'pending': len(self.pending), 'recovered': len(self._recovered)}
+
+    def close(self):
+        """Write the last entries and stop the writer thread (call on shutdown)"""
+        with self.lock:
+            self._closed = True
+            self._wakeup.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout=5)
+            if self._journal is not None:
+                self._journal.close()
+
+
+# Global outbox instance
+outbox = Outbox(OUTBOX_FILE, OUTBOX_FSYNC_INTERVAL)
@@ -0,0 +1,198 @@
+"""
+Persistent cache of resolved peers with batched resolution
+
+Stores, per account (a user ID, or "bot" for the bot client), every chat a
+redirection touches: its type, access hash and title. Entries survive
+restarts (peer_cache.json) and are handed to the client's session, so
+startup does not look up each source and destination again. Missing or stale peers are resolved in batches: one
+channels.GetChannels / messages.GetChats / users.GetUsers call per 100
+peers, and resolve_all() runs the batches of several clients concurrently.
+"""
+
+import asyncio
+import logging
+import time
+from dataclasses import asdict, dataclass
+from typing import Optional
+from telethon import errors, functions, types, utils
+from config.settings import PEER_CACHE_FILE, PEER_CACHE_MAX_AGE, DATA_FLUSH_DELAY
+from bot.entity_cache import entity_cache, entity_name
+from bot.scheduler import Priority, schedule
+from bot.storage import get_json_store
+
+logger = logging.getLogger(__name__)
+
+# Peers per GetChannels/GetChats/GetUsers request
+BATCH_SIZE = 100
+# FloodWaits up to this many seconds are waited out once; longer ones skip the batch
+MAX_FLOOD_WAIT = 30
+
+
+@dataclass
+class PeerInfo:
+    """A resolved chat; has a title so it can stand in for the entity in name lookups"""
+
+    chat_id: int  # Marked ID (-100... for channels)
+    type: str  # "channel", "chat" or "user"
+    access_hash: Optional[int]
+    title: str
+    resolved_at: float
+
+    @property
+    def input_peer(self):
+        real_id = utils.resolve_id(self.chat_id)[0]
+        if self.type == "channel":
+            return types.InputPeerChannel(real_id, self.access_hash or 0)
+        if self.type == "chat":
+            return types.InputPeerChat(real_id)
+        return types.InputPeerUser(real_id, self.access_hash or 0)
+
+    @classmethod
+    def from_entity(cls, entity):
+        if isinstance(entity, (types.Channel, types.ChannelForbidden)):
+            peer_type = "channel"
+        elif isinstance(entity, (types.Chat, types.ChatForbidden)):
+            peer_type = "chat"
+        else:
+            peer_type = "user"
+        chat_id = utils.get_peer_id(entity)
+        return cls(chat_id, peer_type, getattr(entity, 'access_hash', None), entity_name(entity, chat_id), time.time())
+
+
+class PeerCache:
+    """Resolved peers per account, persisted as JSON"""
+
+    def __init__(self, path, max_age=24 * 3600, flush_delay=1.0):
+        self.max_age = max_age
+        self.store = get_json_store(path, dict, flush_delay)
+
+    def get(self, scope, chat_id, allow_stale=False):
+        record = self.store.data.get(str(scope), {}).get(str(int(chat_id)))
+        if record is None:
+            return None
+        info = PeerInfo(**record)
+        if not allow_stale and time.time() - info.resolved_at > self.max_age:
+            return None
+        return info
+
+    def put(self, scope, info):
+        with self.store.lock:
+            self.store.data.setdefault(str(scope), {})[str(info.chat_id)] = asdict(info)
+        self.store.mark_dirty()
+
+    async def resolve(self, client, scope, chat_ids):
+        """Resolve chats for one client; return {chat_id: PeerInfo} for those that resolved"""
+        resolved = {}
+        missing = []
+        for chat_id in {int(chat_id) for chat_id in chat_ids}:
+            info = self.get(scope, chat_id)
+            if info:
+                # Known from a previous run: stands in for the entity until one is fetched
+                entity_cache.put(client, chat_id, info)
+                resolved[chat_id] = info
+            else:
+                missing.append(chat_id)
+        warm = [info.input_peer for info in resolved.values() if info.type == "chat" or info.access_hash is not None]
+        if warm:
+            # Hand the access hashes to Telethon, so requests to these chats need no lookup
+            client.session.process_entities(warm)
+
+        if missing:
+            by_type = {types.PeerChannel: [], types.PeerChat: [], types.PeerUser: []}
+            for chat_id in missing:
+                by_type[utils.resolve_id(chat_id)[1]].append(chat_id)
+
+            is_bot = await client.is_bot()
+            for peer_type, chat_ids in by_type.items():
+                for start in range(0, len(chat_ids), BATCH_SIZE):
+                    batch = chat_ids[start:start + BATCH_SIZE]
+                    for entity in await self._fetch_batch(client, scope, peer_type, batch, is_bot):
+                        info = PeerInfo.from_entity(entity)
+                        self.put(scope, info)
+                        entity_cache.put(client, info.chat_id, entity)
+                        resolved[info.chat_id] = info
+
+            # Peers without a known access hash get a single lookup (negative results are cached)
+            for chat_id in missing:
+                if chat_id not in resolved:
+                    entity = await entity_cache.get_entity(client, chat_id)
+                    if entity is not None:
+                        info = PeerInfo.from_entity(entity)
+                        self.put(scope, info)
+                        resolved[chat_id] = info
+            logger.info(f"Resolved {len(missing)} peers for {scope} in batches ({len(resolved)} total known)")
+        return resolved
+
+    async def resolve_all(self, jobs):
+        """Resolve [(client, scope, chat_ids), ...] concurrently; return {scope: {chat_id: PeerInfo}}"""
+        results = await asyncio.gather(
+            *(self.resolve(client, scope, chat_ids) for client, scope, chat_ids in jobs),
+            return_exceptions=True,
+        )
+        resolved = {}
+        for (_, scope, _), result in zip(jobs, results):
+            if isinstance(result, Exception):
+                logger.error(f"Error resolving peers for {scope}: {result}")
+                continue
+            resolved[scope] = result
+        return resolved
+
+    def _input_hash(self, client, scope, chat_id, is_bot):
+        """Access hash from the stale cache entry or the session, if any"""
+        stale = self.get(scope, chat_id, allow_stale=True)
+        if stale and stale.access_hash is not None:
+            return stale.access_hash
+        try:
+            return getattr(client.session.get_input_entity(chat_id), 'access_hash', 0)
+        except (ValueError, KeyError):
+            # Bots may use access hash 0 for chats they belong to
+            return 0 if is_bot else None
+
+    def _batch_request(self, client, scope, peer_type, chat_ids, is_bot):
+        if peer_type is types.PeerChat:
+            return functions.messages.GetChatsRequest([utils.resolve_id(chat_id)[0] for chat_id in chat_ids])
+
+        inputs = []
+        for chat_id in chat_ids:
+            access_hash = self._input_hash(client, scope, chat_id, is_bot)
+            if access_hash is None:
+                continue
+            real_id = utils.resolve_id(chat_id)[0]
+            if peer_type is types.PeerChannel:
+                inputs.append(types.InputChannel(real_id, access_hash))
+            else:
+                inputs.append(types.InputUser(real_id, access_hash))
+        if not inputs:
+            return None
+        if peer_type is types.PeerChannel:
+            return functions.channels.GetChannelsRequest(inputs)
+        return functions.users.GetUsersRequest(inputs)
+
+    async def _fetch_batch(self, client, scope, peer_type, chat_ids, is_bot):
+        """One request for a batch of peers of the same type; [] if it cannot be made or fails"""
+        request = self._batch_request(client, scope, peer_type, chat_ids, is_bot)
+        if request is None:
+            return []
+        for attempt in range(2):
+            try:
+                result = await schedule(client, Priority.LIVE, lambda: client(request))
+                # GetChannels/GetChats return messages.Chats; GetUsers a plain list
+                return list(getattr(result, 'chats', result))
+            except errors.FloodWaitError as e:
+                if attempt or e.seconds > MAX_FLOOD_WAIT:
+                    logger.warning(f"FloodWait of {e.seconds}s resolving peers for {scope}, skipping batch")
+                    return []
+                await asyncio.sleep(e.seconds)
+            except Exception as e:
+                if len(chat_ids) == 1:
+                    logger.warning(f"Cannot resolve chat {chat_ids[0]} for {scope}: {e}")
+                    return []
+                # One inaccessible peer fails the whole batch: split it to isolate that peer
+                half = len(chat_ids) // 2
+                return (await self._fetch_batch(client, scope, peer_type, chat_ids[:half], is_bot)
+                        + await self._fetch_batch(client, scope, peer_type, chat_ids[half:], is_bot))
+        return []
+
+
+# Global peer cache instance
+peer_cache = PeerCache(PEER_CACHE_FILE, PEER_CACHE_MAX_AGE, DATA_FLUSH_DELAY)
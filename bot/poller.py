@@ -0,0 +1,165 @@
+"""
+Polling fallback for sources that do not deliver push updates
+
+Telegram does not reliably push updates of large channels an account joined
+long ago or rarely reads, so their redirections can stall silently. Each
+account polls its sources for messages newer than their catch-up checkpoints
+(see bot.catchup) and hands what push updates missed to the engine's normal
+pipeline. Checkpoints of new routes are seeded with their source's newest
+message when they are registered, so a source that never pushes anything
+is polled from the start.
+
+Intervals adapt per source: a source where polling found new messages is
+polled again after POLL_MIN_INTERVAL seconds; every quiet poll doubles its
+interval, up to POLL_MAX_INTERVAL. Push updates keep checkpoints current, so
+sources that deliver them stay quiet for the poller and cost one history
+request per POLL_MAX_INTERVAL. Duplicates between push and polling are
+dropped by the message map and the engines' delivery claims.
+
+Checkpoints only move forward, so a message whose send failed is not found
+again by polling: its intent stays pending in the outbox (see bot.outbox),
+and the poller redirects those again every RETRY_INTERVAL seconds.
+"""
+
+import asyncio
+import logging
+import time
+from config.settings import POLL_MIN_INTERVAL, POLL_MAX_INTERVAL, CATCHUP_MAX_BACKLOG
+from bot.catchup import checkpoints, fetch_since, redirect_backlog, replay_outbox
+from bot.scheduler import Priority
+
+logger = logging.getLogger(__name__)
+
+# Seconds between retries of the sends that failed (see bot.outbox)
+RETRY_INTERVAL = 60
+
+
+class SourcePoller:
+    """Polls the sources of one account's routes with adaptive intervals"""
+
+    def __init__(self, client, scope, get_routes, on_message, on_album):
+        """get_routes() returns the account's current routes; on_message/on_album are the engine's dispatch callbacks"""
+        self.client = client
+        self.scope = scope
+        self.get_routes = get_routes
+        self.on_message = on_message
+        self.on_album = on_album
+        self.sources = {}  # source_id -> {'interval', 'due', 'seen'}
+        self.task = None
+        self.retry_due = time.monotonic() + RETRY_INTERVAL
+        self.polls = 0
+        self.recovered = 0
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self._loop())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def _loop(self):
+        while True:
+            routes = self.get_routes()
+            by_source = {}
+            for route in routes:
+                by_source.setdefault(route['source_id'], []).append(route)
+
+            now = time.monotonic()
+            if routes and self.retry_due <= now and self.client.is_connected():
+                self.retry_due = now + RETRY_INTERVAL
+                await self._retry_failed(routes)
+            for source_id in list(self.sources):
+                if source_id not in by_source:
+                    del self.sources[source_id]
+            for source_id, routes in by_source.items():
+                state = self.sources.setdefault(
+                    source_id, {'interval': POLL_MIN_INTERVAL, 'due': now + POLL_MIN_INTERVAL, 'seen': 0}
+                )
+                if state['due'] <= now and self.client.is_connected():
+                    await self._poll(source_id, routes, state)
+
+            now = time.monotonic()
+            wait = min((state['due'] for state in self.sources.values()), default=now + POLL_MAX_INTERVAL) - now
+            # Wake up at least every POLL_MIN_INTERVAL to pick up new routes
+            await asyncio.sleep(min(max(wait, 0.5), POLL_MIN_INTERVAL))
+
+    async def _retry_failed(self, routes):
+        """Redirect again the messages whose send failed (see Outbox.retry)"""
+        try:
+            self.recovered += await replay_outbox(self.client, self.scope, routes, self.on_message, self.on_album)
+        except Exception as e:
+            logger.warning(f"Retrying failed sends for {self.scope} failed: {e}")
+
+    async def _poll(self, source_id, routes, state):
+        marks = {
+            route['destination_id']: checkpoints.get(self.scope, source_id, route['destination_id'])
+            for route in routes
+        }
+        # Routes whose checkpoint is not seeded yet (see bot.catchup.seed_checkpoint) have no starting point
+        marks = {destination_id: mark for destination_id, mark in marks.items() if mark is not None}
+        routes = [route for route in routes if route['destination_id'] in marks]
+
+        active = False
+        if marks:
+            self.polls += 1
+            try:
+                messages = await fetch_since(
+                    self.client, source_id, min(marks.values()), CATCHUP_MAX_BACKLOG, Priority.BACKGROUND
+                )
+                # Activity is what this poller has not seen yet; failed sends are retried from the outbox
+                active = bool(messages) and messages[-1].id > state['seen']
+                if messages:
+                    state['seen'] = max(state['seen'], messages[-1].id)
+                    handed = await redirect_backlog(
+                        self.scope, source_id, routes, marks, messages, self.on_message, self.on_album, Priority.LIVE
+                    )
+                    if handed:
+                        self.recovered += handed
+                        logger.info(f"Polling recovered {handed} messages from {source_id} for {self.scope}")
+            except Exception as e:
+                logger.warning(f"Polling {source_id} for {self.scope} failed: {e}")
+
+        state['interval'] = POLL_MIN_INTERVAL if active else min(state['interval'] * 2, POLL_MAX_INTERVAL)
+        state['due'] = time.monotonic() + state['interval']
+
+    def stats(self):
+        return {
+            'scope': self.scope,
+            'sources': len(self.sources),
+            'polls': self.polls,
+            'recovered': self.recovered,
+        }
+
+
+class Pollers:
+    """One SourcePoller per account (user ID, or "bot")"""
+
+    def __init__(self):
+        self._pollers = {}  # scope -> SourcePoller
+
+    def start(self, client, scope, get_routes, on_message, on_album):
+        """Start polling an account's sources; restarts the poller if the account switched client"""
+        if POLL_MIN_INTERVAL <= 0:
+            return
+        poller = self._pollers.get(scope)
+        if poller is not None and poller.client is client:
+            poller.start()
+            return
+        if poller is not None:
+            poller.stop()
+        poller = self._pollers[scope] = SourcePoller(client, scope, get_routes, on_message, on_album)
+        poller.start()
+
+    def stop(self, scope):
+        poller = self._pollers.pop(scope, None)
+        if poller is not None:
+            poller.stop()
+
+    def stats(self):
+        return [poller.stats() for poller in self._pollers.values()]
+
+
+# Global pollers instance
+pollers = Pollers()
@@ -1,4 +1,5 @@
 import logging
+from datetime import datetime, timezone
 from telethon import events
 from telethon.errors import ChannelInvalidError, UsernameNotOccupiedError
 
@@ -30,6 +31,17 @@ Commande utilisée pour configurer les redirections. Vous devez utiliser la comm
 
 **Afficher les redirections actives :**
 `/redirection 2759205517`
+
+**Copier l'historique du canal source (tout, les N derniers messages ou depuis une date) :**
+`/redirection backfill groupe1 on 2759205517`
+`/redirection backfill groupe1 on 2759205517 5000`
+`/redirection backfill groupe1 on 2759205517 since 2024-01-31`
+
+**Suivre, mettre en pause, reprendre ou annuler la copie :**
+`/redirection backfill groupe1 on 2759205517 status`
+`/redirection backfill groupe1 on 2759205517 pause`
+`/redirection backfill groupe1 on 2759205517 resume`
+`/redirection backfill groupe1 on 2759205517 cancel`
             """
             await event.respond(usage_message)
             return
@@ -47,6 +59,8 @@ Commande utilisée pour configurer les redirections. Vous devez utiliser la comm
             await remove_redirection(event, client, parts[2], parts[4])
         elif parts[1] == "change" and len(parts) == 5 and parts[3] == "on":
             await change_redirection(event, client, parts[2], parts[4])
+        elif parts[1] == "backfill" and 5 <= len(parts) <= 7 and parts[3] == "on":
+            await backfill_redirection(event, client, parts[2], parts[4], parts[5:])
         elif len(parts) == 2 and parts[1].isdigit():
             await show_redirections(event, client, parts[1])
         else:
@@ -201,6 +215,83 @@ Aucune redirection active pour ce numéro.
 
 
 
+async def backfill_redirection(event, client, name, phone_number, args):
+    """Start or control the copy of a redirection's source history"""
+    try:
+        from bot.backfill import backfill_jobs
+        user_id = event.sender_id
+        
+        if len(args) == 1 and args[0] in ("status", "pause", "resume", "cancel"):
+            action = args[0]
+            job = backfill_jobs.get(user_id, name)
+            if not job:
+                await event.respond(f"❌ Aucune copie d'historique pour la redirection '{name}'.")
+                return
+            if action == "status":
+                states = {"running": "En cours", "paused": "En pause", "cancelled": "Annulée", "done": "Terminée", "failed": "Interrompue"}
+                await event.respond(f"🔄 **Backfill {name} :** {states.get(job['state'], job['state'])}\n\n{backfill_jobs.describe(job)}")
+            elif action == "pause":
+                ok = backfill_jobs.pause(user_id, name)
+                await event.respond("⏸️ Mise en pause demandée." if ok else "❌ Cette copie n'est pas en cours.")
+            elif action == "resume":
+                ok = backfill_jobs.resume(client, user_id, name)
+                await event.respond("▶️ Copie reprise." if ok else "❌ Cette copie ne peut pas être reprise.")
+            else:
+                ok = backfill_jobs.cancel(user_id, name)
+                await event.respond("🛑 Annulation demandée." if ok else "❌ Cette copie est déjà terminée.")
+            return
+        
+        count, since = None, None
+        if len(args) == 1 and args[0].isdigit() and int(args[0]) > 0:
+            count = int(args[0])
+        elif len(args) == 2 and args[0] == "since":
+            for date_format in ("%Y-%m-%d", "%d/%m/%Y"):
+                try:
+                    since = datetime.strptime(args[1], date_format).replace(tzinfo=timezone.utc)
+                    break
+                except ValueError:
+                    continue
+            if since is None:
+                await event.respond("❌ Date invalide. Utilisez le format `AAAA-MM-JJ` (ex : `2024-01-31`).")
+                return
+        elif args:
+            await event.respond("❌ Format incorrect. Tapez `/redirection` pour voir l'utilisation.")
+            return
+        
+        from bot.database import get_all_redirections
+        redirection = (await get_all_redirections(user_id=user_id)).get(str(user_id), {}).get(name)
+        if not redirection or str(redirection.get('phone')) != str(phone_number):
+            await event.respond(f"❌ **Redirection introuvable**\n\nAucune redirection nommée '{name}' trouvée pour le numéro {phone_number}.")
+            return
+        if not redirection.get('source_id') or not redirection.get('destination_id'):
+            await event.respond(f"❌ La redirection '{name}' n'a pas encore de canaux source et destination.")
+            return
+        
+        started = backfill_jobs.start(
+            client, user_id, name, phone_number, redirection['source_id'], redirection['destination_id'],
+            event.chat_id, count=count, since=since,
+        )
+        if not started:
+            await event.respond(f"⚠️ Une copie est déjà en cours pour '{name}'. Tapez `/redirection backfill {name} on {phone_number} status`.")
+            return
+        
+        scope = f"les {count} derniers messages" if count else f"les messages depuis le {since:%d/%m/%Y}" if since else "tout l'historique"
+        await event.respond(f"""
+📥 **Copie de l'historique lancée**
+
+📝 **Redirection :** {name}
+🔄 **Canal source :** {redirection['source_id']}
+🎯 **Canal destination :** {redirection['destination_id']}
+📚 **Étendue :** {scope}
+
+La copie tourne en arrière-plan, par lots de 100 messages. Vous recevrez sa progression ici.
+        """)
+        logger.info(f"Backfill started by user {user_id}: {name} on {phone_number} (count={count}, since={since})")
+        
+    except Exception as e:
+        logger.error(f"Error in redirection backfill: {e}")
+        await event.respond("❌ Erreur lors de la copie de l'historique.")
+
 async def store_redirection(user_id, name, phone_number, action, channel_name=None, source_id=None, destination_id=None):
     """Store redirection in database"""
     from bot.database import store_redirection as db_store_redirection
@@ -272,15 +363,17 @@ async def handle_redirection_format(event, client, source_id, destination_id):
         elif destination_id.isdigit():
             destination_id = f"-{destination_id}"
         
+        # Importing the redirector subscribes it to the change bus before the redirection is stored
+        from bot.message_handler import message_redirector
+        
         # Store complete redirection with channel IDs
         await store_redirection(user_id, name, phone_number, "add", channel_name, source_id, destination_id)
         
         # Clear pending redirection
         await clear_pending_redirection(user_id)
         
-        # Set up message redirection handler with the user's client
-        from bot.message_handler import message_redirector
-        handler_added = await message_redirector.add_redirection_handler(user_id, name, source_id, destination_id)
+        # The stored redirection is wired live through the change bus
+        handler_added = message_redirector.is_route_active(user_id, name)
         
         success_message = f"""
 ✅ **Redirection configurée avec succès**
@@ -7,7 +7,7 @@ import logging
 import asyncio
 import os
 from telethon import TelegramClient
-from bot.database import load_data
+from bot.database import get_all_redirections
 from bot.connection import active_connections, store_connection_client
 from config.settings import API_ID, API_HASH
 
@@ -26,8 +26,7 @@ class RedirectionRestorer:
             logger.info("🔄 Démarrage de la restauration automatique des redirections")
             
             # Charger les données
-            data = load_data()
-            redirections = data.get("redirections", {})
+            redirections = await get_all_redirections()
             
             if not redirections:
                 logger.info("Aucune redirection à restaurer")
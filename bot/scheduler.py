@@ -0,0 +1,183 @@
+"""
+Account-wide API call scheduler
+
+Every API call a module makes through a client (redirection sends, /chats
+dialogs, invite link resolution, entity and peer lookups) is admitted by
+that client's ClientScheduler. Calls are admitted in priority order:
+
+    INTERACTIVE  commands a user is waiting on
+    LIVE         forwarding of new messages
+    BACKFILL     catch-up and backfill of older messages
+    BACKGROUND   lookups for logs and maintenance
+
+under one token bucket per account, so the account's request rate is
+bounded as a whole. A FloodWaitError backs off the class that hit it and
+every lower class for the requested time; higher classes keep running.
+Waiting calls gain one class every AGING_SECONDS, so no class starves.
+"""
+
+import asyncio
+import itertools
+import logging
+import time
+import weakref
+from enum import IntEnum
+from telethon import errors
+from config.settings import API_RATE_PER_CLIENT, API_BURST_PER_CLIENT
+
+logger = logging.getLogger(__name__)
+
+# Seconds of waiting after which a call is treated as one class more urgent
+AGING_SECONDS = 5.0
+
+
+class TokenBucket:
+    """Refills rate tokens per second up to capacity; can be paused until a FloodWait ends"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self):
+        """Seconds until a token can be taken"""
+        now = time.monotonic()
+        self._refill(now)
+        wait = max(0.0, self.paused_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def take(self):
+        self.tokens -= 1
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+    async def acquire(self):
+        """Wait for a token and take it"""
+        while True:
+            wait = self.delay()
+            if wait <= 0:
+                self.take()
+                return
+            await asyncio.sleep(wait)
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0
+    LIVE = 1
+    BACKFILL = 2
+    BACKGROUND = 3
+
+
+class ClientScheduler:
+    """Admits one client's API calls by priority under a shared budget and FloodWait backoff"""
+
+    def __init__(self, rate, capacity):
+        self.bucket = TokenBucket(rate, capacity)
+        self.paused_until = {priority: 0.0 for priority in Priority}
+        self._waiters = []  # [priority, seq, enqueued_at, future]
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._pump_task = None
+        self.admitted = {priority: 0 for priority in Priority}
+        self.flood_waits = 0
+
+    async def run(self, priority, call):
+        """Wait for admission, then run call (a no-argument coroutine function)"""
+        await self._admit(Priority(priority))
+        try:
+            return await call()
+        except errors.FloodWaitError as e:
+            self.backoff(priority, e.seconds)
+            raise
+
+    def backoff(self, priority, seconds):
+        """Pause a class and all lower classes after a FloodWait"""
+        self.flood_waits += 1
+        until = time.monotonic() + seconds
+        for other in Priority:
+            if other >= priority:
+                self.paused_until[other] = max(self.paused_until[other], until)
+        logger.warning(f"FloodWait of {seconds}s: {Priority(priority).name} and lower calls paused")
+        self._wakeup.set()
+
+    async def _admit(self, priority):
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append([priority, next(self._seq), time.monotonic(), future])
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.ensure_future(self._pump())
+        else:
+            self._wakeup.set()
+        await future
+
+    def _effective(self, waiter, now):
+        return waiter[0] - int((now - waiter[2]) / AGING_SECONDS), waiter[1]
+
+    async def _pump(self):
+        while True:
+            self._waiters = [waiter for waiter in self._waiters if not waiter[3].done()]
+            if not self._waiters:
+                return
+            now = time.monotonic()
+            ready = [waiter for waiter in self._waiters if self.paused_until[waiter[0]] <= now]
+            if ready:
+                wait = self.bucket.delay()
+            else:
+                wait = min(self.paused_until[waiter[0]] for waiter in self._waiters) - now
+            if wait > 0:
+                # A new waiter or a backoff may change the decision before the wait ends
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            waiter = min(ready, key=lambda waiter: self._effective(waiter, now))
+            self._waiters.remove(waiter)
+            self.bucket.take()
+            self.admitted[waiter[0]] += 1
+            waiter[3].set_result(None)
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            'waiting': {
+                priority.name: sum(1 for waiter in self._waiters if waiter[0] == priority and not waiter[3].done())
+                for priority in Priority
+            },
+            'admitted': {priority.name: count for priority, count in self.admitted.items()},
+            'paused_for': {
+                priority.name: round(until - now, 1) for priority, until in self.paused_until.items() if until > now
+            },
+            'flood_waits': self.flood_waits,
+        }
+
+
+_schedulers = weakref.WeakKeyDictionary()  # client -> ClientScheduler
+
+
+def scheduler_for(client):
+    """Return the scheduler shared by every caller of this client"""
+    scheduler = _schedulers.get(client)
+    if scheduler is None:
+        scheduler = _schedulers[client] = ClientScheduler(API_RATE_PER_CLIENT, API_BURST_PER_CLIENT)
+    return scheduler
+
+
+async def schedule(client, priority, call):
+    """Run an API call through the client's scheduler"""
+    return await scheduler_for(client).run(priority, call)
+
+
+def scheduler_stats():
+    return [scheduler.stats() for scheduler in list(_schedulers.values())]
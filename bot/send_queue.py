@@ -0,0 +1,149 @@
+"""
+Per-destination outbound send queues with token-bucket rate limiting
+
+Every send, forward, edit or delete towards a destination chat goes through
+that destination's FIFO queue. One worker per queue drains it, taking a
+token from the destination's bucket (Telegram's per-chat limit) before each
+call, which is then admitted by the client's account-wide scheduler (see
+bot.scheduler). On FloodWaitError the destination bucket is paused for the
+requested time and the same call is retried (up to MAX_FLOOD_RETRIES times),
+so bursts are delayed instead of dropped. A worker exits once its queue has
+been empty for IDLE_TIMEOUT seconds, and the next call starts a new one.
+
+stats() reports queue depth, wait times and pauses for monitoring.
+"""
+
+import asyncio
+import logging
+import time
+import weakref
+from telethon import errors
+from config.settings import SEND_RATE_PER_CHAT, SEND_BURST_PER_CHAT
+from bot.scheduler import Priority, TokenBucket, scheduler_for
+
+logger = logging.getLogger(__name__)
+
+# Seconds an empty queue keeps its worker
+IDLE_TIMEOUT = 60
+
+# FloodWaits a call sits out before its error is raised to the caller
+MAX_FLOOD_RETRIES = 5
+
+
+class SendQueue:
+    """FIFO of calls to one destination chat, drained by a single worker"""
+
+    def __init__(self, client, destination_id):
+        self._client = weakref.ref(client)  # Queues are dropped along with their client
+        self.destination_id = destination_id
+        self.bucket = TokenBucket(SEND_RATE_PER_CHAT, SEND_BURST_PER_CHAT)
+        self.queue = asyncio.Queue()
+        self.worker = None
+        # Monitoring
+        self.sent = 0
+        self.flood_waits = 0
+        self.last_wait = 0.0
+        self.max_wait = 0.0
+
+    def submit(self, call, priority=Priority.LIVE):
+        """Queue call (a no-argument coroutine function); return a future of its result"""
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((call, priority, future, time.monotonic()))
+        if self.worker is None or self.worker.done():
+            self.worker = asyncio.ensure_future(self._drain())
+        return future
+
+    async def _drain(self):
+        while True:
+            try:
+                call, priority, future, enqueued_at = await asyncio.wait_for(self.queue.get(), IDLE_TIMEOUT)
+            except asyncio.TimeoutError:
+                if self.queue.empty():
+                    return  # submit() starts a new worker
+                continue
+            if future.cancelled():
+                continue
+            flood_waits = 0
+            while True:
+                await self.bucket.acquire()
+                client = self._client()
+                if client is None:
+                    future.cancel()
+                    break
+                try:
+                    result = await scheduler_for(client).run(priority, call)
+                except errors.FloodWaitError as e:
+                    self.flood_waits += 1
+                    self.bucket.pause(e.seconds)
+                    flood_waits += 1
+                    if flood_waits <= MAX_FLOOD_RETRIES:
+                        logger.warning(f"FloodWait of {e.seconds}s sending to {self.destination_id}, retrying after it")
+                        continue
+                    logger.error(f"Giving up a call to {self.destination_id} after {flood_waits} FloodWaits")
+                    if not future.cancelled():
+                        future.set_exception(e)
+                except Exception as e:
+                    if not future.cancelled():
+                        future.set_exception(e)
+                else:
+                    self.sent += 1
+                    if not future.cancelled():
+                        future.set_result(result)
+                break
+            self.last_wait = time.monotonic() - enqueued_at
+            self.max_wait = max(self.max_wait, self.last_wait)
+
+    async def close(self):
+        """Stop the worker and cancel the calls still queued"""
+        while not self.queue.empty():
+            _, _, future, _ = self.queue.get_nowait()
+            future.cancel()
+        if self.worker is not None and not self.worker.done():
+            self.worker.cancel()
+            await asyncio.gather(self.worker, return_exceptions=True)
+        self.worker = None
+
+    def stats(self):
+        return {
+            'destination_id': self.destination_id,
+            'depth': self.queue.qsize(),
+            'sent': self.sent,
+            'flood_waits': self.flood_waits,
+            'last_wait': round(self.last_wait, 3),
+            'max_wait': round(self.max_wait, 3),
+            'paused_for': round(max(0.0, self.bucket.paused_until - time.monotonic()), 1),
+        }
+
+
+class SendQueues:
+    """Send queues per (client, destination)"""
+
+    def __init__(self):
+        self._queues = weakref.WeakKeyDictionary()  # client -> {destination_id: SendQueue}
+
+    def _queue(self, client, destination_id):
+        queues = self._queues.setdefault(client, {})
+        queue = queues.get(destination_id)
+        if queue is None:
+            queue = queues[destination_id] = SendQueue(client, destination_id)
+        return queue
+
+    def enqueue(self, client, destination_id, call, priority=Priority.LIVE):
+        """Queue call behind earlier ones for the destination; return a future of its result"""
+        return self._queue(client, int(destination_id)).submit(call, priority)
+
+    async def submit(self, client, destination_id, call, priority=Priority.LIVE):
+        """Run call through the destination's queue and return its result"""
+        return await self.enqueue(client, destination_id, call, priority)
+
+    async def close(self):
+        """Stop every worker (call on shutdown)"""
+        await asyncio.gather(*(queue.close() for queues in list(self._queues.values()) for queue in queues.values()))
+
+    def stats(self):
+        """Per-queue monitoring data for every client"""
+        return [queue.stats() for queues in list(self._queues.values()) for queue in queues.values()]
+
+
+# Global send queues instance
+send_queues = SendQueues()
@@ -1,69 +1,35 @@
 import logging
 import os
 import asyncio
-import json
 from telethon import TelegramClient
-from bot.database import load_data, save_data
+from bot.storage import get_backend, session_key as make_session_key
+from bot.change_bus import change_bus, SessionActivated, SessionDeactivated
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
 class SessionManager:
-    """Manages persistent Telegram sessions using local file storage"""
+    """Manages persistent Telegram sessions using the configured storage backend"""
     
     def __init__(self):
         self.sessions = {}  # In-memory active sessions
-        self.sessions_file = "telegram_sessions.json"
-        self._init_storage()
-    
-    def _init_storage(self):
-        """Initialize local file storage for sessions"""
-        try:
-            if not os.path.exists(self.sessions_file):
-                with open(self.sessions_file, 'w') as f:
-                    json.dump({}, f)
-                logger.info("Session storage file created")
-            else:
-                logger.info("Session storage file found")
-        except Exception as e:
-            logger.error(f"Error initializing session storage: {e}")
-    
-    def _load_sessions(self):
-        """Load sessions from local file"""
-        try:
-            with open(self.sessions_file, 'r') as f:
-                return json.load(f)
-        except Exception as e:
-            logger.error(f"Error loading sessions: {e}")
-            return {}
-    
-    def _save_sessions(self, sessions_data):
-        """Save sessions to local file"""
-        try:
-            with open(self.sessions_file, 'w') as f:
-                json.dump(sessions_data, f, indent=2, default=str)
-        except Exception as e:
-            logger.error(f"Error saving sessions: {e}")
     
     async def store_session(self, user_id, phone_number, session_name):
-        """Store session information in local file"""
+        """Store session information in storage"""
         try:
-            sessions_data = self._load_sessions()
-            
             # Create unique key for user+phone combination
-            session_key = f"{user_id}_{phone_number}"
+            session_key = make_session_key(user_id, phone_number)
             
-            sessions_data[session_key] = {
+            await get_backend().put_session(session_key, {
                 'user_id': user_id,
                 'phone_number': phone_number,
                 'session_file': session_name,
                 'is_active': True,
                 'created_at': datetime.now().isoformat(),
                 'last_used': datetime.now().isoformat()
-            }
-            
-            self._save_sessions(sessions_data)
+            })
             logger.info(f"✅ Session stored locally for user {user_id}, phone {phone_number}")
+            await change_bus.publish(SessionActivated(user_id, phone_number))
             
         except Exception as e:
             logger.error(f"Error storing session: {e}")
@@ -71,18 +37,15 @@ class SessionManager:
     async def get_user_sessions(self, user_id):
         """Get all active sessions for a user"""
         try:
-            sessions_data = self._load_sessions()
-            user_sessions = []
-            
-            for session_key, session_info in sessions_data.items():
-                if session_info.get('user_id') == user_id and session_info.get('is_active', False):
-                    user_sessions.append({
-                        'phone': session_info['phone_number'],
-                        'session_file': session_info['session_file'],
-                        'last_used': session_info['last_used']
-                    })
-            
-            return user_sessions
+            sessions = await get_backend().list_sessions(user_id=user_id, active_only=True)
+            return [
+                {
+                    'phone': session_info['phone_number'],
+                    'session_file': session_info['session_file'],
+                    'last_used': session_info['last_used']
+                }
+                for session_info in sessions
+            ]
             
         except Exception as e:
             logger.error(f"Error getting user sessions: {e}")
@@ -91,18 +54,17 @@ class SessionManager:
     async def restore_all_sessions(self):
         """Restore all active sessions on bot startup"""
         try:
-            sessions_data = self._load_sessions()
+            sessions = await get_backend().list_sessions(active_only=True)
             restored_count = 0
             
-            for session_key, session_info in sessions_data.items():
-                if session_info.get('is_active', False):
-                    user_id = session_info['user_id']
-                    phone_number = session_info['phone_number']
-                    session_file = session_info['session_file']
-                    
-                    success = await self._restore_session(user_id, phone_number, session_file)
-                    if success:
-                        restored_count += 1
+            for session_info in sessions:
+                user_id = session_info['user_id']
+                phone_number = session_info['phone_number']
+                session_file = session_info['session_file']
+                
+                success = await self._restore_session(user_id, phone_number, session_file)
+                if success:
+                    restored_count += 1
                 
             logger.info(f"✅ Restored {restored_count} active sessions from local storage")
             
@@ -143,6 +105,7 @@ class SessionManager:
                 await self.update_session_activity(user_id, phone_number)
                 
                 logger.info(f"Session restored for user {user_id}, phone {phone_number}")
+                await change_bus.publish(SessionActivated(user_id, phone_number))
                 return True
             else:
                 # Session expired, deactivate
@@ -159,12 +122,9 @@ class SessionManager:
     async def update_session_activity(self, user_id, phone_number):
         """Update last used timestamp for a session"""
         try:
-            sessions_data = self._load_sessions()
-            session_key = f"{user_id}_{phone_number}"
-            
-            if session_key in sessions_data:
-                sessions_data[session_key]['last_used'] = datetime.now().isoformat()
-                self._save_sessions(sessions_data)
+            await get_backend().update_session(
+                make_session_key(user_id, phone_number), {'last_used': datetime.now().isoformat()}
+            )
             
         except Exception as e:
             logger.error(f"Error updating session activity: {e}")
@@ -172,12 +132,7 @@ class SessionManager:
     async def deactivate_session(self, user_id, phone_number):
         """Deactivate a session in local storage"""
         try:
-            sessions_data = self._load_sessions()
-            session_key = f"{user_id}_{phone_number}"
-            
-            if session_key in sessions_data:
-                sessions_data[session_key]['is_active'] = False
-                self._save_sessions(sessions_data)
+            await get_backend().update_session(make_session_key(user_id, phone_number), {'is_active': False})
             
             # Remove from active connections if present
             from bot.connection import active_connections
@@ -188,6 +143,7 @@ class SessionManager:
                 del active_connections[user_id]
             
             logger.info(f"Session deactivated for user {user_id}, phone {phone_number}")
+            await change_bus.publish(SessionDeactivated(user_id, phone_number))
             
         except Exception as e:
             logger.error(f"Error deactivating session: {e}")
@@ -195,33 +151,31 @@ class SessionManager:
     async def cleanup_expired_sessions(self):
         """Clean up expired sessions (older than 7 days)"""
         try:
-            sessions_data = self._load_sessions()
+            backend = get_backend()
             current_time = datetime.now()
             expired_count = 0
             
-            for session_key, session_info in sessions_data.items():
-                if session_info.get('is_active', False):
-                    last_used_str = session_info.get('last_used', '')
-                    try:
-                        last_used = datetime.fromisoformat(last_used_str.replace('Z', '+00:00'))
-                        if (current_time - last_used).days > 7:
-                            session_info['is_active'] = False
-                            expired_count += 1
-                    except:
-                        # Invalid date format, mark as expired
-                        session_info['is_active'] = False
-                        expired_count += 1
+            for session_info in await backend.list_sessions(active_only=True):
+                last_used_str = session_info.get('last_used') or ''
+                try:
+                    last_used = datetime.fromisoformat(last_used_str.replace('Z', '+00:00'))
+                    expired = (current_time - last_used).days > 7
+                except:
+                    # Invalid date format, mark as expired
+                    expired = True
+                if expired:
+                    await backend.update_session(session_info['session_key'], {'is_active': False})
+                    expired_count += 1
             
             if expired_count > 0:
-                self._save_sessions(sessions_data)
                 logger.info(f"Cleaned up {expired_count} expired sessions")
             
         except Exception as e:
             logger.error(f"Error cleaning up expired sessions: {e}")
     
     def close(self):
-        """Close session manager (no action needed for file storage)"""
-        pass
+        """Close session manager, flushing pending writes to storage"""
+        get_backend().flush()
 
 # Global session manager instance
 session_manager = SessionManager()
\ No newline at end of file
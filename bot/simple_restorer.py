@@ -8,10 +8,23 @@ import asyncio
 import os
 import json
 from typing import Dict, List, Optional, Tuple, Any, Union
-from telethon import TelegramClient, events
+from telethon import TelegramClient
 from telethon.types import Message, MessageEntityMention, MessageEntityMentionName
 from config.settings import API_ID, API_HASH, BOT_TOKEN
-from bot.database import load_data, save_data
+from bot.database import get_all_redirections
+from bot.catchup import catch_ups, checkpoints, recent_deliveries, seed_checkpoint
+from bot.coalescer import forward_coalescer
+from bot.dispatcher import RouteRegistry
+from bot.entity_cache import entity_cache, entity_name
+from bot.fanout import Outgoing, fan_out
+from bot.lanes import lane_key, lanes
+from bot.outbox import outbox
+from bot.peer_cache import peer_cache
+from bot.poller import pollers
+from bot.scheduler import Priority
+from bot.send_queue import send_queues
+from bot.storage import get_message_map
+from bot.change_bus import change_bus, RedirectionAdded, RedirectionRemoved, RedirectionChanged
 
 logger = logging.getLogger(__name__)
 
@@ -23,8 +36,9 @@ class SimpleRedirectionRestorer:
 
     def __init__(self):
         self.bot_client = None
-        self.active_redirections = {}
-        self.message_mapping = {}
+        self.active_redirections = RouteRegistry(self._dispatch_message, self._handle_message_deletion, self._dispatch_album)  # (user_id, name) -> route
+        self.message_map = get_message_map()  # Mappings sous la portée "bot"
+        change_bus.subscribe(self._on_redirection_change, RedirectionAdded, RedirectionRemoved, RedirectionChanged)
 
     async def initialize_bot_client(self):
         """Initialise le client bot principal"""
@@ -46,8 +60,17 @@ class SimpleRedirectionRestorer:
                 return
 
             # Charger les données de redirection
-            data = load_data()
-            redirections = data.get("redirections", {})
+            redirections = await get_all_redirections()
+
+            # Résoudre tous les canaux en quelques requêtes groupées (cache persistant)
+            chat_ids = [
+                chat_id
+                for user_redirections in redirections.values()
+                for redir_data in user_redirections.values()
+                for chat_id in (redir_data.get('source_id'), redir_data.get('destination_id'))
+                if chat_id
+            ]
+            await peer_cache.resolve(self.bot_client, "bot", chat_ids)
 
             total_restored = 0
 
@@ -72,6 +95,17 @@ class SimpleRedirectionRestorer:
 
             logger.info(f"🔄 Restauration terminée: {total_restored} redirections actives")
 
+            # Rattraper les messages publiés pendant l'arrêt, sans bloquer le démarrage
+            catch_ups.start(
+                self.bot_client, "bot", self.active_redirections.routes_of('bot'),
+                self._dispatch_message, self._dispatch_album,
+            )
+            # Interroger les sources dont les mises à jour n'arrivent plus
+            pollers.start(
+                self.bot_client, "bot", lambda: self.active_redirections.routes_of('bot'),
+                self._dispatch_message, self._dispatch_album,
+            )
+
         except Exception as e:
             logger.error(f"❌ Erreur restauration redirections: {e}")
 
@@ -79,40 +113,27 @@ class SimpleRedirectionRestorer:
         """Configure un gestionnaire de redirection"""
         try:
             # Convertir les IDs en entiers
+            user_id = int(user_id)
             source_chat_id = int(source_id)
             dest_chat_id = int(destination_id)
 
+            # Déjà active avec la même configuration
+            current = self.active_redirections.get(user_id, name)
+            if current and current['source_id'] == source_chat_id and current['destination_id'] == dest_chat_id:
+                return True
+
             # Vérifier l'accès aux canaux
-            try:
-                source_entity = await self.bot_client.get_entity(source_chat_id)
-                dest_entity = await self.bot_client.get_entity(dest_chat_id)
-                logger.info(f"✅ Accès vérifié: {source_entity.title if hasattr(source_entity, 'title') else source_chat_id} → {dest_entity.title if hasattr(dest_entity, 'title') else dest_chat_id}")
-            except Exception as e:
-                logger.warning(f"⚠️ Impossible d'accéder aux canaux pour {name}: {e}")
+            source_entity = await entity_cache.get_entity(self.bot_client, source_chat_id)
+            dest_entity = await entity_cache.get_entity(self.bot_client, dest_chat_id)
+            if source_entity is None or dest_entity is None:
+                logger.warning(f"⚠️ Impossible d'accéder aux canaux pour {name}")
                 return False
+            logger.info(f"✅ Accès vérifié: {entity_name(source_entity, source_chat_id)} → {entity_name(dest_entity, dest_chat_id)}")
 
-            # Créer le gestionnaire de messages
-            @self.bot_client.on(events.NewMessage(chats=source_chat_id))
-            async def message_handler(event):
-                await self._handle_message_redirection(
-                    event, dest_chat_id, name, user_id, is_edit=False
-                )
-
-            # Créer le gestionnaire d'édition
-            @self.bot_client.on(events.MessageEdited(chats=source_chat_id))
-            async def edit_handler(event):
-                await self._handle_message_redirection(
-                    event, dest_chat_id, name, user_id, is_edit=True
-                )
-
-            # Stocker la redirection active
-            self.active_redirections[name] = {
-                'source_id': source_chat_id,
-                'destination_id': dest_chat_id,
-                'user_id': user_id,
-                'message_handler': message_handler,
-                'edit_handler': edit_handler
-            }
+            # Router la redirection (remplace une ancienne configuration du même nom)
+            self.active_redirections.register(self.bot_client, 'bot', user_id, name, source_chat_id, dest_chat_id)
+            # Point de départ du polling, même si la source n'envoie jamais de mise à jour
+            asyncio.ensure_future(seed_checkpoint(self.bot_client, "bot", source_chat_id, dest_chat_id))
 
             logger.info(f"🔄 Redirection '{name}' configurée: {source_chat_id} → {dest_chat_id}")
             return True
@@ -121,32 +142,96 @@ class SimpleRedirectionRestorer:
             logger.error(f"❌ Erreur configuration redirection {name}: {e}")
             return False
 
-    async def _handle_message_redirection(self, event, destination_id, redirect_name, user_id, is_edit=False):
-        """Traite la redirection d'un message"""
+    async def _dispatch_message(self, event, entries, is_edit, priority=Priority.LIVE):
+        """Prépare le message une fois, puis le redirige vers toutes les destinations en parallèle"""
+        outgoing = Outgoing.from_message(event.message)
+        await fan_out(entries, lambda entry: self._handle_message_redirection(
+            event, entry['destination_id'], entry['name'], entry['user_id'], is_edit=is_edit, outgoing=outgoing,
+            priority=priority, lane=lane_key(entry)
+        ))
+
+    async def _dispatch_album(self, events, entries, priority=Priority.LIVE):
+        await fan_out(entries, lambda entry: self._handle_album_redirection(
+            events, entry['destination_id'], entry['name'], priority, lane_key(entry)
+        ))
+
+    async def _handle_album_redirection(self, events, destination_id, redirect_name, priority=Priority.LIVE, lane=None):
+        """Transfère toutes les parties d'un album en un seul appel et mappe chaque partie"""
+        try:
+            chat_id = events[0].chat_id
+            messages = [event.message for event in events]
+            if not recent_deliveries.claim("bot", chat_id, messages[0].id, destination_id):
+                return
+            try:
+                await outbox.record("bot", chat_id, [message.id for message in messages], destination_id)
+                if lane is not None:
+                    await lanes.turn(lane, messages[0].id)
+                queued = forward_coalescer.queue_forward_many(self.bot_client, chat_id, destination_id, messages, priority)
+                if lane is not None:
+                    for message in messages:
+                        lanes.leave(lane, message.id)
+                sent_messages = await queued
+            except Exception:
+                recent_deliveries.release("bot", chat_id, messages[0].id, destination_id)
+                outbox.retry("bot", chat_id, messages[0].id, destination_id)
+                raise
+            for message, sent_message in zip(messages, sent_messages):
+                if sent_message is not None:
+                    await self.message_map.put("bot", chat_id, message.id, destination_id, sent_message.id)
+            if any(sent_messages):
+                checkpoints.advance("bot", chat_id, destination_id, messages[-1].id)
+            outbox.complete("bot", chat_id, messages[0].id, destination_id,
+                            [sent_message.id if sent_message is not None else None for sent_message in sent_messages])
+
+            logger.info("✅ Album de %d messages redirigé: %s → %s via %s", len(messages),
+                        entity_cache.describe(self.bot_client, chat_id),
+                        entity_cache.describe(self.bot_client, destination_id), redirect_name)
+        except Exception as e:
+            logger.error(f"❌ Erreur redirection album via {redirect_name}: {e}")
+
+    async def _handle_message_deletion(self, event, entries):
+        """Supprime les copies des messages supprimés dans un canal source (un appel par destination)"""
+        names = {entry['destination_id']: entry['name'] for entry in entries}
+        copies = await self.message_map.pop_copies("bot", event.chat_id, event.deleted_ids, names.keys())
+        for destination_id, redirected_ids in copies.items():
+            try:
+                await send_queues.submit(self.bot_client, destination_id, lambda: self.bot_client.delete_messages(destination_id, redirected_ids))
+                logger.info(f"🗑️ {len(redirected_ids)} message(s) supprimé(s) via {names[destination_id]}")
+            except Exception as e:
+                logger.warning(f"⚠️ Échec suppression via {names[destination_id]}: {e}")
+
+    async def _handle_message_redirection(self, event, destination_id, redirect_name, user_id, is_edit=False, outgoing=None,
+                                          priority=Priority.LIVE, lane=None):
+        """Traite la redirection d'un message
+
+        outgoing : contenu préparé une fois par message source ; lane : file
+        ordonnée de la redirection (voir bot.lanes), s'il y en a une.
+        """
         try:
             message = event.message
             original_msg_id = message.id
-            mapping_key = f"{event.chat_id}_{original_msg_id}_{destination_id}"
+            if outgoing is None:
+                outgoing = Outgoing.from_message(message)
 
-            # Obtenir les noms des canaux pour les logs
-            source_name = await self._get_channel_name(event.chat_id)
-            dest_name = await self._get_channel_name(destination_id)
+            # Noms des canaux pour les logs, résolus seulement si la ligne est émise
+            source_name = entity_cache.describe(self.bot_client, event.chat_id)
+            dest_name = entity_cache.describe(self.bot_client, destination_id)
 
             if is_edit:
                 # Gérer l'édition de message
-                if mapping_key in self.message_mapping:
-                    redirected_msg_id = self.message_mapping[mapping_key]
+                redirected_msg_id = await self.message_map.get("bot", event.chat_id, original_msg_id, destination_id)
+                if redirected_msg_id is not None:
                     try:
-                        if message.text:
-                            await self.bot_client.edit_message(destination_id, redirected_msg_id, message.text)
-                            logger.info(f"📝 Message édité: {source_name} → {dest_name} via {redirect_name}")
+                        if outgoing.kind == "text":
+                            await send_queues.submit(self.bot_client, destination_id, lambda: self.bot_client.edit_message(destination_id, redirected_msg_id, outgoing.text, formatting_entities=outgoing.entities))
+                            logger.info("📝 Message édité: %s → %s via %s", source_name, dest_name, redirect_name)
                             return
                         else:
                             # Message supprimé ou sans contenu
                             try:
-                                await self.bot_client.delete_messages(destination_id, redirected_msg_id)
-                                del self.message_mapping[mapping_key]
-                                logger.info(f"🗑️ Message supprimé: {source_name} → {dest_name} via {redirect_name}")
+                                await send_queues.submit(self.bot_client, destination_id, lambda: self.bot_client.delete_messages(destination_id, redirected_msg_id))
+                                await self.message_map.pop("bot", event.chat_id, original_msg_id, destination_id)
+                                logger.info("🗑️ Message supprimé: %s → %s via %s", source_name, dest_name, redirect_name)
                                 return
                             except:
                                 pass
@@ -157,53 +242,59 @@ class SimpleRedirectionRestorer:
                 else:
                     return  # Édition d'un message non mappé
 
+            # Un message peut arriver par les mises à jour, le rattrapage et le polling : l'envoyer une fois
+            if not is_edit and not recent_deliveries.claim("bot", event.chat_id, original_msg_id, destination_id):
+                return
+
             # Envoyer nouveau message ou remplacer média
             sent_message = None
 
-            if message.text:
-                # Message texte
-                sent_message = await self.bot_client.send_message(destination_id, message.text)
-            elif message.media:
-                # Message média - transférer
-                sent_message = await self.bot_client.forward_messages(destination_id, message)
-            else:
-                # Message vide
-                sent_message = await self.bot_client.send_message(destination_id, "📎 Message transféré")
+            try:
+                if not is_edit:
+                    # Enregistré avant l'envoi : si le processus s'arrête d'ici là, le message est envoyé au prochain démarrage
+                    await outbox.record("bot", event.chat_id, [original_msg_id], destination_id)
+                if lane is not None and not is_edit:
+                    # Passer après les messages précédents de la source pas encore en file pour cette destination
+                    await lanes.turn(lane, original_msg_id)
+                if outgoing.kind == "text":
+                    # Message texte
+                    queued = forward_coalescer.queue_send(self.bot_client, event.chat_id, destination_id, lambda: self.bot_client.send_message(destination_id, outgoing.text, formatting_entities=outgoing.entities), priority)
+                elif outgoing.kind == "media":
+                    # Message média - transférer (regroupé avec les autres transferts de la source)
+                    queued = forward_coalescer.queue_forward_many(self.bot_client, event.chat_id, destination_id, [message], priority)
+                else:
+                    # Message vide
+                    queued = forward_coalescer.queue_send(self.bot_client, event.chat_id, destination_id, lambda: self.bot_client.send_message(destination_id, "📎 Message transféré"), priority)
+                if lane is not None and not is_edit:
+                    lanes.leave(lane, original_msg_id)
+                sent_message = await queued
+                if outgoing.kind == "media":
+                    sent_message = sent_message[0]
+            except Exception:
+                if not is_edit:
+                    recent_deliveries.release("bot", event.chat_id, original_msg_id, destination_id)
+                    outbox.retry("bot", event.chat_id, original_msg_id, destination_id)
+                raise
 
             # Stocker le mapping pour futures éditions
+            sent_id = None
             if sent_message and not is_edit:
                 if hasattr(sent_message, 'id'):
-                    self.message_mapping[mapping_key] = sent_message.id
+                    sent_id = sent_message.id
                 elif isinstance(sent_message, list) and len(sent_message) > 0:
-                    self.message_mapping[mapping_key] = sent_message[0].id
+                    sent_id = sent_message[0].id
+                if sent_id is not None:
+                    await self.message_map.put("bot", event.chat_id, original_msg_id, destination_id, sent_id)
+                checkpoints.advance("bot", event.chat_id, destination_id, original_msg_id)
+            if not is_edit:
+                outbox.complete("bot", event.chat_id, original_msg_id, destination_id, [sent_id] if sent_id else [])
 
             action = "édité et redirigé" if is_edit else "redirigé"
-            logger.info(f"✅ Message {action}: {source_name} → {dest_name} via {redirect_name}")
+            logger.info("✅ Message %s: %s → %s via %s", action, source_name, dest_name, redirect_name)
 
         except Exception as e:
             logger.error(f"❌ Erreur redirection message via {redirect_name}: {e}")
 
-    async def _get_channel_name(self, chat_id):
-        """Obtient le nom d'un canal"""
-        try:
-            entity = await self.bot_client.get_entity(chat_id)
-
-            if hasattr(entity, 'title') and entity.title:
-                return entity.title
-            elif hasattr(entity, 'first_name') and entity.first_name:
-                name = entity.first_name
-                if hasattr(entity, 'last_name') and entity.last_name:
-                    name += f" {entity.last_name}"
-                return name
-            elif hasattr(entity, 'username') and entity.username:
-                return f"@{entity.username}"
-            else:
-                return f"Chat {chat_id}"
-
-        except Exception as e:
-            logger.error(f"❌ Erreur nom canal {chat_id}: {e}")
-            return f"Chat {chat_id}"
-
     async def add_redirection(self, user_id, name, source_id, destination_id):
         """Ajoute une nouvelle redirection"""
         try:
@@ -225,11 +316,10 @@ class SimpleRedirectionRestorer:
             logger.error(f"❌ Erreur ajout redirection: {e}")
             return False
 
-    async def remove_redirection(self, name):
+    async def remove_redirection(self, user_id, name):
         """Supprime une redirection"""
         try:
-            if name in self.active_redirections:
-                del self.active_redirections[name]
+            if self.active_redirections.unregister(user_id, name):
                 logger.info(f"✅ Redirection supprimée: {name}")
                 return True
             else:
@@ -240,5 +330,17 @@ class SimpleRedirectionRestorer:
             logger.error(f"❌ Erreur suppression redirection: {e}")
             return False
 
+    async def _on_redirection_change(self, event):
+        """Applique une modification de redirection stockée (uniquement si le client bot tourne)"""
+        if not self.bot_client:
+            return
+        if not isinstance(event, RedirectionAdded):
+            await self.remove_redirection(event.user_id, event.name)
+        if isinstance(event, RedirectionRemoved):
+            return
+        record = event.record or {}
+        if record.get('active', True) and record.get('source_id') and record.get('destination_id'):
+            await self.add_redirection(event.user_id, event.name, record['source_id'], record['destination_id'])
+
 # Instance globale
 simple_restorer = SimpleRedirectionRestorer()
\ No newline at end of file
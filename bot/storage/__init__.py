@@ -0,0 +1,106 @@
+import asyncio
+import logging
+import os
+import threading
+from bot.storage.json_store import JsonStore, get_json_store, flush_all
+from bot.storage.base import StorageBackend, default_data, session_key
+from bot.storage.message_map import MessageMap, get_message_map, close_message_map
+
+logger = logging.getLogger(__name__)
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def create_backend(kind, migrate=True):
+    """Build a storage backend by name ("json", "journal", "sqlite" or "postgres")"""
+    from config.settings import DATA_FILE, SESSIONS_FILE, SQLITE_FILE, DATA_FLUSH_DELAY
+
+    if kind == "json":
+        from bot.storage.json_backend import JsonBackend
+        return JsonBackend(DATA_FILE, SESSIONS_FILE, DATA_FLUSH_DELAY)
+
+    if kind == "journal":
+        # Uses the JSON files as its snapshot, so no migration is needed
+        from config.settings import (
+            JOURNAL_FILE, JOURNAL_FSYNC_INTERVAL, JOURNAL_COMPACT_BYTES, SNAPSHOT_FORMAT, SNAPSHOT_FILE
+        )
+        from bot.storage.journal_backend import JournalBackend
+        return JournalBackend(
+            DATA_FILE, SESSIONS_FILE, JOURNAL_FILE, JOURNAL_FSYNC_INTERVAL, JOURNAL_COMPACT_BYTES,
+            binary_snapshot=SNAPSHOT_FILE if SNAPSHOT_FORMAT == "binary" else None,
+        )
+
+    if kind == "postgres":
+        from config.settings import DATABASE_URL, PG_POOL_MIN, PG_POOL_MAX
+        from bot.storage.postgres_backend import PostgresBackend
+        from bot.storage.migrate import read_json_documents
+        if not DATABASE_URL:
+            raise ValueError("DATABASE_URL is required for the postgres storage backend")
+        # Connects, creates the schema and imports the JSON files on its own threads:
+        # get_backend() is called from async code and must not block the event loop
+        initial_documents = None
+        if migrate and (os.path.exists(DATA_FILE) or os.path.exists(SESSIONS_FILE)):
+            initial_documents = lambda: read_json_documents(DATA_FILE, SESSIONS_FILE)
+        return PostgresBackend(DATABASE_URL, PG_POOL_MIN, PG_POOL_MAX, initial_documents)
+
+    if kind == "sqlite":
+        from bot.storage.sqlite_backend import SQLiteBackend
+        backend = SQLiteBackend(SQLITE_FILE)
+    else:
+        raise ValueError(f"Unknown storage backend: {kind}")
+
+    if migrate and backend.is_empty() and (os.path.exists(DATA_FILE) or os.path.exists(SESSIONS_FILE)):
+        # First start on a database: import the existing JSON files once
+        from bot.storage.migrate import migrate_json
+        _run_sync(migrate_json(backend, DATA_FILE, SESSIONS_FILE))
+    return backend
+
+
+def _run_sync(coro):
+    """Run a coroutine to completion from synchronous code, even inside a running loop"""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    result = {}
+    thread = threading.Thread(target=lambda: result.setdefault("value", asyncio.run(coro)))
+    thread.start()
+    thread.join()
+    return result.get("value")
+
+
+def get_backend():
+    """Return the process-wide storage backend selected by STORAGE_BACKEND"""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            from config.settings import STORAGE_BACKEND
+            _backend = create_backend(STORAGE_BACKEND)
+            logger.info(f"Storage backend: {_backend.name}")
+        return _backend
+
+
+def close_backend():
+    """Flush and close the storage backend, the message map and any JSON stores (call on shutdown)"""
+    global _backend
+    with _backend_lock:
+        if _backend is not None:
+            try:
+                _backend.close()
+            except Exception as e:
+                logger.error(f"Error closing storage backend: {e}")
+            _backend = None
+    try:
+        close_message_map()
+    except Exception as e:
+        logger.error(f"Error closing message map: {e}")
+    flush_all()
+
+
+__all__ = [
+    "JsonStore", "get_json_store", "flush_all",
+    "StorageBackend", "default_data", "session_key",
+    "MessageMap", "get_message_map", "close_message_map",
+    "create_backend", "get_backend", "close_backend",
+]
@@ -0,0 +1,112 @@
+"""
+Storage backend interface shared by all persistence engines
+
+Records are plain dicts using the same field names as user_data.json and
+telegram_sessions.json, so callers do not depend on the engine in use.
+User IDs are stored as strings (the JSON keys), except in session records
+where user_id keeps the type it was stored with.
+"""
+
+# Top-level sections of user_data.json
+DATA_SECTIONS = (
+    "licenses",
+    "connections",
+    "redirections",
+    "transformations",
+    "whitelists",
+    "blacklists",
+    "chats",
+    "pending_redirections",
+)
+
+# Sections with dedicated tables/methods; the others are kept as opaque blobs
+EXTRA_SECTIONS = ("transformations", "whitelists", "blacklists", "chats")
+
+
+def default_data():
+    """Empty user_data.json document"""
+    return {section: {} for section in DATA_SECTIONS}
+
+
+def session_key(user_id, phone_number):
+    """Unique key for a user+phone session"""
+    return f"{user_id}_{phone_number}"
+
+
+class StorageBackend:
+    """Async persistence API used by bot.database and SessionManager"""
+
+    name = "base"
+
+    # Licenses
+    async def put_license(self, user_id, record):
+        raise NotImplementedError
+
+    async def list_licenses(self):
+        """Return {user_id: record}"""
+        raise NotImplementedError
+
+    # Connections
+    async def replace_connection(self, user_id, record):
+        """Insert a connection, replacing any existing one for the same phone"""
+        raise NotImplementedError
+
+    async def list_connections(self, user_id=None):
+        """Return {user_id: [record, ...]}, optionally for a single user"""
+        raise NotImplementedError
+
+    # Redirections
+    async def put_redirection(self, user_id, name, record):
+        raise NotImplementedError
+
+    async def update_redirection(self, user_id, name, fields):
+        """Update fields of an existing redirection; return False if missing"""
+        raise NotImplementedError
+
+    async def delete_redirection(self, user_id, name):
+        raise NotImplementedError
+
+    async def get_redirection(self, user_id, name):
+        raise NotImplementedError
+
+    async def list_redirections(self, user_id=None, phone=None, source_id=None, active_only=False):
+        """Return matching records, each with an added 'user_id' field"""
+        raise NotImplementedError
+
+    # Pending redirections
+    async def set_pending(self, user_id, record):
+        raise NotImplementedError
+
+    async def get_pending(self, user_id):
+        raise NotImplementedError
+
+    async def delete_pending(self, user_id):
+        """Remove a pending redirection; return True if one existed"""
+        raise NotImplementedError
+
+    # Sessions
+    async def put_session(self, key, record):
+        raise NotImplementedError
+
+    async def update_session(self, key, fields):
+        """Update fields of an existing session; return False if missing"""
+        raise NotImplementedError
+
+    async def list_sessions(self, user_id=None, active_only=False):
+        """Return session records, each with an added 'session_key' field"""
+        raise NotImplementedError
+
+    # Whole-document access
+    async def export_data(self):
+        """Return the full state in the legacy user_data.json shape"""
+        raise NotImplementedError
+
+    async def import_data(self, data, sessions):
+        """Bulk-load a user_data.json document and a sessions document"""
+        raise NotImplementedError
+
+    def flush(self):
+        """Persist buffered writes (called on shutdown)"""
+
+    def close(self):
+        self.flush()
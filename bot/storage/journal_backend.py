@@ -0,0 +1,212 @@
+"""
+Append-only journal backend
+
+Each mutation is appended to a JSONL journal instead of rewriting
+user_data.json. Appends are buffered and written + fsynced in batches by a
+background thread. When the journal grows past a threshold it is compacted:
+the in-memory state is written as a snapshot (user_data.json and
+telegram_sessions.json, in their usual format) and the journal is truncated.
+Startup loads the snapshot and replays the journal tail. Replaying an entry
+twice yields the same state, so a crash in the middle of compaction is safe.
+
+With a binary_snapshot path, compaction also writes a compact binary
+snapshot (see bot.storage.snapshot) after the JSON files, and startup loads
+it instead of parsing JSON when it is valid and at least as new as
+user_data.json.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from bot.storage.base import DATA_SECTIONS, default_data
+from bot.storage.json_backend import MemoryBackend, apply_op
+from bot.storage.snapshot import SnapshotError, read_snapshot, write_snapshot
+
+logger = logging.getLogger(__name__)
+
+
+def _read_json(path, default_factory):
+    if os.path.exists(path):
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except Exception as e:
+            logger.error(f"Error loading snapshot {path}: {e}")
+    return default_factory()
+
+
+def _write_atomic(path, payload):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class JournalBackend(MemoryBackend):
+    """In-memory state persisted as a snapshot plus an append-only mutation journal"""
+
+    name = "journal"
+
+    def __init__(self, data_file, sessions_file, journal_file, fsync_interval=0.05,
+                 compact_bytes=4 * 1024 * 1024, binary_snapshot=None):
+        super().__init__()
+        self.data_file = data_file
+        self.sessions_file = sessions_file
+        self.journal_file = journal_file
+        self.fsync_interval = fsync_interval
+        self.compact_bytes = compact_bytes
+        self.binary_snapshot = binary_snapshot
+
+        self._data, self._sessions = self._load_snapshot()
+        for section in DATA_SECTIONS:
+            self._data.setdefault(section, {})
+        replayed = self._replay()
+        if replayed:
+            logger.info(f"Replayed {replayed} journal entries from {journal_file}")
+
+        self._buffer = []
+        self._io_lock = threading.Lock()  # Serializes journal file writes and compaction
+        self._wakeup = threading.Condition(self.lock)
+        self._closed = False
+        self._journal = open(journal_file, 'a', encoding='utf-8')
+        self._journal_size = self._journal.tell()
+        self._thread = threading.Thread(target=self._sync_loop, name="JournalBackend", daemon=True)
+        self._thread.start()
+
+    @property
+    def data(self):
+        return self._data
+
+    @property
+    def sessions(self):
+        return self._sessions
+
+    def _load_snapshot(self):
+        """Load the binary snapshot if usable, else the JSON files"""
+        if self.binary_snapshot and os.path.exists(self.binary_snapshot):
+            # The binary snapshot is written after the JSON files; an older one is stale
+            json_mtime = os.path.getmtime(self.data_file) if os.path.exists(self.data_file) else 0
+            if os.path.getmtime(self.binary_snapshot) >= json_mtime:
+                try:
+                    return read_snapshot(self.binary_snapshot)
+                except SnapshotError as e:
+                    logger.warning(f"Binary snapshot unusable, falling back to JSON: {e}")
+        return _read_json(self.data_file, default_data), _read_json(self.sessions_file, dict)
+
+    def _replay(self):
+        """Apply every complete journal entry on top of the snapshot"""
+        if not os.path.exists(self.journal_file):
+            return 0
+        count = 0
+        complete_bytes = 0  # Length of the journal up to its last complete entry
+        torn = False
+        with open(self.journal_file, 'r', encoding='utf-8', newline='') as f:
+            for line in f:
+                if not line.endswith('\n'):
+                    # Torn write from a crash: the entry was never acknowledged as durable
+                    logger.warning(f"Ignoring incomplete journal entry in {self.journal_file}")
+                    torn = True
+                    break
+                complete_bytes += len(line.encode('utf-8'))
+                try:
+                    entry = json.loads(line)
+                    apply_op(self._data, self._sessions, entry["op"], entry["args"])
+                    count += 1
+                except Exception as e:
+                    logger.error(f"Skipping invalid journal entry: {e}")
+        if torn:
+            # Appending after the torn bytes would corrupt the next entry
+            with open(self.journal_file, 'r+b') as f:
+                f.truncate(complete_bytes)
+                f.flush()
+                os.fsync(f.fileno())
+        return count
+
+    def _record(self, op, args):
+        # Called under self.lock, right after the in-memory state changed
+        self._buffer.append(json.dumps({"op": op, "args": args}, separators=(',', ':'), default=str) + '\n')
+        self._wakeup.notify()
+
+    def _replace_documents(self, data, sessions):
+        with self.lock:
+            self._data = data
+            self._sessions = sessions
+        # A bulk import is persisted directly as a new snapshot
+        self.compact()
+
+    # Persistence
+    def _write_buffer(self):
+        """Append buffered entries to the journal and fsync them as one batch"""
+        with self._io_lock:
+            with self.lock:
+                pending, self._buffer = self._buffer, []
+            if not pending:
+                return
+            payload = ''.join(pending)
+            self._journal.write(payload)
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            self._journal_size += len(payload.encode('utf-8'))
+
+    def compact(self):
+        """Write the current state as a snapshot and drop the journal entries it covers"""
+        with self._io_lock:
+            with self.lock:
+                pending, self._buffer = self._buffer, []
+                data_payload = json.dumps(self._data, default=str)
+                sessions_payload = json.dumps(self._sessions, default=str)
+            # Entries made before the snapshot was taken are now redundant
+            _write_atomic(self.data_file, data_payload)
+            _write_atomic(self.sessions_file, sessions_payload)
+            if self.binary_snapshot:
+                # Encode from the frozen JSON payloads, not the live (mutating) state
+                self._write_binary_snapshot(json.loads(data_payload), json.loads(sessions_payload))
+            self._journal.close()
+            with open(self.journal_file, 'w', encoding='utf-8') as f:
+                f.flush()
+                os.fsync(f.fileno())
+            self._journal = open(self.journal_file, 'a', encoding='utf-8')
+            self._journal_size = 0
+        logger.info(f"Journal compacted into {self.data_file} ({len(pending)} buffered entries folded in)")
+
+    def _write_binary_snapshot(self, data, sessions):
+        try:
+            write_snapshot(self.binary_snapshot, data, sessions)
+        except Exception as e:
+            # Never leave an older binary snapshot behind once the journal is truncated
+            logger.warning(f"Binary snapshot not written, JSON snapshot only: {e}")
+            if os.path.exists(self.binary_snapshot):
+                os.remove(self.binary_snapshot)
+
+    def _sync_loop(self):
+        while True:
+            with self.lock:
+                while not self._buffer and not self._closed:
+                    self._wakeup.wait()
+                closed = self._closed
+            if not closed:
+                # Let concurrent mutations accumulate so one fsync covers the batch
+                time.sleep(self.fsync_interval)
+            try:
+                self._write_buffer()
+                if self._journal_size > self.compact_bytes:
+                    self.compact()
+            except Exception as e:
+                logger.error(f"Error writing journal {self.journal_file}: {e}")
+            if closed:
+                return
+
+    def flush(self):
+        self._write_buffer()
+
+    def close(self):
+        with self.lock:
+            self._closed = True
+            self._wakeup.notify()
+        self._thread.join(timeout=5)
+        self.compact()
+        self._journal.close()
@@ -0,0 +1,217 @@
+import copy
+import threading
+from bot.storage.base import StorageBackend, DATA_SECTIONS, default_data
+from bot.storage.json_store import get_json_store
+
+# Mutations touching telegram_sessions.json; all others touch user_data.json
+SESSION_OPS = {"put_session", "update_session"}
+
+
+def apply_op(data, sessions, op, args):
+    """Apply one mutation to the in-memory documents; return False if it changed nothing"""
+    if op == "put_license":
+        data["licenses"][args["user_id"]] = args["record"]
+    elif op == "replace_connection":
+        record = args["record"]
+        connections = data["connections"]
+        user_connections = [
+            conn for conn in connections.get(args["user_id"], [])
+            if conn["phone"] != record["phone"]
+        ]
+        user_connections.append(record)
+        connections[args["user_id"]] = user_connections
+    elif op == "put_redirection":
+        data["redirections"].setdefault(args["user_id"], {})[args["name"]] = args["record"]
+    elif op == "update_redirection":
+        record = data["redirections"].get(args["user_id"], {}).get(args["name"])
+        if record is None:
+            return False
+        record.update(args["fields"])
+    elif op == "delete_redirection":
+        user_redirections = data["redirections"].get(args["user_id"], {})
+        if args["name"] not in user_redirections:
+            return False
+        del user_redirections[args["name"]]
+    elif op == "set_pending":
+        data["pending_redirections"][args["user_id"]] = args["record"]
+    elif op == "delete_pending":
+        if args["user_id"] not in data["pending_redirections"]:
+            return False
+        del data["pending_redirections"][args["user_id"]]
+    elif op == "put_session":
+        sessions[args["key"]] = args["record"]
+    elif op == "update_session":
+        record = sessions.get(args["key"])
+        if record is None:
+            return False
+        record.update(args["fields"])
+    else:
+        raise ValueError(f"Unknown storage operation: {op}")
+    return True
+
+
+class MemoryBackend(StorageBackend):
+    """Backend serving everything from in-memory documents; subclasses decide how to persist"""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+
+    # Subclass hooks
+    @property
+    def data(self):
+        raise NotImplementedError
+
+    @property
+    def sessions(self):
+        raise NotImplementedError
+
+    def _state_lock(self, op):
+        return self.lock
+
+    def _record(self, op, args):
+        """Persist a mutation that has just been applied"""
+        raise NotImplementedError
+
+    def _replace_documents(self, data, sessions):
+        raise NotImplementedError
+
+    def _mutate(self, op, **args):
+        with self._state_lock(op):
+            changed = apply_op(self.data, self.sessions, op, args)
+            if changed:
+                self._record(op, args)
+            return changed
+
+    # Licenses
+    async def put_license(self, user_id, record):
+        self._mutate("put_license", user_id=str(user_id), record=dict(record))
+
+    async def list_licenses(self):
+        return dict(self.data["licenses"])
+
+    # Connections
+    async def replace_connection(self, user_id, record):
+        self._mutate("replace_connection", user_id=str(user_id), record=dict(record))
+
+    async def list_connections(self, user_id=None):
+        connections = self.data["connections"]
+        if user_id is not None:
+            return {str(user_id): list(connections.get(str(user_id), []))}
+        return {uid: list(conns) for uid, conns in connections.items()}
+
+    # Redirections
+    async def put_redirection(self, user_id, name, record):
+        self._mutate("put_redirection", user_id=str(user_id), name=name, record=dict(record))
+
+    async def update_redirection(self, user_id, name, fields):
+        return self._mutate("update_redirection", user_id=str(user_id), name=name, fields=dict(fields))
+
+    async def delete_redirection(self, user_id, name):
+        return self._mutate("delete_redirection", user_id=str(user_id), name=name)
+
+    async def get_redirection(self, user_id, name):
+        record = self.data["redirections"].get(str(user_id), {}).get(name)
+        return dict(record, user_id=str(user_id)) if record else None
+
+    async def list_redirections(self, user_id=None, phone=None, source_id=None, active_only=False):
+        redirections = self.data["redirections"]
+        if user_id is not None:
+            users = [(str(user_id), redirections.get(str(user_id), {}))]
+        else:
+            users = list(redirections.items())
+
+        results = []
+        for uid, user_redirections in users:
+            for record in list(user_redirections.values()):
+                if phone is not None and record.get("phone") != phone:
+                    continue
+                if source_id is not None and record.get("source_id") != source_id:
+                    continue
+                if active_only and not record.get("active", True):
+                    continue
+                results.append(dict(record, user_id=uid))
+        return results
+
+    # Pending redirections
+    async def set_pending(self, user_id, record):
+        self._mutate("set_pending", user_id=str(user_id), record=dict(record))
+
+    async def get_pending(self, user_id):
+        return self.data["pending_redirections"].get(str(user_id))
+
+    async def delete_pending(self, user_id):
+        return self._mutate("delete_pending", user_id=str(user_id))
+
+    # Sessions
+    async def put_session(self, key, record):
+        self._mutate("put_session", key=key, record=dict(record))
+
+    async def update_session(self, key, fields):
+        return self._mutate("update_session", key=key, fields=dict(fields))
+
+    async def list_sessions(self, user_id=None, active_only=False):
+        results = []
+        for key, record in list(self.sessions.items()):
+            if user_id is not None and record.get("user_id") != user_id:
+                continue
+            if active_only and not record.get("is_active", False):
+                continue
+            results.append(dict(record, session_key=key))
+        return results
+
+    # Whole-document access
+    async def export_data(self):
+        with self._state_lock("export"):
+            return copy.deepcopy(self.data)
+
+    async def import_data(self, data, sessions):
+        new_data = default_data()
+        new_data.update(copy.deepcopy(data))
+        self._replace_documents(new_data, copy.deepcopy(sessions))
+
+
+class JsonBackend(MemoryBackend):
+    """Backend keeping user_data.json and telegram_sessions.json in memory"""
+
+    name = "json"
+
+    def __init__(self, data_file, sessions_file, flush_delay=1.0):
+        super().__init__()
+        self.data_store = get_json_store(data_file, default_data, flush_delay)
+        self.sessions_store = get_json_store(sessions_file, dict, flush_delay)
+        with self.data_store.lock:
+            # Ensure all required keys exist
+            for section in DATA_SECTIONS:
+                if section not in self.data_store.data:
+                    self.data_store.data[section] = {}
+                    self.data_store.mark_dirty()
+
+    @property
+    def data(self):
+        return self.data_store.data
+
+    @property
+    def sessions(self):
+        return self.sessions_store.data
+
+    def _store_for(self, op):
+        return self.sessions_store if op in SESSION_OPS else self.data_store
+
+    def _state_lock(self, op):
+        # Same lock the store's flush thread takes while serializing
+        return self._store_for(op).lock
+
+    def _record(self, op, args):
+        self._store_for(op).mark_dirty()
+
+    def _replace_documents(self, data, sessions):
+        with self.data_store.lock:
+            self.data_store.data = data
+            self.data_store.mark_dirty()
+        with self.sessions_store.lock:
+            self.sessions_store.data = sessions
+            self.sessions_store.mark_dirty()
+
+    def flush(self):
+        self.data_store.flush()
+        self.sessions_store.flush()
@@ -0,0 +1,120 @@
+import logging
+import json
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Registry of process-wide stores, one per file path
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+class JsonStore:
+    """In-memory JSON document with debounced, atomic write-back to disk"""
+
+    def __init__(self, path, default_factory=dict, flush_delay=1.0, indent=None):
+        self.path = path
+        self.flush_delay = flush_delay
+        self.indent = indent
+        # Guards both the in-memory document and the flush state
+        self.lock = threading.RLock()
+        self._default_factory = default_factory
+        self._dirty = False
+        self._dirty_since = None
+        self._wakeup = threading.Condition(self.lock)
+        # Serializes writers so an older snapshot never lands after a newer one
+        self._write_lock = threading.Lock()
+        self._closed = False
+        self.data = self._load()
+        self._thread = threading.Thread(
+            target=self._flush_loop, name=f"JsonStore({os.path.basename(path)})", daemon=True
+        )
+        self._thread.start()
+
+    def _load(self):
+        """Read the document once from disk, falling back to the default"""
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r') as f:
+                    return json.load(f)
+            except Exception as e:
+                logger.error(f"Error loading {self.path}: {e}")
+        return self._default_factory()
+
+    def mark_dirty(self):
+        """Schedule a write-back; repeated calls within the delay are coalesced"""
+        with self.lock:
+            if not self._dirty:
+                self._dirty = True
+                self._dirty_since = time.monotonic()
+                self._wakeup.notify()
+
+    def flush(self):
+        """Write pending changes to disk immediately"""
+        with self._write_lock:
+            with self.lock:
+                if not self._dirty:
+                    return
+                payload = json.dumps(self.data, indent=self.indent, default=str)
+                self._dirty = False
+                self._dirty_since = None
+            self._write_atomic(payload)
+
+    def close(self):
+        """Flush and stop the background writer"""
+        with self.lock:
+            self._closed = True
+            self._wakeup.notify()
+        self._thread.join(timeout=5)
+        self.flush()
+
+    def _write_atomic(self, payload):
+        """Write to a temp file in the same directory, then rename over the target"""
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.error(f"Error saving {self.path}: {e}")
+
+    def _flush_loop(self):
+        """Background thread: flush once the data has been dirty for flush_delay seconds"""
+        while True:
+            with self.lock:
+                while not self._closed:
+                    if self._dirty:
+                        remaining = self._dirty_since + self.flush_delay - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._wakeup.wait(remaining)
+                    else:
+                        self._wakeup.wait()
+                if self._closed:
+                    return
+            self.flush()
+
+
+def get_json_store(path, default_factory=dict, flush_delay=1.0, indent=None):
+    """Return the process-wide store for a file, creating it on first use"""
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = JsonStore(path, default_factory, flush_delay, indent)
+            _stores[path] = store
+        return store
+
+
+def flush_all():
+    """Flush every open store (call on shutdown)"""
+    with _stores_lock:
+        stores = list(_stores.values())
+    for store in stores:
+        try:
+            store.flush()
+        except Exception as e:
+            logger.error(f"Error flushing {store.path}: {e}")
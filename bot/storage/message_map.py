@@ -0,0 +1,373 @@
+"""
+Bounded, persistent mapping of redirected message IDs
+
+Remembers which destination message each source message was copied to, so
+edits (and deletions) can be mirrored even after a restart. Recent mappings
+live in an in-memory hot tier; every mapping is also written to a small
+SQLite file in batches. Retention is bounded per (source, destination) pair
+by age (ttl seconds) and count (max_per_pair); 0 disables either limit.
+
+Mappings are namespaced by a scope (the redirecting user, or "bot" for the
+bot client) because message IDs of private chats are per account.
+
+The hot tier holds one PairMap per (scope, source, destination): parallel
+array('q') columns sorted by source message ID and searched with bisect,
+about 24 bytes per mapping instead of ~150+ for a dict keyed by a formatted
+string (see benchmarks/message_map_bench.py). Message IDs only grow within
+a chat, so inserts are appends. The hot tier holds at most cache_size
+mappings across all pairs: the least recently used pairs are evicted whole
+(their mappings stay on disk), and a single pair larger than the bound has
+its oldest mappings trimmed from the front.
+"""
+
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS message_map (
+    scope TEXT NOT NULL,
+    source_chat INTEGER NOT NULL,
+    dest_chat INTEGER NOT NULL,
+    source_msg INTEGER NOT NULL,
+    dest_msg INTEGER NOT NULL,
+    created_at INTEGER NOT NULL,
+    PRIMARY KEY (scope, source_chat, dest_chat, source_msg)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_message_map_created ON message_map (created_at);
+CREATE INDEX IF NOT EXISTS idx_message_map_source ON message_map (scope, source_msg, source_chat);
+"""
+
+# Marked chat IDs at or below this are channels/supergroups, whose message IDs are per chat.
+# Messages of private chats and basic groups share one ID sequence per account.
+CHANNEL_ID_MAX = -1000000000000
+
+# Bound parameters per IN (...) query (SQLite's historical limit is 999)
+QUERY_CHUNK = 500
+
+# Seconds between retention sweeps of the disk tier
+PRUNE_INTERVAL = 300
+
+# Destination ID marking a mapping deleted in the hot tier (Telegram message IDs are positive)
+DELETED = 0
+
+
+class PairMap:
+    """Mappings of one source -> destination pair as parallel int64 columns sorted by source ID"""
+
+    __slots__ = ("source", "dest", "created")
+
+    def __init__(self):
+        self.source = array('q')
+        self.dest = array('q')
+        self.created = array('q')
+
+    def __len__(self):
+        return len(self.source)
+
+    def set(self, source_msg, dest_msg, created_at):
+        source = self.source
+        if not source or source_msg > source[-1]:
+            # Common case: newest message of the chat
+            source.append(source_msg)
+            self.dest.append(dest_msg)
+            self.created.append(created_at)
+            return
+        i = bisect_left(source, source_msg)
+        if i < len(source) and source[i] == source_msg:
+            self.dest[i] = dest_msg
+            self.created[i] = created_at
+        else:
+            source.insert(i, source_msg)
+            self.dest.insert(i, dest_msg)
+            self.created.insert(i, created_at)
+
+    def get(self, source_msg):
+        """Return (dest_msg, created_at), or None if the source message is not held"""
+        source = self.source
+        i = bisect_left(source, source_msg)
+        if i < len(source) and source[i] == source_msg:
+            return self.dest[i], self.created[i]
+        return None
+
+    def trim(self, keep):
+        """Drop the oldest mappings so at most keep remain"""
+        excess = len(self.source) - keep
+        if excess > 0:
+            del self.source[:excess]
+            del self.dest[:excess]
+            del self.created[:excess]
+
+
+class MessageMap:
+    """Source message -> redirected message IDs with an in-memory hot tier over SQLite"""
+
+    def __init__(self, path, ttl=7 * 24 * 3600, max_per_pair=100000, cache_size=200000, flush_delay=0.5):
+        self.path = path
+        self.ttl = ttl
+        self.max_per_pair = max_per_pair
+        self.cache_size = cache_size
+        self.flush_delay = flush_delay
+
+        self._pairs = OrderedDict()  # (scope, source_chat, dest_chat) -> PairMap, least recently used first
+        self._cached = 0  # Mappings held by all PairMaps
+        self._pending = {}  # key -> (dest_msg, created_at), or None for a deletion; not yet on disk
+        self._lock = threading.Lock()
+        self._timer = None
+        self._last_prune = 0
+        # A single worker thread owns the connection; disk I/O never runs on the event loop
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="message-map")
+        self._conn = self._executor.submit(self._connect).result()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        conn.commit()
+        return conn
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _expired(self, created_at, now):
+        return bool(self.ttl) and created_at < now - self.ttl
+
+    # Hot tier (callers hold self._lock)
+    def _cache_put(self, key, value):
+        pair = self._pairs.get(key[:3])
+        if pair is None:
+            pair = self._pairs[key[:3]] = PairMap()
+        else:
+            self._pairs.move_to_end(key[:3])
+        held = len(pair)
+        pair.set(key[3], *value)
+        if len(pair) > self.cache_size:
+            # Trim in chunks so the column shift is amortized
+            pair.trim(self.cache_size - self.cache_size // 10)
+        self._cached += len(pair) - held
+        while self._cached > self.cache_size and len(self._pairs) > 1:
+            # Evict whole pairs, least recently used first (e.g. routes that were removed)
+            _, evicted = self._pairs.popitem(last=False)
+            self._cached -= len(evicted)
+
+    def _lookup_memory(self, key):
+        """Return (found, value) from the unwritten batch or the hot tier"""
+        if key in self._pending:
+            return True, self._pending[key]
+        pair = self._pairs.get(key[:3])
+        value = pair.get(key[3]) if pair is not None else None
+        if value is None:
+            return False, None
+        self._pairs.move_to_end(key[:3])
+        if value[0] == DELETED:
+            return True, None
+        return True, value
+
+    # Public API
+    async def get(self, scope, source_chat, source_msg, dest_chat):
+        """Return the redirected message ID, or None if unknown or expired"""
+        key = (str(scope), int(source_chat), int(dest_chat), int(source_msg))
+        with self._lock:
+            found, value = self._lookup_memory(key)
+        if not found:
+            value = await self._run(self._read, key)
+            if value is not None:
+                with self._lock:
+                    if key not in self._pending:
+                        self._cache_put(key, value)
+        if value is None or self._expired(value[1], time.time()):
+            return None
+        return value[0]
+
+    async def put(self, scope, source_chat, source_msg, dest_chat, dest_msg):
+        key = (str(scope), int(source_chat), int(dest_chat), int(source_msg))
+        value = (int(dest_msg), int(time.time()))
+        with self._lock:
+            self._cache_put(key, value)
+            self._pending[key] = value
+            self._schedule_flush()
+
+    async def pop(self, scope, source_chat, source_msg, dest_chat):
+        """Forget a mapping and return the redirected message ID it held"""
+        dest_msg = await self.get(scope, source_chat, source_msg, dest_chat)
+        key = (str(scope), int(source_chat), int(dest_chat), int(source_msg))
+        with self._lock:
+            self._cache_put(key, (DELETED, int(time.time())))
+            self._pending[key] = None
+            self._schedule_flush()
+        return dest_msg
+
+    async def pop_copies(self, scope, source_chat, source_msgs, dest_chats=None):
+        """Forget every copy of the given source messages; return {dest_chat: [dest_msg, ...]}
+
+        source_chat None means the messages were deleted outside any channel
+        (Telegram does not say where), so every non-channel source chat of the
+        scope is matched. dest_chats optionally restricts the destinations.
+        """
+        if not source_msgs:
+            return {}
+        rows = await self._run(
+            self._pop_copies, str(scope), None if source_chat is None else int(source_chat),
+            [int(msg) for msg in source_msgs], None if dest_chats is None else {int(d) for d in dest_chats},
+        )
+
+        now = int(time.time())
+        copies = {}
+        with self._lock:
+            for row_source_chat, dest_chat, source_msg, dest_msg, created_at in rows:
+                pair = self._pairs.get((str(scope), row_source_chat, dest_chat))
+                if pair is not None and pair.get(source_msg) is not None:
+                    pair.set(source_msg, DELETED, now)
+                if not self._expired(created_at, now):
+                    copies.setdefault(dest_chat, []).append(dest_msg)
+        return copies
+
+    # Disk tier
+    def _pop_copies(self, scope, source_chat, source_msgs, dest_chats):
+        """Reverse lookup on the worker thread: write pending changes, then select and delete"""
+        self._write_pending()
+        rows = []
+        for start in range(0, len(source_msgs), QUERY_CHUNK):
+            chunk = source_msgs[start:start + QUERY_CHUNK]
+            if source_chat is None:
+                chat_filter, chat_args = "source_chat > ?", (CHANNEL_ID_MAX,)
+            else:
+                chat_filter, chat_args = "source_chat = ?", (source_chat,)
+            rows.extend(self._conn.execute(
+                "SELECT source_chat, dest_chat, source_msg, dest_msg, created_at FROM message_map "
+                f"WHERE scope = ? AND source_msg IN ({','.join('?' * len(chunk))}) AND {chat_filter}",
+                (scope, *chunk, *chat_args),
+            ).fetchall())
+        if dest_chats is not None:
+            rows = [row for row in rows if row[1] in dest_chats]
+        if rows:
+            with self._conn:
+                self._conn.executemany(
+                    "DELETE FROM message_map "
+                    "WHERE scope = ? AND source_chat = ? AND dest_chat = ? AND source_msg = ?",
+                    [(scope, row[0], row[1], row[2]) for row in rows],
+                )
+        return rows
+
+    def _read(self, key):
+        row = self._conn.execute(
+            "SELECT dest_msg, created_at FROM message_map "
+            "WHERE scope = ? AND source_chat = ? AND dest_chat = ? AND source_msg = ?",
+            key,
+        ).fetchone()
+        return tuple(row) if row else None
+
+    def _schedule_flush(self):
+        # Called under self._lock
+        if self._timer is None:
+            self._timer = threading.Timer(self.flush_delay, lambda: self._executor.submit(self._write_pending))
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _write_pending(self):
+        """Write the batched changes in one transaction (runs on the worker thread)"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._timer = None
+        if pending:
+            upserts = [key + value for key, value in pending.items() if value is not None]
+            deletes = [key for key, value in pending.items() if value is None]
+            try:
+                with self._conn:
+                    if upserts:
+                        self._conn.executemany(
+                            "INSERT OR REPLACE INTO message_map "
+                            "(scope, source_chat, dest_chat, source_msg, dest_msg, created_at) "
+                            "VALUES (?, ?, ?, ?, ?, ?)",
+                            upserts,
+                        )
+                    if deletes:
+                        self._conn.executemany(
+                            "DELETE FROM message_map "
+                            "WHERE scope = ? AND source_chat = ? AND dest_chat = ? AND source_msg = ?",
+                            deletes,
+                        )
+            except Exception as e:
+                logger.error(f"Error writing {len(pending)} message mappings to {self.path}: {e}")
+        if time.time() - self._last_prune > PRUNE_INTERVAL:
+            self._prune()
+
+    def _prune(self):
+        """Apply the retention limits to the disk tier"""
+        self._last_prune = time.time()
+        try:
+            with self._conn:
+                removed = 0
+                if self.ttl:
+                    removed += self._conn.execute(
+                        "DELETE FROM message_map WHERE created_at < ?", (int(time.time() - self.ttl),)
+                    ).rowcount
+                if self.max_per_pair:
+                    pairs = self._conn.execute(
+                        "SELECT scope, source_chat, dest_chat FROM message_map "
+                        "GROUP BY scope, source_chat, dest_chat HAVING COUNT(*) > ?",
+                        (self.max_per_pair,),
+                    ).fetchall()
+                    for pair in pairs:
+                        # Keep the newest max_per_pair source messages of the pair
+                        removed += self._conn.execute(
+                            "DELETE FROM message_map WHERE scope = ? AND source_chat = ? AND dest_chat = ? "
+                            "AND source_msg <= (SELECT source_msg FROM message_map "
+                            "WHERE scope = ? AND source_chat = ? AND dest_chat = ? "
+                            "ORDER BY source_msg DESC LIMIT 1 OFFSET ?)",
+                            pair + pair + (self.max_per_pair,),
+                        ).rowcount
+            if removed:
+                logger.info(f"Pruned {removed} expired message mappings")
+        except Exception as e:
+            logger.error(f"Error pruning message mappings: {e}")
+
+    def flush(self):
+        """Write pending mappings now"""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+        self._executor.submit(self._write_pending).result()
+
+    def close(self):
+        self.flush()
+        self._executor.submit(self._conn.close).result()
+        self._executor.shutdown(wait=True)
+
+
+_message_map = None
+_message_map_lock = threading.Lock()
+
+
+def get_message_map():
+    """Return the process-wide message mapping store"""
+    global _message_map
+    with _message_map_lock:
+        if _message_map is None:
+            from config.settings import (
+                MESSAGE_MAP_FILE, MESSAGE_MAP_TTL, MESSAGE_MAP_MAX_PER_PAIR, MESSAGE_MAP_CACHE_SIZE
+            )
+            _message_map = MessageMap(
+                MESSAGE_MAP_FILE,
+                ttl=MESSAGE_MAP_TTL,
+                max_per_pair=MESSAGE_MAP_MAX_PER_PAIR,
+                cache_size=MESSAGE_MAP_CACHE_SIZE,
+            )
+        return _message_map
+
+
+def close_message_map():
+    global _message_map
+    with _message_map_lock:
+        if _message_map is not None:
+            _message_map.close()
+            _message_map = None
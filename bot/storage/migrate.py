@@ -0,0 +1,62 @@
+"""
+One-shot migration of user_data.json and telegram_sessions.json into another backend
+
+Usage: python -m bot.storage.migrate [sqlite|postgres]
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sys
+
+logger = logging.getLogger(__name__)
+
+
+def read_json_documents(data_file, sessions_file):
+    """Read the legacy JSON files, returning (data, sessions)"""
+    data, sessions = {}, {}
+    if os.path.exists(data_file):
+        with open(data_file, 'r') as f:
+            data = json.load(f)
+    if os.path.exists(sessions_file):
+        with open(sessions_file, 'r') as f:
+            sessions = json.load(f)
+    return data, sessions
+
+
+def count_records(data, sessions):
+    return (
+        len(data.get("licenses", {}))
+        + sum(len(conns) for conns in data.get("connections", {}).values())
+        + sum(len(redirs) for redirs in data.get("redirections", {}).values())
+        + len(data.get("pending_redirections", {}))
+        + len(sessions)
+    )
+
+
+async def migrate_json(backend, data_file, sessions_file):
+    """Copy the legacy JSON files into backend; return the number of records imported"""
+    data, sessions = read_json_documents(data_file, sessions_file)
+    await backend.import_data(data, sessions)
+    count = count_records(data, sessions)
+    logger.info(f"Migrated {count} records from {data_file} and {sessions_file} to {backend.name}")
+    return count
+
+
+def main(argv):
+    from config.settings import DATA_FILE, SESSIONS_FILE
+    from bot.storage import create_backend
+
+    logging.basicConfig(level=logging.INFO)
+    target = argv[1] if len(argv) > 1 else "sqlite"
+    backend = create_backend(target, migrate=False)
+    try:
+        count = asyncio.run(migrate_json(backend, DATA_FILE, SESSIONS_FILE))
+        print(f"✅ {count} enregistrements migrés vers {target}")
+    finally:
+        backend.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv)
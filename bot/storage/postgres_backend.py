@@ -0,0 +1,443 @@
+import asyncio
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from bot.storage.base import StorageBackend, EXTRA_SECTIONS, default_data, session_key
+from bot.storage.migrate import count_records
+
+try:
+    import psycopg2
+    import psycopg2.extras
+    import psycopg2.pool
+except ImportError:  # pragma: no cover - optional dependency
+    psycopg2 = None
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS licenses (
+    user_id TEXT PRIMARY KEY,
+    license TEXT,
+    validated_at TEXT,
+    active BOOLEAN NOT NULL DEFAULT TRUE
+);
+CREATE TABLE IF NOT EXISTS connections (
+    id BIGSERIAL,
+    user_id TEXT NOT NULL,
+    phone TEXT NOT NULL,
+    connected_at TEXT,
+    active BOOLEAN NOT NULL DEFAULT TRUE,
+    replaced_at TEXT,
+    PRIMARY KEY (user_id, phone)
+);
+CREATE TABLE IF NOT EXISTS redirections (
+    id BIGSERIAL,
+    user_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    phone TEXT,
+    channel_name TEXT,
+    source_id TEXT,
+    destination_id TEXT,
+    created_at TEXT,
+    replaced_at TEXT,
+    updated_at TEXT,
+    active BOOLEAN NOT NULL DEFAULT TRUE,
+    replacement_info TEXT,
+    PRIMARY KEY (user_id, name)
+);
+CREATE INDEX IF NOT EXISTS idx_redirections_user_phone ON redirections (user_id, phone);
+CREATE INDEX IF NOT EXISTS idx_redirections_source ON redirections (source_id);
+CREATE TABLE IF NOT EXISTS pending_redirections (
+    user_id TEXT PRIMARY KEY,
+    name TEXT,
+    phone_number TEXT,
+    created_at TEXT
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    session_key TEXT PRIMARY KEY,
+    user_id TEXT,
+    phone_number TEXT,
+    session_file TEXT,
+    is_active BOOLEAN NOT NULL DEFAULT FALSE,
+    created_at TEXT,
+    last_used TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_active ON sessions (is_active);
+CREATE INDEX IF NOT EXISTS idx_sessions_user ON sessions (user_id);
+CREATE TABLE IF NOT EXISTS sections (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+LICENSE_FIELDS = ("license", "validated_at", "active")
+CONNECTION_FIELDS = ("phone", "connected_at", "active", "replaced_at")
+REDIRECTION_FIELDS = (
+    "name", "phone", "channel_name", "source_id", "destination_id",
+    "created_at", "replaced_at", "updated_at", "active", "replacement_info",
+)
+PENDING_FIELDS = ("name", "phone_number", "created_at")
+SESSION_FIELDS = ("user_id", "phone_number", "session_file", "is_active", "created_at", "last_used")
+BOOL_FIELDS = {"active", "is_active"}
+
+
+def _upsert_sql(table, key_columns, columns, placeholders):
+    updates = ", ".join(f"{c} = EXCLUDED.{c}" for c in columns if c not in key_columns)
+    return (
+        f"INSERT INTO {table} ({', '.join(columns)}) VALUES {placeholders} "
+        f"ON CONFLICT ({', '.join(key_columns)}) DO UPDATE SET {updates}"
+    )
+
+
+def _numbered(count):
+    return "(" + ", ".join(f"${i}" for i in range(1, count + 1)) + ")"
+
+
+LICENSE_COLUMNS = ("user_id",) + LICENSE_FIELDS
+CONNECTION_COLUMNS = ("user_id",) + CONNECTION_FIELDS
+REDIRECTION_COLUMNS = ("user_id",) + REDIRECTION_FIELDS
+PENDING_COLUMNS = ("user_id",) + PENDING_FIELDS
+SESSION_COLUMNS = ("session_key",) + SESSION_FIELDS
+
+# Server-side prepared statements, created once per pooled connection
+PREPARED = {
+    "put_license": _upsert_sql("licenses", ("user_id",), LICENSE_COLUMNS, _numbered(len(LICENSE_COLUMNS))),
+    "delete_connection": "DELETE FROM connections WHERE user_id = $1 AND phone = $2",
+    "insert_connection": (
+        f"INSERT INTO connections ({', '.join(CONNECTION_COLUMNS)}) VALUES {_numbered(len(CONNECTION_COLUMNS))}"
+    ),
+    "put_redirection": _upsert_sql(
+        "redirections", ("user_id", "name"), REDIRECTION_COLUMNS, _numbered(len(REDIRECTION_COLUMNS))
+    ),
+    "delete_redirection": "DELETE FROM redirections WHERE user_id = $1 AND name = $2",
+    "get_redirection": "SELECT * FROM redirections WHERE user_id = $1 AND name = $2",
+    "put_pending": _upsert_sql("pending_redirections", ("user_id",), PENDING_COLUMNS, _numbered(len(PENDING_COLUMNS))),
+    "get_pending": "SELECT * FROM pending_redirections WHERE user_id = $1",
+    "delete_pending": "DELETE FROM pending_redirections WHERE user_id = $1",
+    "put_session": _upsert_sql("sessions", ("session_key",), SESSION_COLUMNS, _numbered(len(SESSION_COLUMNS))),
+}
+
+
+def _row_to_record(row, fields):
+    """Convert a RealDictRow into a JSON-style record, dropping NULL optionals"""
+    record = {}
+    for field in fields:
+        value = row[field]
+        if value is None and field in ("updated_at", "replacement_info"):
+            continue
+        record[field] = bool(value) if field in BOOL_FIELDS else value
+    return record
+
+
+def _record_values(record, fields, defaults=None):
+    defaults = defaults or {}
+    values = []
+    for field in fields:
+        value = record.get(field, defaults.get(field))
+        if field in BOOL_FIELDS:
+            value = bool(value)
+        elif field == "user_id" and value is not None:
+            value = str(value)
+        values.append(value)
+    return values
+
+
+def _session_user_id(value):
+    """Session user IDs are ints in practice; keep them ints when round-tripping"""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return value
+
+
+class PostgresBackend(StorageBackend):
+    """Backend storing state in PostgreSQL so several bot replicas can share it"""
+
+    name = "postgres"
+
+    def __init__(self, dsn, min_connections=1, max_connections=5, initial_documents=None):
+        """initial_documents() returns (data, sessions) to import if the database is empty
+
+        Nothing blocks here: the pool, the schema and the import are set up on
+        a worker thread, and the first calls wait for them without blocking
+        the event loop.
+        """
+        if psycopg2 is None:
+            raise RuntimeError("psycopg2 is required for the postgres storage backend")
+        self.dsn = dsn
+        self._pool = None
+        # One worker per pooled connection: the pool can never be exhausted and
+        # blocking driver calls never run on the Telethon event loop
+        self._executor = ThreadPoolExecutor(max_workers=max_connections, thread_name_prefix="pg-storage")
+        self._prepared = {}  # id(connection) -> backend PID the statements were prepared on
+        self._opened = self._executor.submit(self._open, min_connections, max_connections, initial_documents)
+
+    def _open(self, min_connections, max_connections, initial_documents):
+        """Create the pool and the schema, then import the initial documents into an empty database"""
+        try:
+            self._pool = psycopg2.pool.ThreadedConnectionPool(min_connections, max_connections, self.dsn)
+            self._create_schema()
+            if initial_documents is not None and self._is_empty():
+                data, sessions = initial_documents()
+                self._call(self._import, data, sessions)
+                logger.info(f"Imported {count_records(data, sessions)} records into PostgreSQL")
+        except Exception as e:
+            logger.error(f"Cannot open the PostgreSQL storage backend: {e}")
+            raise
+
+    # Connection handling
+    def _call(self, func, *args):
+        """Run func(cursor, *args) on a pooled connection inside a transaction"""
+        conn = self._pool.getconn()
+        try:
+            self._ensure_prepared(conn)
+            with conn:
+                with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+                    return func(cur, *args)
+        except (psycopg2.InterfaceError, psycopg2.OperationalError):
+            # Connection dropped: discard it so the pool opens a fresh one
+            self._pool.putconn(conn, close=True)
+            conn = None
+            raise
+        finally:
+            if conn is not None:
+                self._pool.putconn(conn)
+
+    def _ensure_prepared(self, conn):
+        pid = conn.get_backend_pid()
+        if self._prepared.get(id(conn)) == pid:
+            return
+        with conn:
+            with conn.cursor() as cur:
+                for name, sql in PREPARED.items():
+                    cur.execute(f"PREPARE {name} AS {sql}")
+        self._prepared[id(conn)] = pid
+
+    async def _run(self, func, *args):
+        if not self._opened.done():
+            await asyncio.wrap_future(self._opened)
+        self._opened.result()  # Raises the setup error, if any
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._call, func, *args)
+
+    async def _execute(self, statement, params):
+        """EXECUTE a prepared statement; return the affected row count"""
+        def run(cur):
+            cur.execute(f"EXECUTE {statement} ({', '.join(['%s'] * len(params))})", params)
+            return cur.rowcount
+        return await self._run(run)
+
+    async def _fetch(self, sql, params=(), prepared=False):
+        def run(cur):
+            if prepared:
+                cur.execute(f"EXECUTE {sql} ({', '.join(['%s'] * len(params))})", params)
+            else:
+                cur.execute(sql, params)
+            return cur.fetchall()
+        return await self._run(run)
+
+    def _create_schema(self):
+        # Must run before any statement is prepared against these tables
+        conn = self._pool.getconn()
+        try:
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute(SCHEMA)
+        finally:
+            self._pool.putconn(conn)
+
+    def is_empty(self):
+        """True if no redirections, sessions or licenses have been stored yet (blocking)"""
+        self._opened.result()
+        return self._is_empty()
+
+    def _is_empty(self):
+        def check(cur):
+            for table in ("redirections", "sessions", "licenses", "connections"):
+                cur.execute(f"SELECT 1 FROM {table} LIMIT 1")
+                if cur.fetchone():
+                    return False
+            return True
+        return self._call(check)
+
+    # Licenses
+    async def put_license(self, user_id, record):
+        await self._execute("put_license", [str(user_id)] + _record_values(record, LICENSE_FIELDS))
+
+    async def list_licenses(self):
+        rows = await self._fetch("SELECT * FROM licenses")
+        return {row["user_id"]: _row_to_record(row, LICENSE_FIELDS) for row in rows}
+
+    # Connections
+    async def replace_connection(self, user_id, record):
+        # Delete + insert in one transaction so the replaced connection sorts last
+        def replace(cur):
+            cur.execute("EXECUTE delete_connection (%s, %s)", (str(user_id), record["phone"]))
+            values = [str(user_id)] + _record_values(record, CONNECTION_FIELDS, {"active": True})
+            cur.execute(f"EXECUTE insert_connection ({', '.join(['%s'] * len(values))})", values)
+        await self._run(replace)
+
+    async def list_connections(self, user_id=None):
+        if user_id is not None:
+            rows = await self._fetch("SELECT * FROM connections WHERE user_id = %s ORDER BY id", (str(user_id),))
+            result = {str(user_id): []}
+        else:
+            rows = await self._fetch("SELECT * FROM connections ORDER BY id")
+            result = {}
+        for row in rows:
+            result.setdefault(row["user_id"], []).append(_row_to_record(row, CONNECTION_FIELDS))
+        return result
+
+    # Redirections
+    async def put_redirection(self, user_id, name, record):
+        values = [str(user_id)] + _record_values(dict(record, name=name), REDIRECTION_FIELDS, {"active": True})
+        await self._execute("put_redirection", values)
+
+    async def update_redirection(self, user_id, name, fields):
+        fields = {k: v for k, v in fields.items() if k in REDIRECTION_FIELDS and k != "name"}
+        if not fields:
+            return await self.get_redirection(user_id, name) is not None
+        assignments = ", ".join(f"{k} = %s" for k in fields)
+
+        def update(cur):
+            cur.execute(
+                f"UPDATE redirections SET {assignments} WHERE user_id = %s AND name = %s",
+                _record_values(fields, tuple(fields)) + [str(user_id), name],
+            )
+            return cur.rowcount
+        return await self._run(update) > 0
+
+    async def delete_redirection(self, user_id, name):
+        return await self._execute("delete_redirection", [str(user_id), name]) > 0
+
+    async def get_redirection(self, user_id, name):
+        rows = await self._fetch("get_redirection", [str(user_id), name], prepared=True)
+        if not rows:
+            return None
+        return dict(_row_to_record(rows[0], REDIRECTION_FIELDS), user_id=rows[0]["user_id"])
+
+    async def list_redirections(self, user_id=None, phone=None, source_id=None, active_only=False):
+        clauses, params = [], []
+        if user_id is not None:
+            clauses.append("user_id = %s")
+            params.append(str(user_id))
+        if phone is not None:
+            clauses.append("phone = %s")
+            params.append(phone)
+        if source_id is not None:
+            clauses.append("source_id = %s")
+            params.append(source_id)
+        if active_only:
+            clauses.append("active")
+        sql = "SELECT * FROM redirections"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        rows = await self._fetch(sql + " ORDER BY id", params)
+        return [dict(_row_to_record(row, REDIRECTION_FIELDS), user_id=row["user_id"]) for row in rows]
+
+    # Pending redirections
+    async def set_pending(self, user_id, record):
+        await self._execute("put_pending", [str(user_id)] + _record_values(record, PENDING_FIELDS))
+
+    async def get_pending(self, user_id):
+        rows = await self._fetch("get_pending", [str(user_id)], prepared=True)
+        return _row_to_record(rows[0], PENDING_FIELDS) if rows else None
+
+    async def delete_pending(self, user_id):
+        return await self._execute("delete_pending", [str(user_id)]) > 0
+
+    # Sessions
+    async def put_session(self, key, record):
+        await self._execute("put_session", [key] + _record_values(record, SESSION_FIELDS))
+
+    async def update_session(self, key, fields):
+        fields = {k: v for k, v in fields.items() if k in SESSION_FIELDS}
+        if not fields:
+            return False
+        assignments = ", ".join(f"{k} = %s" for k in fields)
+
+        def update(cur):
+            cur.execute(
+                f"UPDATE sessions SET {assignments} WHERE session_key = %s",
+                _record_values(fields, tuple(fields)) + [key],
+            )
+            return cur.rowcount
+        return await self._run(update) > 0
+
+    async def list_sessions(self, user_id=None, active_only=False):
+        clauses, params = [], []
+        if user_id is not None:
+            clauses.append("user_id = %s")
+            params.append(str(user_id))
+        if active_only:
+            clauses.append("is_active")
+        sql = "SELECT * FROM sessions"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sessions = []
+        for row in await self._fetch(sql, params):
+            record = _row_to_record(row, SESSION_FIELDS)
+            record["user_id"] = _session_user_id(record["user_id"])
+            record["session_key"] = row["session_key"]
+            sessions.append(record)
+        return sessions
+
+    # Whole-document access
+    async def export_data(self):
+        data = default_data()
+        data["licenses"] = await self.list_licenses()
+        data["connections"] = await self.list_connections()
+        for record in await self.list_redirections():
+            uid = record.pop("user_id")
+            data["redirections"].setdefault(uid, {})[record["name"]] = record
+        rows = await self._fetch("SELECT * FROM pending_redirections")
+        data["pending_redirections"] = {row["user_id"]: _row_to_record(row, PENDING_FIELDS) for row in rows}
+        for row in await self._fetch("SELECT * FROM sections"):
+            data[row["name"]] = json.loads(row["value"])
+        return data
+
+    async def import_data(self, data, sessions):
+        await self._run(self._import, data, sessions)
+
+    @staticmethod
+    def _import(cur, data, sessions):
+        """Batched upserts of both documents in a single transaction"""
+        def upsert(table, key_columns, columns, rows):
+            # ON CONFLICT cannot touch the same row twice in one statement: keep the last duplicate
+            key_positions = [columns.index(c) for c in key_columns]
+            rows = list({tuple(row[i] for i in key_positions): row for row in rows}.values())
+            if rows:
+                psycopg2.extras.execute_values(
+                    cur, _upsert_sql(table, key_columns, columns, "%s"), rows, page_size=500
+                )
+
+        upsert("licenses", ("user_id",), LICENSE_COLUMNS, [
+            [uid] + _record_values(r, LICENSE_FIELDS) for uid, r in data.get("licenses", {}).items()
+        ])
+        upsert("connections", ("user_id", "phone"), CONNECTION_COLUMNS, [
+            [uid] + _record_values(r, CONNECTION_FIELDS, {"active": True})
+            for uid, conns in data.get("connections", {}).items() for r in conns
+        ])
+        upsert("redirections", ("user_id", "name"), REDIRECTION_COLUMNS, [
+            [uid] + _record_values(dict(r, name=name), REDIRECTION_FIELDS, {"active": True})
+            for uid, redirs in data.get("redirections", {}).items() for name, r in redirs.items()
+        ])
+        upsert("pending_redirections", ("user_id",), PENDING_COLUMNS, [
+            [uid] + _record_values(r, PENDING_FIELDS) for uid, r in data.get("pending_redirections", {}).items()
+        ])
+        upsert("sections", ("name",), ("name", "value"), [
+            (section, json.dumps(data.get(section, {}))) for section in EXTRA_SECTIONS
+        ])
+        upsert("sessions", ("session_key",), SESSION_COLUMNS, [
+            [key or session_key(r.get("user_id"), r.get("phone_number"))] + _record_values(r, SESSION_FIELDS)
+            for key, r in sessions.items()
+        ])
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        if self._pool is None:
+            return
+        try:
+            self._pool.closeall()
+        except Exception as e:
+            logger.error(f"Error closing PostgreSQL pool: {e}")
@@ -0,0 +1,248 @@
+"""
+Compact binary snapshot of the storage state
+
+Layout (little-endian):
+
+    header   magic "TFSNAP" | version u16 | body length u64 | crc32(body) u32
+    body     string table | redirection columns | session columns | JSON blob
+
+The string table is every distinct string, NUL-joined and UTF-8 encoded, so
+it decodes with a single decode() + split(). Redirections and sessions (the
+bulky sections) are stored as fixed-width int32 columns of string-table
+indexes (-1 for a missing or null field) plus a uint8 flags column. The small
+remaining sections travel as one JSON blob. The file is read through mmap and
+verified against its checksum; any mismatch raises SnapshotError so callers
+can fall back to the JSON files.
+"""
+
+import json
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+from operator import itemgetter
+
+MAGIC = b"TFSNAP"
+VERSION = 1
+HEADER = struct.Struct("<6sHQI")
+COUNT = struct.Struct("<I")
+
+REDIRECTION_COLUMNS = (
+    "user_id", "name", "phone", "channel_name", "source_id", "destination_id",
+    "created_at", "replaced_at", "updated_at", "replacement_info",
+)
+SESSION_COLUMNS = ("session_key", "phone_number", "session_file", "created_at", "last_used")
+
+# Flag bits
+ACTIVE = 1
+USER_ID_INT = 2  # session user_id was an int
+
+
+class SnapshotError(Exception):
+    """Snapshot missing, truncated, corrupted or of an unknown version"""
+
+
+class _StringTable:
+    def __init__(self):
+        self.index = {}
+        self.strings = []
+
+    def add(self, value):
+        if value is None:
+            return -1
+        value = str(value)
+        position = self.index.get(value)
+        if position is None:
+            if "\x00" in value:
+                raise SnapshotError("strings containing NUL cannot be stored in a binary snapshot")
+            position = len(self.strings)
+            self.index[value] = position
+            self.strings.append(value)
+        return position
+
+    def encode(self):
+        blob = "\x00".join(self.strings).encode("utf-8")
+        return COUNT.pack(len(self.strings)) + COUNT.pack(len(blob)) + blob
+
+
+def _pack_array(typecode, values):
+    column = array(typecode, values)
+    if sys.byteorder != "little":
+        column.byteswap()
+    return column.tobytes()
+
+
+def _unpack_array(typecode, buffer, offset, count):
+    column = array(typecode)
+    size = column.itemsize * count
+    column.frombytes(buffer[offset:offset + size])
+    if sys.byteorder != "little":
+        column.byteswap()
+    return column, offset + size
+
+
+def _resolve(strings, columns):
+    """Map columns of string-table indexes to tuples of values"""
+    resolved = []
+    for column in columns:
+        if len(column) == 0:
+            resolved.append(())
+        elif len(column) == 1:
+            resolved.append((strings[column[0]],))
+        else:
+            resolved.append(itemgetter(*column)(strings))
+    return resolved
+
+
+def _check_row(row, columns, extra):
+    """Refuse records the columnar layout would not round-trip exactly"""
+    for key, value in row.items():
+        if key in extra:
+            continue
+        if key not in columns:
+            raise SnapshotError(f"unsupported field {key!r} for a binary snapshot")
+        if value is not None and not isinstance(value, str):
+            raise SnapshotError(f"field {key!r} is not a string")
+
+
+def encode_snapshot(data, sessions):
+    """Serialize the user_data.json document and the sessions document to bytes"""
+    strings = _StringTable()
+
+    redirection_rows = [
+        dict(record, user_id=user_id, name=record.get("name", name))
+        for user_id, user_redirections in data.get("redirections", {}).items()
+        for name, record in user_redirections.items()
+    ]
+    for row in redirection_rows:
+        _check_row(row, REDIRECTION_COLUMNS, ("active",))
+    redirection_columns = [
+        [strings.add(row.get(column)) for row in redirection_rows] for column in REDIRECTION_COLUMNS
+    ]
+    redirection_flags = [ACTIVE if row.get("active", True) else 0 for row in redirection_rows]
+
+    session_rows = [dict(record, session_key=key) for key, record in sessions.items()]
+    for row in session_rows:
+        _check_row(row, SESSION_COLUMNS, ("is_active", "user_id"))
+        if row.get("user_id") is not None and not isinstance(row["user_id"], (int, str)):
+            raise SnapshotError("session user_id must be an int or a string")
+    session_columns = [[strings.add(row.get(column)) for row in session_rows] for column in SESSION_COLUMNS]
+    session_user_ids = [strings.add(row.get("user_id")) for row in session_rows]
+    session_flags = [
+        (ACTIVE if row.get("is_active") else 0) | (USER_ID_INT if isinstance(row.get("user_id"), int) else 0)
+        for row in session_rows
+    ]
+
+    rest = {key: value for key, value in data.items() if key != "redirections"}
+    rest_blob = json.dumps(rest, separators=(",", ":"), default=str).encode("utf-8")
+
+    parts = [strings.encode(), COUNT.pack(len(redirection_rows))]
+    parts.extend(_pack_array("i", column) for column in redirection_columns)
+    parts.append(_pack_array("B", redirection_flags))
+    parts.append(COUNT.pack(len(session_rows)))
+    parts.extend(_pack_array("i", column) for column in session_columns)
+    parts.append(_pack_array("i", session_user_ids))
+    parts.append(_pack_array("B", session_flags))
+    parts.append(COUNT.pack(len(rest_blob)))
+    parts.append(rest_blob)
+    body = b"".join(parts)
+    return HEADER.pack(MAGIC, VERSION, len(body), zlib.crc32(body)) + body
+
+
+def decode_snapshot(buffer):
+    """Parse bytes produced by encode_snapshot; return (data, sessions)"""
+    if len(buffer) < HEADER.size:
+        raise SnapshotError("snapshot truncated")
+    magic, version, length, checksum = HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise SnapshotError("not a TeleFeed snapshot")
+    if version != VERSION:
+        raise SnapshotError(f"unsupported snapshot version {version}")
+    view = memoryview(buffer)
+    body = view[HEADER.size:HEADER.size + length]
+    try:
+        if len(body) != length or zlib.crc32(body) != checksum:
+            raise SnapshotError("snapshot checksum mismatch")
+
+        offset = 0
+        (string_count,) = COUNT.unpack_from(body, offset)
+        (blob_size,) = COUNT.unpack_from(body, offset + 4)
+        offset += 8
+        strings = str(body[offset:offset + blob_size], "utf-8").split("\x00") if string_count else []
+        # Index -1 (missing field) resolves to None
+        strings.append(None)
+        offset += blob_size
+
+        (redirection_count,) = COUNT.unpack_from(body, offset)
+        offset += 4
+        columns = []
+        for _ in REDIRECTION_COLUMNS:
+            column, offset = _unpack_array("i", body, offset, redirection_count)
+            columns.append(column)
+        flags, offset = _unpack_array("B", body, offset, redirection_count)
+
+        redirections = {}
+        for values, flag in zip(zip(*_resolve(strings, columns)), flags):
+            record = dict(zip(REDIRECTION_COLUMNS, values))
+            if record["updated_at"] is None:
+                # Only present once a redirection has been changed
+                del record["updated_at"]
+            record["active"] = bool(flag & ACTIVE)
+            user_id = record.pop("user_id")
+            redirections.setdefault(user_id, {})[record["name"]] = record
+
+        (session_count,) = COUNT.unpack_from(body, offset)
+        offset += 4
+        columns = []
+        for _ in SESSION_COLUMNS:
+            column, offset = _unpack_array("i", body, offset, session_count)
+            columns.append(column)
+        user_ids, offset = _unpack_array("i", body, offset, session_count)
+        flags, offset = _unpack_array("B", body, offset, session_count)
+
+        sessions = {}
+        user_ids = _resolve(strings, [user_ids])[0]
+        for values, user_id, flag in zip(zip(*_resolve(strings, columns)), user_ids, flags):
+            record = dict(zip(SESSION_COLUMNS, values))
+            record["user_id"] = int(user_id) if flag & USER_ID_INT else user_id
+            record["is_active"] = bool(flag & ACTIVE)
+            sessions[record.pop("session_key")] = record
+
+        (rest_size,) = COUNT.unpack_from(body, offset)
+        offset += 4
+        data = json.loads(str(body[offset:offset + rest_size], "utf-8"))
+    except (struct.error, IndexError, ValueError, KeyError) as e:
+        raise SnapshotError(f"malformed snapshot: {e}")
+    finally:
+        # Views must be released before the mmap can be closed
+        body.release()
+        view.release()
+
+    data["redirections"] = redirections
+    return data, sessions
+
+
+def write_snapshot(path, data, sessions):
+    """Atomically write a binary snapshot"""
+    payload = encode_snapshot(data, sessions)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def read_snapshot(path):
+    """Memory-map and decode a binary snapshot; raise SnapshotError if unusable"""
+    try:
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                raise SnapshotError("snapshot is empty")
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return decode_snapshot(mm)
+    except OSError as e:
+        raise SnapshotError(f"cannot read snapshot: {e}")
@@ -0,0 +1,363 @@
+import asyncio
+import json
+import logging
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from bot.storage.base import StorageBackend, EXTRA_SECTIONS, default_data, session_key
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS licenses (
+    user_id TEXT PRIMARY KEY,
+    license TEXT,
+    validated_at TEXT,
+    active INTEGER NOT NULL DEFAULT 1
+);
+CREATE TABLE IF NOT EXISTS connections (
+    user_id TEXT NOT NULL,
+    phone TEXT NOT NULL,
+    connected_at TEXT,
+    active INTEGER NOT NULL DEFAULT 1,
+    replaced_at TEXT,
+    PRIMARY KEY (user_id, phone)
+);
+CREATE TABLE IF NOT EXISTS redirections (
+    user_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    phone TEXT,
+    channel_name TEXT,
+    source_id TEXT,
+    destination_id TEXT,
+    created_at TEXT,
+    replaced_at TEXT,
+    updated_at TEXT,
+    active INTEGER NOT NULL DEFAULT 1,
+    replacement_info TEXT,
+    PRIMARY KEY (user_id, name)
+);
+CREATE INDEX IF NOT EXISTS idx_redirections_user_phone ON redirections (user_id, phone);
+CREATE INDEX IF NOT EXISTS idx_redirections_source ON redirections (source_id);
+CREATE TABLE IF NOT EXISTS pending_redirections (
+    user_id TEXT PRIMARY KEY,
+    name TEXT,
+    phone_number TEXT,
+    created_at TEXT
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    session_key TEXT PRIMARY KEY,
+    user_id TEXT,
+    phone_number TEXT,
+    session_file TEXT,
+    is_active INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT,
+    last_used TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_active ON sessions (is_active);
+CREATE INDEX IF NOT EXISTS idx_sessions_user ON sessions (user_id);
+CREATE TABLE IF NOT EXISTS sections (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+LICENSE_FIELDS = ("license", "validated_at", "active")
+CONNECTION_FIELDS = ("phone", "connected_at", "active", "replaced_at")
+REDIRECTION_FIELDS = (
+    "name", "phone", "channel_name", "source_id", "destination_id",
+    "created_at", "replaced_at", "updated_at", "active", "replacement_info",
+)
+PENDING_FIELDS = ("name", "phone_number", "created_at")
+SESSION_FIELDS = ("user_id", "phone_number", "session_file", "is_active", "created_at", "last_used")
+BOOL_FIELDS = {"active", "is_active"}
+
+
+def _row_to_record(row, fields):
+    """Convert a sqlite3.Row into a JSON-style record, dropping NULL optionals"""
+    record = {}
+    for field in fields:
+        value = row[field]
+        if field in BOOL_FIELDS:
+            value = bool(value)
+        elif value is None and field in ("updated_at", "replacement_info"):
+            continue
+        record[field] = value
+    return record
+
+
+def _record_values(record, fields, defaults=None):
+    defaults = defaults or {}
+    values = []
+    for field in fields:
+        value = record.get(field, defaults.get(field))
+        if field in BOOL_FIELDS:
+            value = 1 if value else 0
+        values.append(value)
+    return values
+
+
+def _session_user_id(value):
+    """Session user IDs are ints in practice; keep them ints when round-tripping"""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return value
+
+
+class SQLiteBackend(StorageBackend):
+    """Backend storing each record as an indexed row in a WAL-mode SQLite database"""
+
+    name = "sqlite"
+
+    def __init__(self, path):
+        self.path = path
+        # A single worker thread owns the connection; statements never run on the event loop
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-storage")
+        self._conn = self._executor.submit(self._connect).result()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        conn.commit()
+        return conn
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _write(self, sql, params=()):
+        with self._conn:
+            return self._conn.execute(sql, params).rowcount
+
+    def _query(self, sql, params=()):
+        return self._conn.execute(sql, params).fetchall()
+
+    def is_empty(self):
+        """True if no redirections, sessions or licenses have been stored yet"""
+        def check():
+            for table in ("redirections", "sessions", "licenses", "connections"):
+                if self._query(f"SELECT 1 FROM {table} LIMIT 1"):
+                    return False
+            return True
+        return self._executor.submit(check).result()
+
+    # Licenses
+    async def put_license(self, user_id, record):
+        await self._run(
+            self._write,
+            "INSERT OR REPLACE INTO licenses (user_id, license, validated_at, active) VALUES (?, ?, ?, ?)",
+            [str(user_id)] + _record_values(record, LICENSE_FIELDS),
+        )
+
+    async def list_licenses(self):
+        rows = await self._run(self._query, "SELECT * FROM licenses")
+        return {row["user_id"]: _row_to_record(row, LICENSE_FIELDS) for row in rows}
+
+    # Connections
+    async def replace_connection(self, user_id, record):
+        # Delete + insert so the replaced connection moves to the end of the list (rowid order)
+        def replace():
+            with self._conn:
+                self._conn.execute(
+                    "DELETE FROM connections WHERE user_id = ? AND phone = ?",
+                    (str(user_id), record["phone"]),
+                )
+                self._conn.execute(
+                    "INSERT INTO connections (user_id, phone, connected_at, active, replaced_at) VALUES (?, ?, ?, ?, ?)",
+                    [str(user_id)] + _record_values(record, CONNECTION_FIELDS, {"active": True}),
+                )
+        await self._run(replace)
+
+    async def list_connections(self, user_id=None):
+        if user_id is not None:
+            rows = await self._run(
+                self._query, "SELECT * FROM connections WHERE user_id = ? ORDER BY rowid", (str(user_id),)
+            )
+            result = {str(user_id): []}
+        else:
+            rows = await self._run(self._query, "SELECT * FROM connections ORDER BY rowid")
+            result = {}
+        for row in rows:
+            result.setdefault(row["user_id"], []).append(_row_to_record(row, CONNECTION_FIELDS))
+        return result
+
+    # Redirections
+    async def put_redirection(self, user_id, name, record):
+        record = dict(record, name=name)
+        await self._run(
+            self._write,
+            f"INSERT OR REPLACE INTO redirections (user_id, {', '.join(REDIRECTION_FIELDS)}) "
+            f"VALUES (?, {', '.join('?' for _ in REDIRECTION_FIELDS)})",
+            [str(user_id)] + _record_values(record, REDIRECTION_FIELDS, {"active": True}),
+        )
+
+    async def update_redirection(self, user_id, name, fields):
+        fields = {k: v for k, v in fields.items() if k in REDIRECTION_FIELDS and k != "name"}
+        if not fields:
+            return await self.get_redirection(user_id, name) is not None
+        assignments = ", ".join(f"{k} = ?" for k in fields)
+        count = await self._run(
+            self._write,
+            f"UPDATE redirections SET {assignments} WHERE user_id = ? AND name = ?",
+            _record_values(fields, tuple(fields)) + [str(user_id), name],
+        )
+        return count > 0
+
+    async def delete_redirection(self, user_id, name):
+        count = await self._run(
+            self._write, "DELETE FROM redirections WHERE user_id = ? AND name = ?", (str(user_id), name)
+        )
+        return count > 0
+
+    async def get_redirection(self, user_id, name):
+        rows = await self._run(
+            self._query, "SELECT * FROM redirections WHERE user_id = ? AND name = ?", (str(user_id), name)
+        )
+        if not rows:
+            return None
+        return dict(_row_to_record(rows[0], REDIRECTION_FIELDS), user_id=rows[0]["user_id"])
+
+    async def list_redirections(self, user_id=None, phone=None, source_id=None, active_only=False):
+        clauses, params = [], []
+        if user_id is not None:
+            clauses.append("user_id = ?")
+            params.append(str(user_id))
+        if phone is not None:
+            clauses.append("phone = ?")
+            params.append(phone)
+        if source_id is not None:
+            clauses.append("source_id = ?")
+            params.append(source_id)
+        if active_only:
+            clauses.append("active = 1")
+        sql = "SELECT * FROM redirections"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        rows = await self._run(self._query, sql + " ORDER BY rowid", params)
+        return [dict(_row_to_record(row, REDIRECTION_FIELDS), user_id=row["user_id"]) for row in rows]
+
+    # Pending redirections
+    async def set_pending(self, user_id, record):
+        await self._run(
+            self._write,
+            "INSERT OR REPLACE INTO pending_redirections (user_id, name, phone_number, created_at) VALUES (?, ?, ?, ?)",
+            [str(user_id)] + _record_values(record, PENDING_FIELDS),
+        )
+
+    async def get_pending(self, user_id):
+        rows = await self._run(
+            self._query, "SELECT * FROM pending_redirections WHERE user_id = ?", (str(user_id),)
+        )
+        return _row_to_record(rows[0], PENDING_FIELDS) if rows else None
+
+    async def delete_pending(self, user_id):
+        count = await self._run(
+            self._write, "DELETE FROM pending_redirections WHERE user_id = ?", (str(user_id),)
+        )
+        return count > 0
+
+    # Sessions
+    async def put_session(self, key, record):
+        await self._run(
+            self._write,
+            f"INSERT OR REPLACE INTO sessions (session_key, {', '.join(SESSION_FIELDS)}) "
+            f"VALUES (?, {', '.join('?' for _ in SESSION_FIELDS)})",
+            [key] + _record_values(record, SESSION_FIELDS),
+        )
+
+    async def update_session(self, key, fields):
+        fields = {k: v for k, v in fields.items() if k in SESSION_FIELDS}
+        if not fields:
+            return False
+        assignments = ", ".join(f"{k} = ?" for k in fields)
+        count = await self._run(
+            self._write,
+            f"UPDATE sessions SET {assignments} WHERE session_key = ?",
+            _record_values(fields, tuple(fields)) + [key],
+        )
+        return count > 0
+
+    async def list_sessions(self, user_id=None, active_only=False):
+        clauses, params = [], []
+        if user_id is not None:
+            clauses.append("user_id = ?")
+            params.append(str(user_id))
+        if active_only:
+            clauses.append("is_active = 1")
+        sql = "SELECT * FROM sessions"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        rows = await self._run(self._query, sql, params)
+        sessions = []
+        for row in rows:
+            record = _row_to_record(row, SESSION_FIELDS)
+            record["user_id"] = _session_user_id(record["user_id"])
+            record["session_key"] = row["session_key"]
+            sessions.append(record)
+        return sessions
+
+    # Whole-document access
+    async def export_data(self):
+        data = default_data()
+        data["licenses"] = await self.list_licenses()
+        data["connections"] = await self.list_connections()
+        for record in await self.list_redirections():
+            uid = record.pop("user_id")
+            data["redirections"].setdefault(uid, {})[record["name"]] = record
+        rows = await self._run(self._query, "SELECT * FROM pending_redirections")
+        data["pending_redirections"] = {row["user_id"]: _row_to_record(row, PENDING_FIELDS) for row in rows}
+        for row in await self._run(self._query, "SELECT * FROM sections"):
+            data[row["name"]] = json.loads(row["value"])
+        return data
+
+    async def import_data(self, data, sessions):
+        await self._run(self._import, data, sessions)
+
+    def _import(self, data, sessions):
+        """Bulk-load both documents in a single transaction"""
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO licenses (user_id, license, validated_at, active) VALUES (?, ?, ?, ?)",
+                [[uid] + _record_values(r, LICENSE_FIELDS) for uid, r in data.get("licenses", {}).items()],
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO connections (user_id, phone, connected_at, active, replaced_at) VALUES (?, ?, ?, ?, ?)",
+                [
+                    [uid] + _record_values(r, CONNECTION_FIELDS, {"active": True})
+                    for uid, conns in data.get("connections", {}).items() for r in conns
+                ],
+            )
+            self._conn.executemany(
+                f"INSERT OR REPLACE INTO redirections (user_id, {', '.join(REDIRECTION_FIELDS)}) "
+                f"VALUES (?, {', '.join('?' for _ in REDIRECTION_FIELDS)})",
+                [
+                    [uid] + _record_values(dict(r, name=name), REDIRECTION_FIELDS, {"active": True})
+                    for uid, redirs in data.get("redirections", {}).items() for name, r in redirs.items()
+                ],
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO pending_redirections (user_id, name, phone_number, created_at) VALUES (?, ?, ?, ?)",
+                [[uid] + _record_values(r, PENDING_FIELDS) for uid, r in data.get("pending_redirections", {}).items()],
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO sections (name, value) VALUES (?, ?)",
+                [(section, json.dumps(data.get(section, {}))) for section in EXTRA_SECTIONS],
+            )
+            self._conn.executemany(
+                f"INSERT OR REPLACE INTO sessions (session_key, {', '.join(SESSION_FIELDS)}) "
+                f"VALUES (?, {', '.join('?' for _ in SESSION_FIELDS)})",
+                [
+                    [key or session_key(r.get("user_id"), r.get("phone_number"))] + _record_values(r, SESSION_FIELDS)
+                    for key, r in sessions.items()
+                ],
+            )
+
+    def close(self):
+        try:
+            self._executor.submit(self._conn.close).result()
+        except Exception as e:
+            logger.error(f"Error closing SQLite storage: {e}")
+        self._executor.shutdown(wait=True)
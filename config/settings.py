@@ -18,3 +18,63 @@ if not API_ID or not API_HASH or not BOT_TOKEN:
 # Bot Configuration
 BOT_NAME = "TeleFeed"
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+
+# Storage Configuration
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json").lower()  # json | journal | sqlite | postgres
+DATA_FILE = os.getenv("DATA_FILE", "user_data.json")
+SESSIONS_FILE = os.getenv("SESSIONS_FILE", "telegram_sessions.json")
+SQLITE_FILE = os.getenv("SQLITE_FILE", "telefeed.db")
+JOURNAL_FILE = os.getenv("JOURNAL_FILE", "user_data.journal")
+# Seconds to batch journal appends into one fsync
+JOURNAL_FSYNC_INTERVAL = float(os.getenv("JOURNAL_FSYNC_INTERVAL", "0.05"))
+# Journal size (bytes) that triggers compaction into a snapshot
+JOURNAL_COMPACT_BYTES = int(os.getenv("JOURNAL_COMPACT_BYTES", str(4 * 1024 * 1024)))
+# Journal snapshot format: json, or binary (smaller, faster cold start; JSON is still written as fallback)
+SNAPSHOT_FORMAT = os.getenv("SNAPSHOT_FORMAT", "json").lower()
+SNAPSHOT_FILE = os.getenv("SNAPSHOT_FILE", "user_data.snap")
+DATABASE_URL = os.getenv("DATABASE_URL", "")
+PG_POOL_MIN = int(os.getenv("PG_POOL_MIN", "1"))
+PG_POOL_MAX = int(os.getenv("PG_POOL_MAX", "5"))
+# Seconds to coalesce writes before flushing JSON files to disk
+DATA_FLUSH_DELAY = float(os.getenv("DATA_FLUSH_DELAY", "1.0"))
+
+# Message ID mapping (edit/delete propagation)
+MESSAGE_MAP_FILE = os.getenv("MESSAGE_MAP_FILE", "message_map.db")
+# Retention per source -> destination pair: age in seconds and entry count (0 = unlimited)
+MESSAGE_MAP_TTL = int(os.getenv("MESSAGE_MAP_TTL", str(7 * 24 * 3600)))
+MESSAGE_MAP_MAX_PER_PAIR = int(os.getenv("MESSAGE_MAP_MAX_PER_PAIR", "100000"))
+# Mappings kept in memory across all pairs (about 24 bytes each; least recently used pairs are evicted)
+MESSAGE_MAP_CACHE_SIZE = int(os.getenv("MESSAGE_MAP_CACHE_SIZE", "200000"))
+
+# Resolved chats cached per client (seconds); failed lookups are retried after the negative TTL
+ENTITY_CACHE_TTL = int(os.getenv("ENTITY_CACHE_TTL", "3600"))
+ENTITY_CACHE_NEGATIVE_TTL = int(os.getenv("ENTITY_CACHE_NEGATIVE_TTL", "300"))
+# Resolved peers (access hashes, titles) kept across restarts; refreshed after PEER_CACHE_MAX_AGE seconds
+PEER_CACHE_FILE = os.getenv("PEER_CACHE_FILE", "peer_cache.json")
+PEER_CACHE_MAX_AGE = int(os.getenv("PEER_CACHE_MAX_AGE", str(24 * 3600)))
+
+# Outbound rate limit per destination chat (messages per second and burst size)
+SEND_RATE_PER_CHAT = float(os.getenv("SEND_RATE_PER_CHAT", "1.0"))
+SEND_BURST_PER_CHAT = int(os.getenv("SEND_BURST_PER_CHAT", "3"))
+# Account-wide API budget per client (requests per second and burst size), shared by all operations
+API_RATE_PER_CLIENT = float(os.getenv("API_RATE_PER_CLIENT", "25"))
+API_BURST_PER_CLIENT = int(os.getenv("API_BURST_PER_CLIENT", "30"))
+# Seconds to collect forwards per source -> destination pair into one forward_messages call
+# (up to 100 messages); 0.05-0.2 keeps latency low, 0 disables batching
+FORWARD_COALESCE_WINDOW = float(os.getenv("FORWARD_COALESCE_WINDOW", "0.1"))
+# Seconds without a new part after which a partial album is redirected as is
+ALBUM_WAIT = float(os.getenv("ALBUM_WAIT", "1.0"))
+# Last redirected source message per source -> destination pair, for catching up after a restart
+CHECKPOINT_FILE = os.getenv("CHECKPOINT_FILE", "checkpoints.json")
+# Most recent missed messages redirected per source on catch-up (older ones are skipped)
+CATCHUP_MAX_BACKLOG = int(os.getenv("CATCHUP_MAX_BACKLOG", "500"))
+# Polling of sources for messages push updates missed: seconds between polls of an active source,
+# doubled after each quiet poll up to the maximum (POLL_MIN_INTERVAL=0 disables polling)
+POLL_MIN_INTERVAL = float(os.getenv("POLL_MIN_INTERVAL", "5"))
+POLL_MAX_INTERVAL = float(os.getenv("POLL_MAX_INTERVAL", "300"))
+# Progress of /redirection backfill jobs, resumed after a restart
+BACKFILL_FILE = os.getenv("BACKFILL_FILE", "backfill_jobs.json")
+# Redirections in flight, recorded before sending and replayed after a crash
+OUTBOX_FILE = os.getenv("OUTBOX_FILE", "outbox.journal")
+# Seconds to batch outbox appends into one fsync (added to the latency of each redirected message)
+OUTBOX_FSYNC_INTERVAL = float(os.getenv("OUTBOX_FSYNC_INTERVAL", "0.02"))
@@ -0,0 +1,10 @@
+import os
+import tempfile
+
+# config.settings exits without Telegram credentials; tests never reach Telegram
+os.environ.setdefault("API_ID", "1")
+os.environ.setdefault("API_HASH", "test")
+os.environ.setdefault("BOT_TOKEN", "test")
+
+# Engines open the message map when they are imported; keep it out of the working tree
+os.environ.setdefault("MESSAGE_MAP_FILE", os.path.join(tempfile.mkdtemp(), "message_map.db"))
@@ -0,0 +1,65 @@
+import asyncio
+from types import SimpleNamespace
+
+from telethon import types
+
+from bot import backfill, send_queue
+from bot.backfill import BackfillJobs
+from bot.connection import active_connections
+from bot.storage.message_map import MessageMap
+
+SOURCE = -1001234567890
+
+
+class FakeClient:
+    def __init__(self, history):
+        self.history = history
+        self.forwarded = []
+        self.next_id = 1000
+
+    def is_connected(self):
+        return True
+
+    async def get_messages(self, source_id, limit, offset_id=0, reverse=False, add_offset=0, offset_date=None):
+        if reverse:
+            return [message for message in self.history if message.id > offset_id][:limit]
+        return list(reversed(self.history))[add_offset:add_offset + limit]
+
+    async def forward_messages(self, destination_id, ids, from_peer=None):
+        self.forwarded.extend(ids)
+        copies = []
+        for _ in ids:
+            self.next_id += 1
+            copies.append(SimpleNamespace(id=self.next_id))
+        return copies
+
+    async def send_message(self, chat_id, text):
+        pass
+
+
+def test_backfill_skips_messages_redirected_live(tmp_path, monkeypatch):
+    monkeypatch.setattr(send_queue, "SEND_RATE_PER_CHAT", 1000)
+    monkeypatch.setattr(send_queue, "SEND_BURST_PER_CHAT", 1000)
+    message_map = MessageMap(str(tmp_path / "message_map.db"))
+    monkeypatch.setattr(backfill, "get_message_map", lambda: message_map)
+    history = [types.Message(id=i, peer_id=types.PeerChannel(1234567890), date=None, message="x") for i in range(1, 151)]
+    client = FakeClient(history)
+    monkeypatch.setitem(active_connections, 5, {'client': client})
+
+    async def scenario():
+        # Messages 121-150 were redirected live before the backfill
+        for message_id in range(121, 151):
+            await message_map.put(5, SOURCE, message_id, -200, 500 + message_id)
+        jobs = BackfillJobs(str(tmp_path / "backfill_jobs.json"), 0)
+        assert jobs.start(None, 5, "a", "123", SOURCE, -200, None)
+        while jobs.is_running(5, "a"):
+            await asyncio.sleep(0.01)
+        job = jobs.get(5, "a")
+        assert job['state'] == backfill.DONE and job['done'] == 150
+        assert client.forwarded == list(range(1, 121))
+        assert await message_map.get(5, SOURCE, 130, -200) == 630
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        message_map.close()
@@ -0,0 +1,79 @@
+import asyncio
+
+from telethon import types
+
+from bot import catchup
+from bot.catchup import CheckpointStore, fetch_since, latest_message_id, seed_checkpoint
+
+
+class FakeClient:
+    def __init__(self, message_ids, bot):
+        self.message_ids = set(message_ids)
+        self.bot = bot
+        self.calls = 0
+
+    async def is_bot(self):
+        return self.bot
+
+    async def get_messages(self, source_id, ids=None, limit=None):
+        self.calls += 1
+        if ids is not None:
+            return [types.Message(id=i, peer_id=types.PeerChannel(1), date=None, message="")
+                    if i in self.message_ids else None for i in ids]
+        return [types.Message(id=max(self.message_ids), peer_id=types.PeerChannel(1), date=None, message="")]
+
+
+def test_bot_finds_the_newest_message_despite_gaps():
+    # Deleted messages leave gaps shorter than a probe window
+    ids = [i for i in range(1, 123457) if i % 7 and not 50000 <= i < 50090]
+    client = FakeClient(ids, bot=True)
+    assert asyncio.run(latest_message_id(client, -1001234567890)) == max(ids)
+    assert client.calls < 40
+
+
+def test_bot_fetches_only_the_newest_messages_of_a_long_gap(caplog):
+    client = FakeClient(range(1, 100001), bot=True)
+    messages = asyncio.run(fetch_since(client, -1001234567890, 42, 500))
+    assert [message.id for message in messages] == list(range(99501, 100001))
+    assert client.calls < 40
+    assert "99458 messages of -1001234567890 skipped" in caplog.text
+
+
+def test_bot_fetch_since_the_newest_message_is_empty():
+    client = FakeClient(range(1, 1001), bot=True)
+    assert asyncio.run(fetch_since(client, -1001234567890, 1000, 500)) == []
+    assert client.calls == 1
+
+
+def test_seed_checkpoint_only_starts_new_routes(tmp_path, monkeypatch):
+    monkeypatch.setattr(catchup, "checkpoints", CheckpointStore(str(tmp_path / "checkpoints.json"), 0))
+    client = FakeClient(range(1, 501), bot=False)
+
+    asyncio.run(seed_checkpoint(client, 5, -1001234567890, -200))
+    assert catchup.checkpoints.get(5, -1001234567890, -200) == 500
+
+    catchup.checkpoints.advance(5, -1001234567890, -300, 42)
+    asyncio.run(seed_checkpoint(client, 5, -1001234567890, -300))
+    assert catchup.checkpoints.get(5, -1001234567890, -300) == 42
+
+
+def test_one_catch_up_per_account(monkeypatch):
+    started = []
+
+    async def fake_catch_up(client, scope, routes, on_message, on_album):
+        started.append(scope)
+        await asyncio.sleep(0.01)
+
+    monkeypatch.setattr(catchup, "catch_up", fake_catch_up)
+
+    async def scenario():
+        catch_ups = catchup.CatchUps()
+        assert catch_ups.start(None, 5, [], None, None)
+        assert not catch_ups.start(None, 5, [], None, None)  # Session restore, then redirection setup
+        assert catch_ups.start(None, 6, [], None, None)
+        await asyncio.sleep(0.05)
+        assert catch_ups.start(None, 5, [], None, None)  # Reconnection after the first one finished
+        await asyncio.sleep(0.05)
+
+    asyncio.run(scenario())
+    assert started == [5, 6, 5]
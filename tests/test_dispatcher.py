@@ -0,0 +1,55 @@
+import asyncio
+from types import SimpleNamespace
+
+from bot import dispatcher as dispatcher_module
+from bot.dispatcher import ClientDispatcher
+
+CHANNEL = -1001234567890
+
+
+class FakeClient:
+    def add_event_handler(self, callback, builder):
+        pass
+
+    def remove_event_handler(self, callback):
+        pass
+
+    def is_connected(self):
+        return True
+
+
+def make_dispatcher(name, delivered):
+    async def on_message(event, routes, is_edit):
+        delivered.append((name, event.message.id))
+
+    dispatcher = ClientDispatcher(FakeClient(), on_message)
+    dispatcher.add_route(CHANNEL, {'owner': name, 'source_id': CHANNEL, 'destination_id': -200})
+    return dispatcher
+
+
+def update(message_id):
+    return SimpleNamespace(chat_id=CHANNEL, message=SimpleNamespace(id=message_id, grouped_id=None))
+
+
+def test_shared_channel_is_handled_by_the_receiving_account(monkeypatch):
+    async def scenario():
+        delivered = []
+        a, b = make_dispatcher("a", delivered), make_dispatcher("b", delivered)
+        try:
+            # Only B gets the channel's updates: it becomes the listener and delivers to both
+            await b._on_new_message(update(1))
+            assert sorted(delivered) == [("a", 1), ("b", 1)]
+
+            # A receiving the same update later drops it
+            await a._on_new_message(update(1))
+            assert len(delivered) == 2
+
+            # B stops receiving updates: A takes over once B is stale
+            monkeypatch.setattr(dispatcher_module, "LISTENER_STALE_AFTER", 0)
+            await a._on_new_message(update(2))
+            assert sorted(delivered[2:]) == [("a", 2), ("b", 2)]
+        finally:
+            a.close()
+            b.close()
+
+    asyncio.run(scenario())
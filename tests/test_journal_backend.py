@@ -0,0 +1,24 @@
+import asyncio
+
+from bot.storage.journal_backend import JournalBackend
+
+
+def open_backend(tmp_path):
+    return JournalBackend(str(tmp_path / "user_data.json"), str(tmp_path / "sessions.json"),
+                          str(tmp_path / "user_data.journal"), fsync_interval=0)
+
+
+def test_append_after_torn_entry_survives_the_next_restart(tmp_path):
+    backend = open_backend(tmp_path)
+    asyncio.run(backend.put_license(1, {'active': True}))
+    backend.flush()
+    # Crash in the middle of an append: the last entry has no newline
+    with open(tmp_path / "user_data.journal", 'a', encoding='utf-8') as f:
+        f.write('{"op":"put_license","args":')
+
+    backend = open_backend(tmp_path)
+    asyncio.run(backend.put_license(2, {'active': True}))
+    backend.flush()
+
+    licenses = asyncio.run(open_backend(tmp_path).list_licenses())
+    assert set(map(str, licenses)) == {"1", "2"}
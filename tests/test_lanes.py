@@ -0,0 +1,40 @@
+import asyncio
+
+from bot import lanes as lanes_module
+from bot.lanes import OrderedLanes
+
+KEY = (5, -1001234567890, -200)
+
+
+def test_turn_waits_for_earlier_messages():
+    async def scenario():
+        lanes = OrderedLanes()
+        for message_id in (1, 2):
+            lanes.enter(KEY, message_id)
+        second = asyncio.ensure_future(lanes.turn(KEY, 2))
+        await asyncio.sleep(0.01)
+        assert not second.done()
+        lanes.leave(KEY, 1)
+        await asyncio.wait_for(second, 1)
+        lanes.leave(KEY, 2)
+        assert lanes.stats() == {'lanes': 0, 'waiting': 0}
+
+    asyncio.run(scenario())
+
+
+def test_timeout_does_not_cancel_other_waiters(monkeypatch):
+    async def scenario():
+        lanes = OrderedLanes()
+        for message_id in (1, 2, 3):
+            lanes.enter(KEY, message_id)
+        second = asyncio.ensure_future(lanes.turn(KEY, 2))
+        await asyncio.sleep(0.01)  # 2 waits for 1 with the default timeout
+
+        monkeypatch.setattr(lanes_module, "LANE_MAX_WAIT", 0.05)
+        await lanes.turn(KEY, 3)  # Times out waiting for 1 and 2
+
+        assert not second.done()
+        lanes.leave(KEY, 1)
+        await asyncio.wait_for(second, 1)  # Raises CancelledError if the timeout cancelled 1's future
+
+    asyncio.run(scenario())
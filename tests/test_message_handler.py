@@ -0,0 +1,43 @@
+import asyncio
+from types import SimpleNamespace
+
+from bot.connection import active_connections
+from bot.lanes import lanes
+from bot.message_handler import message_redirector
+
+SOURCE = -1001234567890
+
+
+class FakeClient:
+    def is_connected(self):
+        return True
+
+    async def edit_message(self, chat, message_id, text, formatting_entities=None):
+        raise RuntimeError("message to edit not found")
+
+    async def send_message(self, chat, text, formatting_entities=None):
+        return SimpleNamespace(id=400)
+
+
+def event(message_id, text):
+    return SimpleNamespace(chat_id=SOURCE, message=SimpleNamespace(
+        id=message_id, grouped_id=None, raw_text=text, entities=None, media=None
+    ))
+
+
+def test_edit_does_not_free_the_lane_slot_of_a_waiting_message():
+    key = (5, SOURCE, -200)
+
+    async def scenario():
+        active_connections[5] = {'client': FakeClient()}
+        await message_redirector.message_map.put(5, SOURCE, 60, -200, 300)
+        lanes.enter(key, 60)  # The live message 60 is still on its way
+        # Its edit fails to edit the copy and sends a new message instead
+        await message_redirector._handle_message_redirection(event(60, "edited"), -200, "a", 5, is_edit=True, lane=key)
+        assert lanes.stats() == {'lanes': 1, 'waiting': 1}
+        lanes.leave(key, 60)
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        active_connections.pop(5, None)
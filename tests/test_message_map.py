@@ -0,0 +1,36 @@
+import asyncio
+
+from bot.storage.message_map import MessageMap
+
+
+def test_hot_tier_is_bounded_across_pairs(tmp_path):
+    message_map = MessageMap(str(tmp_path / "message_map.db"), cache_size=100)
+
+    async def scenario():
+        for destination in range(-200, -210, -1):
+            for message_id in range(1, 31):
+                await message_map.put(5, -1001234567890, message_id, destination, 1000 + message_id)
+        assert message_map._cached <= 100
+        assert sum(len(pair) for pair in message_map._pairs.values()) == message_map._cached
+        # Evicted pairs are still read from disk
+        message_map.flush()
+        assert await message_map.get(5, -1001234567890, 7, -200) == 1007
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        message_map.close()
+
+
+def test_single_pair_is_trimmed_to_the_bound(tmp_path):
+    message_map = MessageMap(str(tmp_path / "message_map.db"), cache_size=100)
+
+    async def scenario():
+        for message_id in range(1, 251):
+            await message_map.put(5, -1001234567890, message_id, -200, 1000 + message_id)
+        assert 0 < message_map._cached <= 100
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        message_map.close()
@@ -0,0 +1,107 @@
+import asyncio
+
+from telethon import types
+
+from bot import catchup
+from bot.catchup import replay_outbox
+from bot.outbox import MAX_ATTEMPTS, Outbox
+from bot.storage.message_map import MessageMap
+
+SOURCE = -1001234567890
+
+
+def test_done_marks_restore_mappings_lost_in_a_crash(tmp_path, monkeypatch):
+    path = str(tmp_path / "outbox.journal")
+
+    async def before_crash():
+        outbox = Outbox(path, fsync_interval=0)
+        await outbox.record(5, SOURCE, [10, 11], -200)
+        outbox.complete(5, SOURCE, 10, -200, [100, None])
+        await outbox.record(5, SOURCE, [12], -200)
+        outbox.complete(5, SOURCE, 12, -200)  # Send failed: nothing to restore
+        outbox.close()
+    asyncio.run(before_crash())
+
+    # The message map never wrote the mapping to disk
+    outbox = Outbox(path, fsync_interval=0)
+    message_map = MessageMap(str(tmp_path / "message_map.db"))
+    monkeypatch.setattr(catchup, "outbox", outbox)
+    monkeypatch.setattr(catchup, "get_message_map", lambda: message_map)
+
+    async def after_restart():
+        assert await replay_outbox(None, 5, [], None, None) == 0
+        assert await message_map.get(5, SOURCE, 10, -200) == 100
+        assert await message_map.get(5, SOURCE, 11, -200) is None
+    try:
+        asyncio.run(after_restart())
+        assert outbox.take_copies(5) == []  # Restored once
+        assert outbox.stats() == {'pending': 0, 'recovered': 0}
+    finally:
+        outbox.close()
+        message_map.close()
+
+
+def test_pending_intent_survives_a_restart(tmp_path):
+    path = str(tmp_path / "outbox.journal")
+
+    async def before_crash():
+        outbox = Outbox(path, fsync_interval=0)
+        await outbox.record(5, SOURCE, [20], -200)
+    asyncio.run(before_crash())
+
+    outbox = Outbox(path, fsync_interval=0)
+    intents = outbox.take_recovered(5)
+    assert [(intent['source'], intent['ids'], intent['destination']) for intent in intents] == [(SOURCE, [20], -200)]
+    assert outbox.take_recovered(5) == []
+
+
+def test_failed_send_stays_pending_until_a_replay_sends_it(tmp_path, monkeypatch):
+    outbox = Outbox(str(tmp_path / "outbox.journal"), fsync_interval=0)
+    message_map = MessageMap(str(tmp_path / "message_map.db"))
+    monkeypatch.setattr(catchup, "outbox", outbox)
+    monkeypatch.setattr(catchup, "get_message_map", lambda: message_map)
+    route = {'source_id': SOURCE, 'destination_id': -200}
+    attempts = []
+
+    class Client:
+        async def get_messages(self, source_id, ids):
+            return [types.Message(id=i, peer_id=types.PeerChannel(1234567890), date=None, message="x") for i in ids]
+
+    async def on_message(event, routes, is_edit, priority):
+        # Stands in for an engine: the first replay fails again, the second one sends
+        await outbox.record(5, event.chat_id, [event.message.id], -200)
+        attempts.append(event.message.id)
+        if len(attempts) == 1:
+            outbox.retry(5, event.chat_id, event.message.id, -200)
+        else:
+            outbox.complete(5, event.chat_id, event.message.id, -200, [300])
+
+    async def scenario():
+        await outbox.record(5, SOURCE, [30], -200)
+        outbox.retry(5, SOURCE, 30, -200)  # The live send raised
+        assert await replay_outbox(Client(), 5, [route], on_message, None) == 1
+        assert outbox.stats() == {'pending': 1, 'recovered': 1}
+        assert await replay_outbox(Client(), 5, [route], on_message, None) == 1
+        assert outbox.stats() == {'pending': 0, 'recovered': 0}
+    try:
+        asyncio.run(scenario())
+        assert attempts == [30, 30]
+    finally:
+        outbox.close()
+        message_map.close()
+
+
+def test_intent_is_given_up_after_max_attempts(tmp_path):
+    path = str(tmp_path / "outbox.journal")
+
+    async def scenario():
+        outbox = Outbox(path, fsync_interval=0)
+        await outbox.record(5, SOURCE, [40], -200)
+        for _ in range(MAX_ATTEMPTS - 1):
+            outbox.retry(5, SOURCE, 40, -200)
+            assert [intent['ids'] for intent in outbox.take_recovered(5)] == [[40]]
+        outbox.retry(5, SOURCE, 40, -200)
+        assert outbox.stats() == {'pending': 0, 'recovered': 0}
+        outbox.close()
+    asyncio.run(scenario())
+    assert Outbox(path, fsync_interval=0).pending == {}  # Not retried at the next start either
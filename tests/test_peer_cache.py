@@ -0,0 +1,28 @@
+import asyncio
+import time
+
+from telethon import types
+from telethon.sessions import MemorySession
+
+from bot.peer_cache import PeerCache, PeerInfo
+
+
+class FakeClient:
+    def __init__(self):
+        self.session = MemorySession()
+
+    async def is_bot(self):
+        return False
+
+
+def test_warm_entries_reach_the_session(tmp_path):
+    cache = PeerCache(str(tmp_path / "peer_cache.json"), flush_delay=0)
+    cache.put(5, PeerInfo(-1001234567890, "channel", 987654321, "Source", time.time()))
+    cache.put(5, PeerInfo(-4242, "chat", None, "Group", time.time()))
+    client = FakeClient()
+
+    resolved = asyncio.run(cache.resolve(client, 5, [-1001234567890, -4242]))
+
+    assert set(resolved) == {-1001234567890, -4242}
+    assert client.session.get_input_entity(-1001234567890) == types.InputPeerChannel(1234567890, 987654321)
+    assert client.session.get_input_entity(-4242) == types.InputPeerChat(4242)
@@ -0,0 +1,53 @@
+import asyncio
+
+from telethon import types
+
+from bot import catchup, poller
+from bot.catchup import CheckpointStore
+from bot.outbox import Outbox
+from bot.poller import SourcePoller
+from bot.storage.message_map import MessageMap
+
+SOURCE = -1001234567890
+
+
+class FakeClient:
+    def is_connected(self):
+        return True
+
+    async def get_messages(self, source_id, ids):
+        return [types.Message(id=i, peer_id=types.PeerChannel(1234567890), date=None, message="x") for i in ids]
+
+
+def test_poller_retries_a_send_that_failed_behind_the_checkpoint(tmp_path, monkeypatch):
+    outbox = Outbox(str(tmp_path / "outbox.journal"), fsync_interval=0)
+    message_map = MessageMap(str(tmp_path / "message_map.db"))
+    monkeypatch.setattr(catchup, "outbox", outbox)
+    monkeypatch.setattr(catchup, "get_message_map", lambda: message_map)
+    monkeypatch.setattr(poller, "checkpoints", CheckpointStore(str(tmp_path / "checkpoints.json"), 0))
+    monkeypatch.setattr(poller, "RETRY_INTERVAL", 0)
+    routes = [{'source_id': SOURCE, 'destination_id': -200}]
+    sent = []
+
+    async def on_message(event, routes, is_edit, priority):
+        sent.append(event.message.id)
+        outbox.complete(5, event.chat_id, event.message.id, -200, [300])
+
+    async def scenario():
+        # Message 50 failed, 51 was sent: the checkpoint is past 50
+        await outbox.record(5, SOURCE, [50], -200)
+        outbox.retry(5, SOURCE, 50, -200)
+        poller.checkpoints.advance(5, SOURCE, -200, 51)
+        source_poller = SourcePoller(FakeClient(), 5, lambda: routes, on_message, None)
+        source_poller.sources[SOURCE] = {'interval': 60, 'due': float('inf'), 'seen': 51}
+        source_poller.start()
+        await asyncio.sleep(0.1)
+        source_poller.stop()
+        assert sent == [50]
+        assert source_poller.recovered == 1
+    try:
+        asyncio.run(scenario())
+        assert outbox.stats() == {'pending': 0, 'recovered': 0}
+    finally:
+        outbox.close()
+        message_map.close()
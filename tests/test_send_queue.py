@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+from telethon import errors
+
+from bot import send_queue
+from bot.scheduler import TokenBucket
+from bot.send_queue import SendQueue, SendQueues
+
+
+class FakeClient:
+    pass
+
+
+def test_worker_exits_when_idle(monkeypatch):
+    monkeypatch.setattr(send_queue, "IDLE_TIMEOUT", 0.05)
+
+    async def scenario():
+        client = FakeClient()  # Queues only keep a weak reference
+        queue = SendQueue(client, -200)
+        assert await queue.submit(lambda: asyncio.sleep(0, result=1)) == 1
+        first = queue.worker
+        await asyncio.sleep(0.1)
+        assert first.done()
+        assert await queue.submit(lambda: asyncio.sleep(0, result=2)) == 2  # A new worker is started
+        assert queue.worker is not first
+
+    asyncio.run(scenario())
+
+
+def test_flood_waits_are_retried_a_bounded_number_of_times(monkeypatch):
+    monkeypatch.setattr(send_queue, "MAX_FLOOD_RETRIES", 2)
+    calls = []
+
+    async def flooded():
+        calls.append(None)
+        raise errors.FloodWaitError(request=None, capture=0)
+
+    async def scenario():
+        client = FakeClient()  # Queues only keep a weak reference
+        queue = SendQueue(client, -200)
+        queue.bucket = TokenBucket(1000, 1000)
+        with pytest.raises(errors.FloodWaitError):
+            await queue.submit(flooded)
+
+    asyncio.run(scenario())
+    assert len(calls) == 3
+
+
+def test_close_stops_workers_and_cancels_queued_calls():
+    async def scenario():
+        client = FakeClient()
+        queues = SendQueues()
+        started = asyncio.Event()
+
+        async def slow():
+            started.set()
+            await asyncio.sleep(10)
+
+        running = queues.enqueue(client, -200, slow)
+        waiting = queues.enqueue(client, -200, slow)
+        await started.wait()
+        await queues.close()
+        assert waiting.cancelled()
+        worker = queues._queue(client, -200).worker
+        assert worker is None
+        assert not [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        running.cancel()
+
+    asyncio.run(scenario())